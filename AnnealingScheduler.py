@@ -0,0 +1,490 @@
+"""
+This script schedules procedures by simulated annealing, as an alternative to the greedy
+packing of Optimization_Version2.py that can be given more time for a better schedule.
+
+Each chain of the annealing starts from the greedy schedule and tries random moves, keeping
+every move that makes the schedule better and, with a chance that falls as the temperature
+is lowered, moves that make it worse. A schedule is scored by the weighted sum of:
+    overflowMinutes - procedure minutes left in overflow
+    crossovers - procedures booked in the other lab (cathToEP and epToCath, leaving out
+                 the middle rooms)
+    overCapMinutes - minutes booked in room days past closeCap
+    holdingBayPeak - the peak holding bay occupancy of each day, summed over the days
+
+Notes about use:
+- The moves are those of TimePeriod.improveSchedule (book a procedure in overflow, move the
+    last procedure of a room day to another, swap the last procedures of two room days),
+    and moving the last procedure of a room day to overflow. Procedures stay within the
+    windows, labs and rooms the greedy packing may book them in (see getPlacementWindow),
+    room days within totalTimeRoom, and stays within the holding bay's hours. closeCap is
+    not a hard limit as in the greedy packing, but is weighed by overCapMinutes.
+
+- The temperature falls geometrically from the initial to the final temperature over the
+    time budget, so a run can be given as much time as there is, and a shorter run gives a
+    coarser schedule sooner.
+
+- Every checkpointSeconds, each chain goes back to the best schedule it has found, saves it
+    to the checkpoint folder, and goes on from there. The checkpoints are in the result
+    cache format (see saveResultCache in Optimization_Version2.py), named after the data, the
+    settings, the objective weights and the cooling schedule, so a run that is stopped leaves
+    its best schedules behind, and with resume set, a run of the same annealing on the same
+    data and settings starts its chains from them.
+
+- The chains run side by side in a pool of worker processes, each with its own seed, and the
+    best schedule of all the chains is kept.
+"""
+import csv
+import os
+import hashlib
+import math
+import time
+import array
+import random
+import multiprocessing
+
+from Optimization_Version2 import makeConfig, readData, cleanProcTimes, runScheduler, TimePeriod, ProcedureTable,\
+     getResultCacheName, saveResultCache, readResultCache, printOutputStatistics, saveAssignmentResults, saveHoldingBayResults,\
+     holdingBaySettings
+
+
+######################################################################################################
+######################################################################################################
+############################################ ANNEALING CHAIN #########################################
+######################################################################################################
+######################################################################################################
+
+objectiveTerms = ['overflowMinutes','crossovers','overCapMinutes','holdingBayPeak']
+
+# entries of the undo log since the best schedule, past which a chain goes back to it early
+maxUndoEntries = 1000000
+
+class AnnealingChain:
+    '''
+    Class to run one chain of simulated annealing on a packed time period.
+
+    Initialization:
+        AnnealingChain(timePeriod,weights,seed)
+            timePeriod - a packed TimePeriod, whose schedule the chain changes in place
+            weights - dictionary of the weight of each of objectiveTerms
+            seed - seed of the chain's random moves
+
+    Fields:
+        terms - value of each of objectiveTerms for the current schedule
+        objective - weighted sum of the terms
+        bestObjective - objective of the best schedule found. The changes made since it was
+                        found are kept in the time period's undo log (see
+                        TimePeriod.checkpoint), so the chain can go back to it.
+    '''
+
+    def __init__(self,timePeriod,weights,seed):
+        self.timePeriod = timePeriod
+        self.weights = [weights[name] for name in objectiveTerms]
+        timePeriod.random = random.Random(seed)
+        timePeriod.roomHeaps = {}           # not used by the moves, and searched on every rollback
+        self.windows = {}
+        self.recompute()
+        self.bestObjective = self.objective
+        self.savedObjective = None
+        self.marker = timePeriod.checkpoint()
+
+    def recompute(self):
+        '''
+        Works out the holding bay occupancy and the objective terms from the time period.
+        Returns: none
+        '''
+        tp = self.timePeriod
+        config = tp.config
+        procTimes = tp.procedures.columns[config.iProcTime]
+        numSlots = tp.numSlots
+        self.occupancy = array.array('i',tp.getHoldingBayMatrix())
+        self.dayPeaks = [max(self.occupancy[d*numSlots:(d+1)*numSlots]) for d in xrange(tp.numDays)]
+        self.terms = [sum(procTimes[procID] for procID in tp.overflowOrder),
+                      sum(self.isCrossover(procID,tp.assignments[procID]) for procID in tp.procsPlacedData),
+                      sum(max(0.0,load-config.closeCap) for load in tp.roomLoads),
+                      sum(self.dayPeaks)]
+        self.objective = self.getObjective(self.terms)
+
+    def getObjective(self,terms):
+        return sum(weight*term for weight,term in zip(self.weights,terms))
+
+    def isCrossover(self,procID,index):
+        '''
+        Input: procID (ID of a procedure), index (room day index it is booked in)
+        Returns: True if the room day is in the other lab (Cath or EP) than the procedure's
+        '''
+        tp = self.timePeriod
+        roomLab = tp.roomLabs[index%tp.roomsPerDay]
+        return roomLab != tp.config.middleID and roomLab != tp.procedures.columns[tp.config.iLab][procID]
+
+    def getOverflowEntry(self,procID):
+        '''
+        Input: procID (ID of a procedure)
+        Returns: (overflow day, day or week, True if day) the greedy packing records for the
+                    procedure when it cannot be placed (see tryPlaceProc)
+        '''
+        tp = self.timePeriod
+        firstDay = tp.getWindow(procID,self.windows)[0]
+        if tp.procedures.columns[tp.config.iSchedHorizon][procID] == 3.0:
+            return (firstDay,firstDay/5,False)
+        return (firstDay,firstDay,True)
+
+    ########################################## MOVES ##########################################
+
+    def getInsertMove(self,procID):
+        '''
+        Each get...Move method gives a move as (operations, new room loads by room day
+        index, change in overflow minutes, change in crossovers, holding bay stays) or None
+        if the move drawn is not possible.
+        Input: procID (ID of a procedure in overflow)
+        '''
+        tp = self.timePeriod
+        duration = tp.procedures.columns[tp.config.iProcTime][procID]
+        target = tp.pickWindowRoom(tp.getWindow(procID,self.windows))
+        if target is None or tp.roomLoads[target]+duration > tp.config.totalTimeRoom:
+            return None
+        load = tp.roomLoads[target]+duration
+        return ([('book',procID,target)],{target:load},-duration,self.isCrossover(procID,target),
+                [tp.getStayChanges(procID,target,load-duration,1)])
+
+    def getRelocateMove(self,index,toOverflow):
+        '''
+        Input: index (room day index with procedures booked)
+                toOverflow (True to move its last procedure to overflow, False to another room day)
+        '''
+        tp = self.timePeriod
+        procID = tp.roomSequences[index][-1]
+        duration = tp.procedures.columns[tp.config.iProcTime][procID]
+        loadBefore = tp.getLoadBeforeTail(index)
+        removal = tp.getStayChanges(procID,index,tp.roomLoads[index]-duration,-1)
+        if toOverflow:
+            return ([('pop',index),('overflow',procID)],{index:loadBefore},duration,-self.isCrossover(procID,index),[removal])
+        target = tp.pickWindowRoom(tp.getWindow(procID,self.windows))
+        if target is None or target == index or tp.roomLoads[target]+duration > tp.config.totalTimeRoom:
+            return None
+        load = tp.roomLoads[target]+duration
+        return ([('pop',index),('append',procID,target)],{index:loadBefore,target:load},0,
+                self.isCrossover(procID,target)-self.isCrossover(procID,index),
+                [removal,tp.getStayChanges(procID,target,load-duration,1)])
+
+    def getSwapMove(self,index):
+        '''
+        Input: index (room day index with procedures booked)
+        '''
+        tp = self.timePeriod
+        procTimes = tp.procedures.columns[tp.config.iProcTime]
+        procID = tp.roomSequences[index][-1]
+        target = tp.pickWindowRoom(tp.getWindow(procID,self.windows))
+        if target is None or target == index or not tp.roomSequences[target]:
+            return None
+        other = tp.roomSequences[target][-1]
+        if not tp.isWindowRoom(tp.getWindow(other,self.windows),index):
+            return None
+        duration,otherDuration = procTimes[procID],procTimes[other]
+        load = tp.getLoadBeforeTail(index)+otherDuration
+        targetLoad = tp.getLoadBeforeTail(target)+duration
+        if load > tp.config.totalTimeRoom or targetLoad > tp.config.totalTimeRoom:
+            return None
+        crossovers = self.isCrossover(procID,target)+self.isCrossover(other,index)-self.isCrossover(procID,index)-self.isCrossover(other,target)
+        return ([('pop',index),('pop',target),('append',procID,target),('append',other,index)],{index:load,target:targetLoad},0,crossovers,
+                [tp.getStayChanges(procID,index,tp.roomLoads[index]-duration,-1),
+                 tp.getStayChanges(other,target,tp.roomLoads[target]-otherDuration,-1),
+                 tp.getStayChanges(procID,target,targetLoad-duration,1),
+                 tp.getStayChanges(other,index,load-otherDuration,1)])
+
+    def getNewPeaks(self,changes):
+        '''
+        Input: changes (list of holding bay stays, as given by getStayChanges)
+        Returns: (the new peak of each day the stays fall on, the change in occupancy by
+                    occupancy index)
+        '''
+        slotsPerDay = self.timePeriod.numSlots
+        occupancy = self.occupancy
+        slotChanges = {}
+        for day,firstSlot,numSlots,count in changes:
+            start = day*slotsPerDay+firstSlot
+            for i in xrange(start,start+numSlots):
+                slotChanges[i] = slotChanges.get(i,0)+count
+        changedPeaks = {}
+        for i,count in slotChanges.iteritems():
+            day = i/slotsPerDay
+            changedPeaks[day] = max(changedPeaks.get(day,0),occupancy[i]+count)
+        peaks = {}
+        for day,peak in changedPeaks.iteritems():
+            # a slot at the day's peak may have gone down: the unchanged slots are looked at too
+            if peak < self.dayPeaks[day]:
+                for i in xrange(day*slotsPerDay,(day+1)*slotsPerDay):
+                    if occupancy[i] > peak and i not in slotChanges:
+                        peak = occupancy[i]
+            peaks[day] = peak
+        return (peaks,slotChanges)
+
+    def tryMove(self,temperature):
+        '''
+        Draws a move at random and makes it if it makes the objective better, or with
+        probability exp(-increase/temperature) if it makes it worse.
+        Input: temperature (current temperature of the annealing)
+        Returns: True if the move was made
+        '''
+        tp = self.timePeriod
+        closeCap = tp.config.closeCap
+        draw = tp.random.random()
+        if tp.overflowOrder and draw < 1.0/3:
+            move = self.getInsertMove(tp.overflowOrder[tp.random.randrange(len(tp.overflowOrder))])
+        elif tp.procsPlacedData:
+            index = tp.assignments[tp.procsPlacedData[tp.random.randrange(len(tp.procsPlacedData))]]
+            if draw < 0.4:
+                move = self.getRelocateMove(index,True)
+            elif draw < 0.7:
+                move = self.getRelocateMove(index,False)
+            else:
+                move = self.getSwapMove(index)
+        else:
+            return False
+        if move is None:
+            return False
+        operations,loads,overflowMinutes,crossovers,stays = move
+        if None in stays:           # a stay outside of the holding bay's hours
+            return False
+
+        peaks,slotChanges = self.getNewPeaks(sum(stays,[]))
+        deltas = [overflowMinutes,crossovers,
+                  sum(max(0.0,load-closeCap)-max(0.0,tp.roomLoads[index]-closeCap) for index,load in loads.iteritems()),
+                  sum(peak-self.dayPeaks[day] for day,peak in peaks.iteritems())]
+        delta = self.getObjective(deltas)
+        if delta > 0 and tp.random.random() >= math.exp(-delta/temperature):
+            return False
+
+        for operation in operations:
+            if operation[0] == 'pop':
+                tp.popRoomTail(operation[1])
+            elif operation[0] == 'append':
+                tp.appendToRoom(operation[1],operation[2])
+            elif operation[0] == 'book':
+                tp.removeFromOverflow(operation[1])
+                tp.bookRoom(operation[1],operation[2])
+            else:
+                self.sendToOverflow(operation[1])
+        for i,count in slotChanges.iteritems():
+            self.occupancy[i] += count
+        for day,peak in peaks.iteritems():
+            self.dayPeaks[day] = peak
+        self.terms = [term+change for term,change in zip(self.terms,deltas)]
+        self.objective += delta
+
+        # a new best schedule: start a new undo log from it
+        if self.objective < self.bestObjective-1e-6:
+            self.bestObjective = self.objective
+            tp.commit(self.marker)
+            self.marker = tp.checkpoint()
+        return True
+
+    def sendToOverflow(self,procID):
+        '''
+        Input: procID (ID of a procedure taken out of its room day by popRoomTail)
+        Returns: none
+        '''
+        tp = self.timePeriod
+        tp.setLogged(tp.__dict__,'procsPlaced',tp.procsPlaced-1)
+        tp.removeLogged(tp.procsPlacedData,procID)
+        overflowDay,dayOrWeek,day = self.getOverflowEntry(procID)
+        tp.addToOverflow(procID,overflowDay)
+        tp.updateOverflowStats(procID,dayOrWeek,day)
+
+    ########################################## RUNNING ##########################################
+
+    def returnToBest(self,checkpointName=None):
+        '''
+        Undoes the changes made since the best schedule was found, and saves the best
+        schedule to checkpointName if given and not saved yet.
+        Returns: none
+        '''
+        tp = self.timePeriod
+        tp.rollback(self.marker)
+        self.recompute()
+        self.bestObjective = self.objective
+        self.marker = tp.checkpoint()
+        if checkpointName is not None and self.savedObjective != self.bestObjective:
+            saveResultCache(tp,checkpointName)
+            self.savedObjective = self.bestObjective
+
+    def run(self,seconds,initialTemperature,finalTemperature,checkpointSeconds=None,checkpointName=None):
+        '''
+        Input: seconds (time budget of the chain)
+                initialTemperature, finalTemperature (temperatures at the start and at the
+                                                      end of the time budget)
+                checkpointSeconds, checkpointName (optional: how often to save the best
+                                                   schedule, and the name of the file to)
+        Returns: the number of moves made. The time period is left with the best schedule found.
+        '''
+        tp = self.timePeriod
+        startTime = time.time()
+        nextCheckpoint = startTime+checkpointSeconds if checkpointSeconds else None
+        numTried = 0
+        numMade = 0
+        while True:
+            if numTried%64 == 0:
+                now = time.time()
+                if now >= startTime+seconds:
+                    break
+                if len(tp.undoLog) > maxUndoEntries or (nextCheckpoint is not None and now >= nextCheckpoint):
+                    self.returnToBest(checkpointName)
+                    if nextCheckpoint is not None:
+                        nextCheckpoint = now+checkpointSeconds
+                temperature = initialTemperature*(finalTemperature/initialTemperature)**((now-startTime)/seconds)
+            numTried += 1
+            numMade += self.tryMove(temperature)
+        self.returnToBest(checkpointName)
+        tp.commit(self.marker)
+        return numMade
+
+
+######################################################################################################
+######################################################################################################
+########################################## PARALLEL CHAINS ###########################################
+######################################################################################################
+######################################################################################################
+
+def getCheckpointName(procedures,config,weights,seconds,temperatures,folder,chain):
+    '''
+    Input: procedures, config (as for runScheduler)
+            weights, seconds, temperatures (as for runAnnealing)
+            folder (folder of the checkpoints), chain (number of the chain)
+    Returns: the name of the chain's checkpoint, after the data and settings of the run, the
+                weights and the cooling schedule. The holding bay settings are always part
+                of it, as holdingBayPeak is weighed even when the packing leaves them out.
+    '''
+    cacheName = getResultCacheName(procedures,config._replace(resultCache=folder))
+    settings = [(name,getattr(config,name)) for name in holdingBaySettings]
+    settings.append([weights[name] for name in objectiveTerms])
+    settings.append((seconds,tuple(temperatures)))
+    digest = hashlib.sha1(os.path.basename(cacheName))
+    digest.update(repr(settings))
+    return os.path.join(folder,digest.hexdigest()+'_chain'+str(chain)+'.bin')
+
+def runChain(task):
+    '''
+    Runs one chain. Run in the worker processes.
+
+    Input: task (a (procedure columns, config, weights, seed, seconds, temperatures,
+                 checkpointSeconds, checkpoint name, resume) tuple, as made by runAnnealing)
+    Returns: a (seed, objective, terms, moves made, room state) tuple, the room state of the
+                chain's best schedule as given by TimePeriod.getRoomState
+    '''
+    columns,config,weights,seed,seconds,temperatures,checkpointSeconds,checkpointName,resume = task
+    procedures = ProcedureTable(0)
+    procedures.columns = columns
+    timePeriod = None
+    if resume and checkpointName is not None:
+        timePeriod = readResultCache(checkpointName,procedures,config)
+    if timePeriod is None:
+        timePeriod = runScheduler(procedures,config)
+    chain = AnnealingChain(timePeriod,weights,seed)
+    numMade = chain.run(seconds,temperatures[0],temperatures[1],checkpointSeconds,checkpointName)
+    return (seed,chain.objective,chain.terms,numMade,timePeriod.getRoomState())
+
+def runAnnealing(procedures,config,weights,seconds,numChains=None,temperatures=(60.0,0.5),
+                 checkpointSeconds=60,checkpointFolder=None,resume=False):
+    '''
+    Input: procedures, config (as for runScheduler)
+            weights (dictionary of the weight of each of objectiveTerms)
+            seconds (time budget of each chain)
+            numChains (number of chains, run side by side; None for one per core)
+            temperatures (initial and final temperatures)
+            checkpointSeconds (how often the chains save their best schedules)
+            checkpointFolder (optional: folder to save the checkpoints to)
+            resume (True to start the chains from their checkpoints, if there are any)
+    Returns: (the TimePeriod of the best schedule, list of (seed, objective, terms, moves
+                made) of each chain)
+    '''
+    numChains = numChains or multiprocessing.cpu_count()
+    tasks = []
+    for chain in xrange(numChains):
+        checkpointName = None
+        if checkpointFolder is not None:
+            checkpointName = getCheckpointName(procedures,config,weights,seconds,temperatures,checkpointFolder,chain)
+        tasks.append((procedures.columns,config,weights,config.seed+chain,seconds,temperatures,checkpointSeconds,checkpointName,resume))
+
+    pool = multiprocessing.Pool(numChains)
+    try:
+        results = pool.map(runChain,tasks,1)
+    finally:
+        pool.close()
+        pool.join()
+
+    seed,objective,terms,numMade,state = min(results,key=lambda result: result[1])
+    timePeriod = TimePeriod(config)
+    timePeriod.preparePacking(procedures)
+    timePeriod.setRoomState(state)
+    timePeriod.recomputeHoldingBays()
+    return (timePeriod,[result[:4] for result in results])
+
+def saveChainResults(chainResults,workbook):
+    '''
+    Input: chainResults (as given by runAnnealing), workbook (name of the csv to write to)
+    Returns: none
+    '''
+    out = open(workbook,'wb')
+    writer = csv.writer(out)
+    writer.writerow(['Seed','Objective']+objectiveTerms+['MovesMade'])
+    for seed,objective,terms,numMade in chainResults:
+        writer.writerow([seed,round(objective,2)]+[round(term,2) for term in terms]+[numMade])
+    out.close()
+
+
+######################################################################################################
+######################################################################################################
+#################################### CONFIGURING/RUNNING THE SCRIPT ##################################
+######################################################################################################
+######################################################################################################
+
+
+if __name__ == "__main__":
+
+    ############# VERIFY FOLLOWING VALUES BEFORE RUNNING ##############
+
+    # UNCOMMENT the working directory, or add a new one
+    #os.chdir("/Users/nicseo/Desktop/MIT/Junior/Fall/UROP/Scheduling Optimization/Script")
+    os.chdir("/Users/dscheink/Documents/MIT-MGH/EP_Cath/Git/mghSchedulingModel/")
+
+    # UNCOMMENT the data set to schedule, or add a new one
+    fileName = 'InputData/CathFlatEPGrow2V2.csv'
+    #fileName = 'InputData/CathDrop1EPFlat.csv'
+
+    # settings of the run (see makeConfig in Optimization_Version2.py for the rest)
+    settings = {}
+
+    # weight of each term of the objective: a procedure minute in overflow, a crossover, a
+    # minute past closeCap, and one patient more at a day's holding bay peak
+    objectiveWeights = {'overflowMinutes':1.0, 'crossovers':30.0, 'overCapMinutes':2.0, 'holdingBayPeak':20.0}
+
+    seconds = 60                # time budget of each chain
+    numChains = None            # number of chains, run side by side; None for one per core
+    temperatures = (60.0,0.5)   # initial and final temperatures
+
+    # UNCOMMENT whether to save the chains' best schedules as they go, and to start from them
+    checkpointFolder = "OutputData/AnnealingCheckpoints"
+    #checkpointFolder = None
+    checkpointSeconds = 60
+    #resume = True
+    resume = False
+
+    # please name the workbooks to save the schedule, the holding bays and the chains' results to
+    assignmentWorkbook = "OutputData/assignmentsAnnealingV2.csv"
+    holdingBayWorkbook = "OutputData/holdingBaysAnnealingV2.csv"
+    chainWorkbook = "OutputData/chainsAnnealingV2.csv"
+
+
+    ############# RUNNING OF THE SCRIPT: not necessary to modify #############
+
+    config = makeConfig(**settings)
+    procedures = cleanProcTimes(readData(fileName,config),config)
+    timePeriod,chainResults = runAnnealing(procedures,config,objectiveWeights,seconds,numChains,temperatures,
+                                           checkpointSeconds,checkpointFolder,resume)
+
+    printOutputStatistics(timePeriod)
+    saveAssignmentResults(timePeriod,assignmentWorkbook)
+    saveHoldingBayResults(timePeriod,holdingBayWorkbook)
+    saveChainResults(chainResults,chainWorkbook)
+    for seed,objective,terms,numMade in chainResults:
+        print "Chain "+str(seed)+": objective "+str(round(objective,2))+" ("+\
+              ", ".join(name+" "+str(round(term,2)) for name,term in zip(objectiveTerms,terms))+")"
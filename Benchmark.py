@@ -0,0 +1,311 @@
+"""
+This script times each phase of a full Optimization_Version2.py run, and measures the memory
+it takes, on the scenario data files and on larger versions of them, so that the speed of
+the scheduler can be tracked from one version to the next.
+
+The phases timed are:
+    ingest - parsing the data file (readData without the binary cache)
+    ingestCached - reading the same data back from the binary cache
+    transforms - cleaning the procedure times and applying the policies' transforms
+    sameWeeks, sameDays, emergencies - the three packing passes of packBins
+    stats - the output statistics and the holding bay quantiles
+    export - writing the assignments, the holding bay occupancy and its quantiles
+
+Notes about use:
+- The cases to run are defined at the bottom of this file, in the __main__ function. A case
+    is a data file and a scale: the volume multiplies the number of procedures (each one is
+    repeated that many times, with as many times the rooms), and the periods repeat the time
+    period that many times in a row (10 periods of 125 days are 5 years of weekdays). The
+    scaled data is written to a temporary folder and read from there like any other file.
+
+- Every run of a case is made in a fresh process, so that the memory measured is the case's
+    own. The time of a phase is the best over the repeats, and its memory is the peak
+    resident memory of the process at the end of the phase.
+
+- The results are written as JSON, with the version of the code and the machine they were
+    measured on.
+"""
+import csv
+import os
+import sys
+import time
+import json
+import glob
+import shutil
+import platform
+import tempfile
+import subprocess
+import collections
+import multiprocessing
+try:
+    import resource
+except ImportError:         # not available on Windows: memory is not measured
+    resource = None
+
+from Optimization_Version2 import makeConfig, readData, cleanProcTimes, TimePeriod,\
+     getOutputStatistics, HoldingBayQuantiles, saveAssignmentResults, saveHoldingBayResults, saveHoldingBayQuantiles
+
+
+######################################################################################################
+######################################################################################################
+############################################# MEASUREMENT ############################################
+######################################################################################################
+######################################################################################################
+
+def getPeakMemory():
+    '''
+    Returns: the peak resident memory of this process so far in kilobytes, or None if it
+                cannot be measured on this platform
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024 if sys.platform == 'darwin' else peak      # bytes on Mac OS, kilobytes elsewhere
+
+class PhaseTimer:
+    '''
+    Class to record the time and memory taken by the phases of a run.
+
+    Initialization:
+        PhaseTimer()
+
+    Call start(phase) before a phase and stop() after it.
+    '''
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.phase = None
+        self.startTime = None
+
+    def start(self,phase):
+        self.phase = phase
+        self.startTime = time.time()
+
+    def stop(self):
+        self.phases[self.phase] = {'seconds':time.time()-self.startTime, 'peakMemoryKB':getPeakMemory()}
+        self.phase = None
+
+
+######################################################################################################
+######################################################################################################
+############################################# SCALED DATA ############################################
+######################################################################################################
+######################################################################################################
+
+def getScaledSettings(settings,volume,periods):
+    '''
+    Input: settings (dictionary of the settings of the run at its original scale)
+            volume, periods (scale of the case)
+    Returns: the settings for the scaled data: as many times the rooms as the volume, and
+                as many times the days as the periods
+    '''
+    config = makeConfig(**settings)
+    scaled = dict(settings)
+    for name in ['numCathRooms','numEPRooms','numMiddleRooms','numRestrictedCath','numRestrictedEP']:
+        scaled[name] = getattr(config,name)*volume
+    scaled['daysInPeriod'] = config.daysInPeriod*periods
+    return scaled
+
+def writeScaledData(fileName,settings,volume,periods,scaledName):
+    '''
+    Input: fileName (name of the data file to scale)
+            settings (dictionary of the settings of the run at its original scale)
+            volume (number of times to repeat each procedure)
+            periods (number of times to repeat the time period, one after the other)
+            scaledName (name of the csv to write the scaled data to)
+    Returns: none
+    '''
+    config = makeConfig(**settings)
+    numWeeks = config.daysInPeriod/5
+    with open(fileName,'rU') as f:
+        rows = [row[:config.numEntries] for row in csv.reader(f)]
+    out = open(scaledName,'wb')
+    writer = csv.writer(out)
+    for p in xrange(periods):
+        for row in rows:
+            row = list(row)
+            row[config.iDay] = repr(float(row[config.iDay])+p*config.daysInPeriod)
+            row[config.iWeek] = repr(float(row[config.iWeek])+p*numWeeks)
+            for v in xrange(volume):
+                writer.writerow(row)
+    out.close()
+
+
+######################################################################################################
+######################################################################################################
+############################################## RUNNING ###############################################
+######################################################################################################
+######################################################################################################
+
+def runCase(case):
+    '''
+    Runs one case, timing its phases. Run in a fresh worker process.
+
+    Input: case (a (data file name, settings dictionary, output folder) tuple)
+    Returns: a (number of procedures, phases) pair, the phases as recorded by a PhaseTimer
+    '''
+    fileName,settings,outputFolder = case
+    config = makeConfig(**settings)
+    timer = PhaseTimer()
+
+    timer.start('ingest')
+    procedures = readData(fileName,config._replace(useDataCache=False))
+    timer.stop()
+
+    readData(fileName,config._replace(useDataCache=True))      # make sure the cache exists
+    timer.start('ingestCached')
+    procedures = readData(fileName,config._replace(useDataCache=True))
+    timer.stop()
+
+    timer.start('transforms')
+    procedures = cleanProcTimes(procedures,config)
+    timePeriod = TimePeriod(config)
+    dayBuckets,weekBuckets = timePeriod.preparePacking(procedures)
+    timer.stop()
+
+    timer.start('sameWeeks')
+    timePeriod.packSameWeeks(weekBuckets)
+    timer.stop()
+
+    timer.start('sameDays')
+    timePeriod.packSameDays(dayBuckets)
+    timer.stop()
+
+    timer.start('emergencies')
+    timePeriod.packEmergencies(dayBuckets)
+    timer.stop()
+
+    timer.start('stats')
+    getOutputStatistics(timePeriod)
+    quantiles = HoldingBayQuantiles(timePeriod.numSlots)
+    quantiles.addTimePeriod(timePeriod)
+    timer.stop()
+
+    timer.start('export')
+    saveAssignmentResults(timePeriod,os.path.join(outputFolder,'assignments.csv'))
+    saveHoldingBayResults(timePeriod,os.path.join(outputFolder,'holdingBays.csv'))
+    saveHoldingBayQuantiles(quantiles,config,os.path.join(outputFolder,'holdingBayQuantiles.csv'))
+    timer.stop()
+
+    return (len(procedures),timer.phases)
+
+def runBenchmarks(fileNames,scales,settings,repeats):
+    '''
+    Input: fileNames (list of data files to run at their original scale)
+            scales (list of (data file, volume, periods) scale-ups to run)
+            settings (dictionary of the settings of the runs at the original scale)
+            repeats (number of times to run each case)
+    Returns: a list of results, one dictionary per case
+    '''
+    folder = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        cases = [(fileName,fileName,1,1,settings) for fileName in fileNames]
+        for fileName,volume,periods in scales:
+            scaledName = os.path.join(folder,os.path.splitext(os.path.basename(fileName))[0]+'_x'+str(volume)+'_p'+str(periods)+'.csv')
+            writeScaledData(fileName,settings,volume,periods,scaledName)
+            cases.append((fileName,scaledName,volume,periods,getScaledSettings(settings,volume,periods)))
+
+        results = []
+        for scenario,dataName,volume,periods,caseSettings in cases:
+            # a new process for every run, so that each run's memory is measured on its own
+            pool = multiprocessing.Pool(1,maxtasksperchild=1)
+            try:
+                runs = pool.map(runCase,[(dataName,caseSettings,folder)]*repeats,1)
+            finally:
+                pool.close()
+                pool.join()
+
+            phases = collections.OrderedDict()
+            for phase in runs[0][1]:
+                seconds = min(run[1][phase]['seconds'] for run in runs)
+                memory = [run[1][phase]['peakMemoryKB'] for run in runs]
+                phases[phase] = {'seconds':round(seconds,6), 'peakMemoryKB':None if None in memory else max(memory)}
+            result = collections.OrderedDict()
+            result['scenario'] = os.path.splitext(os.path.basename(scenario))[0]
+            result['volume'] = volume
+            result['periods'] = periods
+            result['days'] = makeConfig(**caseSettings).daysInPeriod
+            result['numProcedures'] = runs[0][0]
+            result['totalSeconds'] = round(sum(phase['seconds'] for phase in phases.values()),6)
+            result['phases'] = phases
+            results.append(result)
+            print result['scenario']+" x"+str(volume)+" over "+str(periods)+" period(s): "+str(result['numProcedures'])+\
+                  " procedures in "+str(result['totalSeconds'])+" s"
+        return results
+    finally:
+        shutil.rmtree(folder,ignore_errors=True)
+
+def getMetadata():
+    '''
+    Returns: a dictionary describing the version of the code and the machine the benchmark is run on
+    '''
+    try:
+        commit = subprocess.Popen(['git','rev-parse','HEAD'],stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        commit = ''
+    return collections.OrderedDict([
+        ('time',time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('commit',commit or None),
+        ('python',platform.python_version()),
+        ('platform',platform.platform()),
+        ('processor',platform.processor()),
+        ('cpuCount',multiprocessing.cpu_count()),
+        ])
+
+def saveBenchmarkResults(results,settings,repeats,workbook):
+    '''
+    Input: results (list of results, as given by runBenchmarks)
+            settings (dictionary of the settings of the runs)
+            repeats (number of times each case was run)
+            workbook (name of the JSON file to write to)
+    Returns: none
+    '''
+    output = collections.OrderedDict([
+        ('metadata',getMetadata()),
+        ('settings',makeConfig(**settings)._asdict()),
+        ('repeats',repeats),
+        ('results',results),
+        ])
+    with open(workbook,'w') as f:
+        json.dump(output,f,indent=2)
+
+
+######################################################################################################
+######################################################################################################
+#################################### CONFIGURING/RUNNING THE SCRIPT ##################################
+######################################################################################################
+######################################################################################################
+
+
+if __name__ == "__main__":
+
+    ############# VERIFY FOLLOWING VALUES BEFORE RUNNING ##############
+
+    # UNCOMMENT the working directory, or add a new one
+    #os.chdir("/Users/nicseo/Desktop/MIT/Junior/Fall/UROP/Scheduling Optimization/Script")
+    os.chdir("/Users/dscheink/Documents/MIT-MGH/EP_Cath/Git/mghSchedulingModel/")
+
+    # UNCOMMENT the data sets to run at their original scale
+    fileNames = sorted(glob.glob('InputData/Cath*EP*.csv'))
+    #fileNames = ['InputData/CathFlatEPGrow2V2.csv']
+
+    # UNCOMMENT the scale-ups to run, as (data file, volume, periods)
+    scales = [('InputData/CathFlatEPGrow2V2.csv',volume,periods) for volume,periods in [(2,1),(10,1),(100,1),(1,2),(1,10)]]
+    #scales = [('InputData/CathFlatEPGrow2V2.csv',volume,periods) for volume,periods in [(2,1),(10,1),(1,10)]]
+    #scales = []
+
+    # settings of the runs (see makeConfig in Optimization_Version2.py for the rest)
+    settings = {}
+
+    # number of times to run each case (the best time is kept)
+    repeats = 3
+
+    # please name the file to save the results to
+    benchmarkFile = "OutputData/benchmarkV2.json"
+
+
+    ############# RUNNING OF THE SCRIPT: not necessary to modify #############
+
+    results = runBenchmarks(fileNames,scales,settings,repeats)
+    saveBenchmarkResults(results,settings,repeats,benchmarkFile)
+    print "Saved benchmark results to "+benchmarkFile
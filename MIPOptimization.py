@@ -0,0 +1,374 @@
+"""
+This script solves the room assignment of Optimization_Version2.py exactly, as a mixed
+integer program, to tell how far the greedy scheduler's overflow is from the least
+possible under the same rules.
+
+The time period is split into the blocks the greedy passes never place across: one week,
+or one pair of weeks (1-2, 3-4, ...) if weekPairs is set (see TimePeriod.getShards). In
+each block, every procedure may be booked in any room day the greedy scheduler could
+have put it in:
+    - the days of its scheduling horizon's window (its week or pair of weeks, its day or
+      pair of days, or its day for emergencies), as packBins gives them
+    - the rooms of its own lab, only the restricted ones if its horizon is restricted, and
+      of the other lab under AllFlex, or under LabPreference if it is flexible; middle
+      room procedures in the middle rooms only
+subject to the room day's time limits: the procedures booked in a room day take no more
+than totalTimeRoom, and all but the last take no more than closeCap (a room is not
+booked once it is past closeCap). The program minimizes the number of procedures in
+overflow and, among the schedules with the fewest, the number of crossovers.
+
+Notes about use:
+- The programs are solved with PuLP and the CBC solver that comes with it, or the one on the
+    path if it came without, which have to be installed (pip install pulp); the rest of the
+    scheduler does not need them.
+
+- Each block's program is started from the greedy schedule, so the solver always has a
+    schedule at least as good as the greedy one, and given a time limit. A block whose
+    program is not solved to optimality within the limit keeps the best schedule found, and
+    its status is 'Stopped'.
+
+- The blocks are solved side by side in a pool of worker processes, one per core by default.
+
+- The optimized schedule is written in the format of saveAssignmentResults, and the greedy
+    and optimized overflow of each block to a csv. Overflow recovery (bumpFlexProcs) is
+    not needed, as the programs can move any procedure.
+"""
+import csv
+import os
+import time
+import heapq
+import itertools
+import multiprocessing
+try:
+    import pulp
+except ImportError:         # only needed to solve the programs
+    pulp = None
+
+from Optimization_Version2 import makeConfig, readData, cleanProcTimes, runScheduler, TimePeriod,\
+     printOutputStatistics, saveAssignmentResults
+
+
+######################################################################################################
+######################################################################################################
+############################################ BLOCK PROGRAMS ##########################################
+######################################################################################################
+######################################################################################################
+
+def getBlockProcedures(timePeriod,weeks):
+    '''
+    Input: timePeriod (a TimePeriod the procedures have been registered in by preparePacking)
+            weeks (the (first, last) weeks of a block, as given by getShards)
+    Returns: a list per pass of packBins (same weeks, same days, emergencies) of
+                (procedure ID, first day, number of days, restricted, overflow day, day or
+                week, True if day) tuples, one per procedure of the block, giving its window
+                and overflow entry as tryPlaceProc is given them, in the order they are placed
+    '''
+    config = timePeriod.config
+    columns = timePeriod.procedures.columns
+    dayBuckets = timePeriod.procedures.getBuckets((config.iSchedHorizon,config.iDay))
+    weekBuckets = timePeriod.procedures.getBuckets((config.iSchedHorizon,config.iWeek))
+    firstWeek,lastWeek = weeks
+    firstDay,lastDay = timePeriod.getShardDays(weeks)
+    sameWeeks,sameDays,emergencies = [],[],[]
+
+    # same week procedures, as in packSameWeeks
+    for w in xrange(firstWeek,lastWeek+1,2 if config.weekPairs else 1):
+        if config.weekPairs and w < timePeriod.numWeeks:
+            procIDs = list(heapq.merge(weekBuckets.get((3.0,w),[]),weekBuckets.get((3.0,w+1),[])))
+            procIDs.sort(key=columns[config.iProcTime].__getitem__)
+            numDays = 10
+        else:
+            procIDs = timePeriod.sortProcedures(weekBuckets.get((3.0,w),[]))
+            numDays = 5
+        weekStart = (w-1)*5
+        sameWeeks.extend((procID,weekStart,numDays,config.restrictWeeks,weekStart,w-1,False) for procID in procIDs)
+
+    # same day procedures, as in packSameDays
+    for d in xrange(firstDay,lastDay+1):
+        if config.dayPairs:
+            if d%5 == 3 or d%5 == 0:
+                continue
+            elif d%5 == 1:
+                procIDs,numDays = dayBuckets.get((2.0,d),[]),1
+            else:
+                procIDs,numDays = heapq.merge(dayBuckets.get((2.0,d),[]),dayBuckets.get((2.0,d+1),[])),2
+        else:
+            procIDs,numDays = dayBuckets.get((2.0,d),[]),1
+        sameDays.extend((procID,d-1,numDays,config.restrictDays,d-1,d-1,True) for procID in timePeriod.sortProcedures(procIDs))
+
+    # emergencies, as in packEmergencies
+    for d in xrange(firstDay,lastDay+1):
+        procIDs = timePeriod.sortProcedures(dayBuckets.get((1.0,d),[]))
+        emergencies.extend((procID,d-1,1,config.restrictEmergencies,d-1,d-1,True) for procID in procIDs)
+    return [sameWeeks,sameDays,emergencies]
+
+def getCandidateRooms(timePeriod,procID,firstDay,numDays,restricted):
+    '''
+    Input: timePeriod (as for getBlockProcedures)
+            procID (ID of a procedure), firstDay, numDays, restricted (its window, as given
+            by getBlockProcedures)
+    Returns: a list of (room day index, True if a crossover) pairs of the room days the
+                procedure may be booked in, following the domain of tryPlaceProc
+    '''
+    config = timePeriod.config
+    columns = timePeriod.procedures.columns
+    if columns[config.iRoom][procID] == 3.0:
+        labs = [(config.middleID,timePeriod.numMiddleRooms,False)]
+    else:
+        originalLab = columns[config.iLab][procID]
+        otherLab = config.cathID if originalLab==config.epID else config.epID
+        if not restricted:
+            numRooms = {config.cathID:timePeriod.numCathRooms, config.epID:timePeriod.numEPRooms}
+        else:
+            numRooms = {config.cathID:timePeriod.numRestrictedCath, config.epID:timePeriod.numRestrictedEP}
+        labs = [(originalLab,numRooms[originalLab],False)]
+        flex = columns[config.iRoom][procID] == 2.0
+        if config.crossoverType == 'AllFlex' or (config.crossoverType == 'LabPreference' and flex):
+            labs.append((otherLab,numRooms[otherLab],True))
+
+    rooms = []
+    for lab,numRooms,crossover in labs:
+        offset = timePeriod.labOffsets[lab]
+        for d in xrange(firstDay,firstDay+numDays):
+            rooms.extend((d*timePeriod.roomsPerDay+offset+r,crossover) for r in xrange(numRooms))
+    return rooms
+
+def getBlocks(greedy):
+    '''
+    Input: greedy (a TimePeriod packed by packBins, without overflow recovery)
+    Returns: a list of blocks, one per shard of the time period, each a (weeks, procedures,
+                config) tuple with a (procedure ID, procedure time, candidate rooms, greedy
+                room day index or -1) tuple per procedure, in the order they are placed
+    '''
+    config = greedy.config
+    procTimes = greedy.procedures.columns[config.iProcTime]
+    blocks = []
+    for weeks in greedy.getShards():
+        procedures = []
+        for procID,firstDay,numDays,restricted,overflowDay,dayOrWeek,day in itertools.chain(*getBlockProcedures(greedy,weeks)):
+            rooms = getCandidateRooms(greedy,procID,firstDay,numDays,restricted)
+            procedures.append((procID,procTimes[procID],rooms,greedy.assignments[procID]))
+        blocks.append((weeks,procedures,config))
+    return blocks
+
+def getSolver(timeLimit):
+    '''
+    Input: timeLimit (seconds the solver may take)
+    Returns: a PuLP CBC solver that starts from the variables' initial values, the CBC on
+                the path if PuLP was installed without its own
+    '''
+    try:
+        solver = pulp.PULP_CBC_CMD(msg=False,timeLimit=timeLimit,warmStart=True)
+        if not solver.available():
+            solver = pulp.COIN_CMD(msg=False,timeLimit=timeLimit,warmStart=True)
+        return solver
+    except TypeError:       # older versions of PuLP
+        return pulp.PULP_CBC_CMD(msg=0,maxSeconds=timeLimit)
+
+def solveBlock(task):
+    '''
+    Solves one block's program. Run in the worker processes.
+
+    Input: task (a (block, time limit in seconds) pair, the block as given by getBlocks)
+    Returns: a (weeks, assignments, status, seconds) tuple: the room day index (or -1)
+                chosen for each procedure of the block in order, and the solver's status,
+                'Stopped' if the time limit ran out before the schedule was proven optimal
+    '''
+    (weeks,procedures,config),timeLimit = task
+    startTime = time.time()
+    if not procedures:
+        return (weeks,[],'Optimal',0.0)
+    problem = pulp.LpProblem("block_"+str(weeks[0])+"_"+str(weeks[1]),pulp.LpMinimize)
+
+    booked = {}         # (procedure, room day) -> variable: the procedure is booked in the room day
+    last = {}           # (procedure, room day) -> variable: the procedure is the last one of the room day
+    unplaced = []
+    crossovers = []
+    roomProcs = {}
+    for p in xrange(len(procedures)):
+        procID,procTime,rooms,greedyRoom = procedures[p]
+        choices = []
+        for room,crossover in rooms:
+            x = pulp.LpVariable("x_"+str(procID)+"_"+str(room),cat='Binary')
+            y = pulp.LpVariable("last_"+str(procID)+"_"+str(room),cat='Binary')
+            booked[(p,room)] = x
+            last[(p,room)] = y
+            choices.append(x)
+            roomProcs.setdefault(room,[]).append(p)
+            problem += y <= x
+            if crossover:
+                crossovers.append(x)
+        u = pulp.LpVariable("overflow_"+str(procID),cat='Binary')
+        unplaced.append(u)
+        problem += pulp.lpSum(choices) + u == 1
+
+    # fewest procedures in overflow first, then fewest crossovers
+    problem += pulp.lpSum(unplaced) + pulp.lpSum(crossovers)/float(len(crossovers)+1)
+
+    for room,ps in roomProcs.iteritems():
+        load = pulp.lpSum(procedures[p][1]*booked[(p,room)] for p in ps)
+        problem += load <= config.totalTimeRoom
+        problem += load - pulp.lpSum(procedures[p][1]*last[(p,room)] for p in ps) <= config.closeCap
+        problem += pulp.lpSum(last[(p,room)] for p in ps) <= 1
+
+    # start from the greedy schedule: the longest procedure of each room day is its last
+    longest = {}
+    for p in xrange(len(procedures)):
+        greedyRoom = procedures[p][3]
+        unplaced[p].setInitialValue(1 if greedyRoom < 0 else 0)
+        if greedyRoom >= 0 and (greedyRoom not in longest or procedures[p][1] > procedures[longest[greedyRoom]][1]):
+            longest[greedyRoom] = p
+    for (p,room),x in booked.iteritems():
+        x.setInitialValue(1 if procedures[p][3] == room else 0)
+        last[(p,room)].setInitialValue(1 if longest.get(room) == p else 0)
+
+    problem.solve(getSolver(timeLimit))
+    status = pulp.LpStatus[problem.status]
+    # PuLP reports a schedule found before the time limit as optimal
+    if getattr(problem,'sol_status',None) == pulp.LpSolutionIntegerFeasible:
+        status = 'Stopped'
+    assignments = []
+    for p in xrange(len(procedures)):
+        chosen = [room for room,crossover in procedures[p][2] if (booked[(p,room)].varValue or 0) > 0.5]
+        assignments.append(chosen[0] if chosen else -1)
+    return (weeks,assignments,status,time.time()-startTime)
+
+def getOverflowCount(assignments):
+    '''
+    Input: assignments (list of room day indices, -1 for overflow)
+    Returns: the number of procedures in overflow
+    '''
+    return sum(1 for room in assignments if room < 0)
+
+def getLastProcedures(bookings,procTimes,closeCap):
+    '''
+    The programs only ask that all but one of the procedures of a room day fit under closeCap,
+    while the greedy scheduler does not book a room day once it is past closeCap. Where the
+    procedures of a room day would go past closeCap in booking order, the longest is the one
+    to book last.
+    Input: bookings (list of (procedure ID, room day index or -1) pairs in booking order)
+            procTimes (the procedure time column), closeCap (as in the config)
+    Returns: the set of IDs of the procedures to book after all the others
+    '''
+    roomProcs = {}
+    for procID,room in bookings:
+        if room >= 0:
+            roomProcs.setdefault(room,[]).append(procID)
+    lastProcs = set()
+    for room,procIDs in roomProcs.iteritems():
+        if sum(procTimes[procID] for procID in procIDs[:-1]) > closeCap:
+            lastProcs.add(max(procIDs,key=procTimes.__getitem__))
+    return lastProcs
+
+def runOptimization(procedures,config,timeLimit=60,processes=None):
+    '''
+    Input: procedures, config (as for runScheduler)
+            timeLimit (seconds each block's program may take)
+            processes (number of worker processes, None for one per core)
+    Returns: a (greedy, optimized, block results) tuple: the TimePeriods scheduled by
+                packBins and from the programs' solutions, and a (weeks, greedy overflow,
+                optimized overflow, status, seconds) tuple per block
+    '''
+    if pulp is None:
+        raise ImportError("the exact optimization needs PuLP: pip install pulp")
+    config = config._replace(bumpFlexProcs=False)
+    greedy = runScheduler(procedures,config)
+    blocks = getBlocks(greedy)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        solutions = pool.map(solveBlock,[(block,timeLimit) for block in blocks],1)
+    finally:
+        pool.close()
+        pool.join()
+
+    blockResults = []
+    blockAssignments = []
+    for (weeks,blockProcedures,blockConfig),(solvedWeeks,assignments,status,seconds) in zip(blocks,solutions):
+        greedyAssignments = [greedyRoom for procID,procTime,rooms,greedyRoom in blockProcedures]
+        if getOverflowCount(assignments) > getOverflowCount(greedyAssignments):
+            assignments = greedyAssignments         # no solution as good as the greedy one was found
+        blockAssignments.append(iter(assignments))
+        blockResults.append((weeks,getOverflowCount(greedyAssignments),getOverflowCount(assignments),status,seconds))
+
+    # book the solutions pass by pass, in the order packBins places the procedures, so that
+    # the rooms' sequences (and the holding bays) and the overflow lists are made up as the
+    # greedy scheduler makes them up
+    optimized = TimePeriod(config)
+    optimized.preparePacking(procedures)
+    blockWindows = [getBlockProcedures(optimized,weeks) for weeks,blockProcedures,blockConfig in blocks]
+    bookings = []
+    for p in xrange(3):
+        for windows,assignments in zip(blockWindows,blockAssignments):
+            for procID,firstDay,numDays,restricted,overflowDay,dayOrWeek,day in windows[p]:
+                bookings.append((procID,next(assignments),overflowDay,dayOrWeek,day))
+    lastProcs = getLastProcedures([booking[:2] for booking in bookings],procedures.columns[config.iProcTime],config.closeCap)
+    for procID,room,overflowDay,dayOrWeek,day in bookings:
+        if room < 0:
+            optimized.addToOverflow(procID,overflowDay)
+            optimized.updateOverflowStats(procID,dayOrWeek,day)
+        elif procID not in lastProcs:
+            optimized.bookRoom(procID,room)
+    for procID,room,overflowDay,dayOrWeek,day in bookings:
+        if procID in lastProcs:
+            optimized.bookRoom(procID,room)
+    return greedy,optimized,blockResults
+
+def saveBlockResults(blockResults,workbook):
+    '''
+    Input: blockResults (as given by runOptimization), workbook (name of the csv to write to)
+    Returns: none
+    '''
+    out = open(workbook,'wb')
+    writer = csv.writer(out)
+    writer.writerow(["FirstWeek","LastWeek","GreedyOverflow","OptimizedOverflow","Status","Seconds"])
+    for (firstWeek,lastWeek),greedyOverflow,optimizedOverflow,status,seconds in blockResults:
+        writer.writerow([firstWeek,lastWeek,greedyOverflow,optimizedOverflow,status,round(seconds,3)])
+    out.close()
+
+
+######################################################################################################
+######################################################################################################
+#################################### CONFIGURING/RUNNING THE SCRIPT ##################################
+######################################################################################################
+######################################################################################################
+
+
+if __name__ == "__main__":
+
+    ############# VERIFY FOLLOWING VALUES BEFORE RUNNING ##############
+
+    # UNCOMMENT the working directory, or add a new one
+    #os.chdir("/Users/nicseo/Desktop/MIT/Junior/Fall/UROP/Scheduling Optimization/Script")
+    os.chdir("/Users/dscheink/Documents/MIT-MGH/EP_Cath/Git/mghSchedulingModel/")
+
+    # UNCOMMENT the data set to optimize, or add a new one
+    fileName = 'InputData/CathFlatEPGrow2V2.csv'
+    #fileName = 'InputData/CathDrop1EPFlat.csv'
+
+    # settings of the run (see makeConfig in Optimization_Version2.py for the rest)
+    settings = {}
+
+    timeLimit = 60              # seconds each block's program may take
+
+    # number of worker processes, None for one per core
+    processes = None
+
+    # please name the workbooks to save the optimized schedule and the overflow per block to
+    assignmentWorkbook = "OutputData/assignmentsMIPV2.csv"
+    blockWorkbook = "OutputData/blockOverflowMIPV2.csv"
+
+
+    ############# RUNNING OF THE SCRIPT: not necessary to modify #############
+
+    config = makeConfig(**settings)
+    procedures = cleanProcTimes(readData(fileName,config),config)
+    greedy,optimized,blockResults = runOptimization(procedures,config,timeLimit,processes)
+
+    printOutputStatistics(optimized)
+    saveAssignmentResults(optimized,assignmentWorkbook)
+    saveBlockResults(blockResults,blockWorkbook)
+    numOptimal = sum(1 for weeks,greedyOverflow,optimizedOverflow,status,seconds in blockResults if status == 'Optimal')
+    print "Overflow procedures: greedy "+str(greedy.overflowCath+greedy.overflowEP+greedy.overflowMiddle)+\
+          ", optimized "+str(optimized.overflowCath+optimized.overflowEP+optimized.overflowMiddle)+\
+          " ("+str(numOptimal)+" of "+str(len(blockResults))+" blocks solved to optimality)"
@@ -0,0 +1,256 @@
+"""
+This script repeats a run of Optimization_Version2.py many times with random post procedure
+times (postProcRandom), to give the distribution of the holding bay occupancy and of the
+overflow rather than a single sample of them. Several policies can be compared in the same
+replications.
+
+Notes about use:
+- The run's settings, the policies to compare and the number of replications are defined at
+    the bottom of this file, in the __main__ function. Any setting that is not given takes
+    its value from defaultSettings in Optimization_Version2.py.
+
+- Every replication draws its random inputs from its own random streams. The streams' seeds
+    are drawn in turn from a generator seeded with the run's seed, so replication r always
+    gets the same draws, whichever process runs it and however many replications are made.
+
+- With common random numbers (commonRandomNumbers = True), the random inputs of a replication
+    are drawn once, by procedure ID, and every policy in the comparison is run on the same
+    draws. The differences between policies within a replication are then due to the
+    policies alone, so far fewer replications are needed to tell policies apart. Without
+    it, every policy gets draws of its own.
+
+- The replications are spread over a pool of worker processes, one per core by default.
+
+- The distribution of the holding bay occupancy in each time slot over all days of all
+    replications (min, 5/25/50/75/95th percentile, max, mean, the percentiles computed as
+    R's quantile() does) is written for each policy, and the statistics of every replication
+    under every policy are written to one csv. The occupancy distribution is accumulated as
+    each replication finishes (see HoldingBayQuantiles), so the occupancy of every day of
+    every replication is never kept or written out.
+"""
+import csv
+import os
+import math
+import random
+import multiprocessing
+
+from Optimization_Version2 import makeConfig, runScheduler, getOutputStatistics, drawRandomInputs, HoldingBayQuantiles, saveHoldingBayQuantiles
+from PolicySweep import getScenarioData
+
+
+######################################################################################################
+######################################################################################################
+############################################# REPLICATIONS ###########################################
+######################################################################################################
+######################################################################################################
+
+def getReplicationSeeds(seed,numReplications,numPolicies=1):
+    '''
+    Input: seed (seed of the run)
+            numReplications (number of replications to make)
+            numPolicies (number of policies compared in each replication)
+    Returns: a list of the seeds of each replication's random streams, one per policy
+    '''
+    master = random.Random(seed)
+    return [[master.getrandbits(32) for p in xrange(numPolicies)] for r in xrange(numReplications)]
+
+def getPolicyLabel(policy):
+    '''
+    Input: policy (dictionary of the settings that make up a policy)
+    Returns: a short description of the policy
+    '''
+    return " ".join(name+"="+str(policy[name]) for name in sorted(policy)) or "base"
+
+def runReplication(replication):
+    '''
+    Schedules one replication under each policy of the comparison. Run in the worker processes.
+
+    Input: replication (a (fileName, settings dictionary, list of policies, replication number,
+                        seeds, common random numbers) tuple)
+    Returns: a (replication number, seeds, results) tuple, with a (holding bay quantiles,
+                statistics) pair of results per policy: the quantiles a HoldingBayQuantiles
+                of the replication's days and the statistics as given by getOutputStatistics,
+                plus the replication's peak holding bay occupancy
+    '''
+    fileName,settings,policies,r,seeds,common = replication
+    randomInputs = None
+    results = []
+    for p in xrange(len(policies)):
+        policySettings = dict(settings)
+        policySettings.update(policies[p])
+        config = makeConfig(**policySettings)._replace(seed=seeds[p])
+        procedures = getScenarioData(fileName,config)
+        if common and randomInputs is None:
+            randomInputs = drawRandomInputs(len(procedures),config,random.Random(seeds[0]))
+        timePeriod = runScheduler(procedures,config,randomInputs)
+
+        quantiles = HoldingBayQuantiles(timePeriod.numSlots)
+        quantiles.addTimePeriod(timePeriod)
+        stats = getOutputStatistics(timePeriod)
+        stats['peakHoldingBay'] = max(timePeriod.getHoldingBayMatrix())
+        results.append((quantiles,stats))
+    return (r,seeds,results)
+
+def runReplications(fileName,settings,policies,numReplications,commonRandomNumbers=True,processes=None):
+    '''
+    Input: fileName (name of the data file to schedule)
+            settings (dictionary of the settings shared by all policies)
+            policies (list of dictionaries of the settings of each policy to compare)
+            numReplications (number of replications to make)
+            commonRandomNumbers (True to give every policy the same draws in a replication)
+            processes (number of worker processes, None for one per core)
+    Returns: a (holding bay quantiles, replication statistics) pair: a HoldingBayQuantiles
+                of every day of every replication per policy, and a list of (replication
+                number, policy number, seed, statistics) tuples
+    '''
+    config = makeConfig(**settings)
+    seeds = getReplicationSeeds(config.seed,numReplications,len(policies))
+    replications = [(fileName,settings,policies,r,seeds[r],commonRandomNumbers) for r in xrange(numReplications)]
+
+    quantiles = [None]*len(policies)
+    replicationStats = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        for r,replicationSeeds,results in pool.imap(runReplication,replications):
+            for p in xrange(len(policies)):
+                replicationQuantiles,stats = results[p]
+                if quantiles[p] is None:
+                    quantiles[p] = replicationQuantiles
+                else:
+                    quantiles[p].merge(replicationQuantiles)
+                seed = replicationSeeds[0] if commonRandomNumbers else replicationSeeds[p]
+                replicationStats.append((r,p,seed,stats))
+    finally:
+        pool.close()
+        pool.join()
+    return quantiles,replicationStats
+
+def getQuantile(sortedValues,p):
+    '''
+    Input: sortedValues (list of values in increasing order)
+            p (probability between 0 and 1)
+    Returns: the p quantile of the values, interpolated as by R's quantile() (type 7)
+    '''
+    h = (len(sortedValues)-1)*p
+    lo = int(math.floor(h))
+    hi = min(lo+1,len(sortedValues)-1)
+    return sortedValues[lo] + (h-lo)*(sortedValues[hi]-sortedValues[lo])
+
+def getPairedDifference(replicationStats,statName,policy,baseline=0):
+    '''
+    Input: replicationStats (list of (replication number, policy number, seed, statistics)
+                             tuples, as given by runReplications)
+            statName (name of the statistic to compare)
+            policy, baseline (numbers of the two policies to compare)
+    Returns: the mean over the replications of the difference in the statistic between the
+                policy and the baseline in the same replication, and its standard error
+    '''
+    values = {}
+    for r,p,seed,stats in replicationStats:
+        values[(r,p)] = stats[statName]
+    replications = sorted(set(r for r,p,seed,stats in replicationStats))
+    differences = [values[(r,policy)]-values[(r,baseline)] for r in replications]
+    n = len(differences)
+    mean = float(sum(differences))/n
+    if n < 2:
+        return mean,0.0
+    variance = sum((d-mean)**2 for d in differences)/(n-1)
+    return mean,math.sqrt(variance/n)
+
+
+######################################################################################################
+######################################################################################################
+############################################ SAVING RESULTS ##########################################
+######################################################################################################
+######################################################################################################
+
+def saveReplicationStatistics(replicationStats,policies,workbook):
+    '''
+    Input: replicationStats (list of (replication number, policy number, seed, statistics)
+                             tuples, as given by runReplications)
+            policies (list of dictionaries of the settings of each policy)
+            workbook (name of the csv to write to)
+    Returns: none
+    '''
+    statNames = replicationStats[0][3].keys()
+    out = open(workbook,'wb')
+    writer = csv.writer(out)
+    writer.writerow(["Replication","Policy","Seed"]+statNames)
+    for r,p,seed,stats in replicationStats:
+        writer.writerow([r+1,getPolicyLabel(policies[p]),seed]+[stats[name] for name in statNames])
+    out.close()
+
+def getPolicyWorkbook(workbook,p,numPolicies):
+    '''
+    Input: workbook (name of a csv), p (policy number), numPolicies (number of policies compared)
+    Returns: the name of the csv for policy p: the given name if only one policy is run,
+                otherwise the given name with the policy number appended
+    '''
+    if numPolicies == 1:
+        return workbook
+    base,extension = os.path.splitext(workbook)
+    return base+"_Policy"+str(p+1)+extension
+
+
+######################################################################################################
+######################################################################################################
+#################################### CONFIGURING/RUNNING THE SCRIPT ##################################
+######################################################################################################
+######################################################################################################
+
+
+if __name__ == "__main__":
+
+    ############# VERIFY FOLLOWING VALUES BEFORE RUNNING ##############
+
+    # UNCOMMENT the working directory, or add a new one
+    #os.chdir("/Users/nicseo/Desktop/MIT/Junior/Fall/UROP/Scheduling Optimization/Script")
+    os.chdir("/Users/dscheink/Documents/MIT-MGH/EP_Cath/Git/mghSchedulingModel/")
+
+    # UNCOMMENT the data set to analyze, or add a new one
+    fileName = 'InputData/CathFlatEPGrow2V2.csv'
+    #fileName = 'InputData/CathDrop1EPFlat.csv'
+
+    # settings of the run (see makeConfig in Optimization_Version2.py for the rest)
+    settings = {
+        'postProcRandom':True,
+        'desiredMean':3.0,          # in hours
+        'desiredStDev':0.25,        # in hours
+        'seed':30,                  # seed the replications' seeds are drawn from
+        }
+
+    # UNCOMMENT the policies to compare, or add new ones
+    policies = [{'priority':'longest'},{'priority':'shortest'},{'priority':'HBConstraints'}]
+    #policies = [{'priority':'longest'}]
+    #policies = [{'crossoverType':"LabPreference"},{'crossoverType':"NoCrossovers"},{'crossoverType':"AllFlex"}]
+
+    # UNCOMMENT whether every policy gets the same random draws in a replication
+    commonRandomNumbers = True
+    #commonRandomNumbers = False
+
+    numReplications = 100
+
+    # number of worker processes, None for one per core
+    processes = None
+
+    # please name the workbooks to save the output to (one occupancy workbook per policy)
+    occupancyWorkbook = "OutputData/holdingBayDistributionV2.csv"
+    replicationWorkbook = "OutputData/replicationStatisticsV2.csv"
+
+
+    ############# RUNNING OF THE SCRIPT: not necessary to modify #############
+
+    quantiles,replicationStats = runReplications(fileName,settings,policies,numReplications,commonRandomNumbers,processes)
+    for p in xrange(len(policies)):
+        saveHoldingBayQuantiles(quantiles[p],makeConfig(**dict(settings,**policies[p])),getPolicyWorkbook(occupancyWorkbook,p,len(policies)))
+    saveReplicationStatistics(replicationStats,policies,replicationWorkbook)
+
+    for p in xrange(len(policies)):
+        overflow = sorted(stats['overflowProcs'] for r,q,seed,stats in replicationStats if q == p)
+        print getPolicyLabel(policies[p])+": overflow procedures over "+str(numReplications)+" replications: mean "+str(float(sum(overflow))/len(overflow))+\
+              ", 5th percentile "+str(getQuantile(overflow,0.05))+", 95th percentile "+str(getQuantile(overflow,0.95))
+    for p in xrange(1,len(policies)):
+        for statName in ['overflowProcs','peakHoldingBay']:
+            mean,error = getPairedDifference(replicationStats,statName,p)
+            print getPolicyLabel(policies[p])+" vs "+getPolicyLabel(policies[0])+": mean difference in "+statName+" "+\
+                  str(round(mean,3))+" (standard error "+str(round(error,3))+")"
@@ -35,6 +35,287 @@ import os
 import copy
 import random
 import math
+import heapq
+import array
+import collections
+import multiprocessing
+import hashlib
+import json
+import struct
+import sys
+import time
+
+######################################################################################################
+######################################################################################################
+############################################ CONFIGURATION ###########################################
+######################################################################################################
+###################################################################################################### 
+
+SchedulerConfig = collections.namedtuple('SchedulerConfig',[
+    # scheduling parameters
+    'totalTimeRoom','closeCap','turnover','labStartTime',
+    'numCathRooms','numEPRooms','numMiddleRooms','numRestrictedCath','numRestrictedEP',
+    'restrictWeeks','restrictDays','restrictEmergencies',
+    # constraint policies
+    'crossoverType','weekPairs','dayPairs','sameDaysOnly','emergencyFlex','bumpFlexProcs',
+    'localSearchSeconds','localSearchMoves',
+    # holding bays
+    'postProcRandom','desiredMean','desiredStDev','seed','HBCloseTime',
+    'ConvertPreProcToHours','CapHBPreProc','HBPreProcCap','resolution','priority',
+    # order of information in the data sheet
+    'numEntries','iDay','iWeek','iLab','iProcTime','iSchedHorizon','iRoom','iProcType',
+    'iProvider','iPreTime','iPostTime','ID','cathID','epID','middleID','daysInPeriod',
+    # reading the data, running
+    'useDataCache','packingProcesses','resultCache','resultCacheMegabytes',
+    # instrumentation
+    'profile'])
+
+defaultSettings = {
+    'totalTimeRoom':10.58*60, 'closeCap':10*60, 'turnover':0, 'labStartTime':8,
+    'numCathRooms':5, 'numEPRooms':4, 'numMiddleRooms':2, 'numRestrictedCath':5, 'numRestrictedEP':4,
+    'restrictWeeks':True, 'restrictDays':True, 'restrictEmergencies':False,
+    'crossoverType':"LabPreference", 'weekPairs':True, 'dayPairs':True, 'sameDaysOnly':True,
+    'emergencyFlex':True, 'bumpFlexProcs':False, 'localSearchSeconds':0, 'localSearchMoves':None,
+    'postProcRandom':False, 'desiredMean':3.0, 'desiredStDev':0.25, 'seed':30, 'HBCloseTime':30,
+    'ConvertPreProcToHours':True, 'CapHBPreProc':True, 'HBPreProcCap':3, 'resolution':15.0, 'priority':'longest',
+    'numEntries':10, 'iDay':0, 'iWeek':1, 'iLab':2, 'iProcTime':3, 'iSchedHorizon':4, 'iRoom':5, 'iProcType':8,
+    'iProvider':9, 'iPreTime':6, 'iPostTime':7, 'ID':10, 'cathID':0.0, 'epID':1.0, 'middleID':2.0,
+    'daysInPeriod':125, 'useDataCache':True, 'packingProcesses':1,
+    'resultCache':None, 'resultCacheMegabytes':512, 'profile':False}
+
+def makeConfig(**settings):
+    '''
+    Builds the read-only set of parameters and policies a run is made with. The same
+    config is passed to readData, cleanProcTimes and TimePeriod, and the writers read
+    it back from the TimePeriod, so several runs with different settings can be made
+    side by side in one process. Use config._replace(name=value) to derive a variant.
+    
+    Input: any of the SchedulerConfig fields, as keyword arguments; the rest take
+            their values from defaultSettings
+    Returns: a SchedulerConfig
+    '''
+    unknown = set(settings) - set(SchedulerConfig._fields)
+    if unknown:
+        raise TypeError("unknown scheduler settings: "+", ".join(sorted(unknown)))
+    values = dict(defaultSettings)
+    values.update(settings)
+    if 'ID' not in settings:
+        values['ID'] = values['numEntries']
+    return SchedulerConfig(**values)
+
+######################################################################################################
+######################################################################################################
+########################################## PROCEDURE DATA TYPE #######################################
+######################################################################################################
+###################################################################################################### 
+
+class ProcedureTable:
+    '''
+    Class to store procedure data column by column.
+
+    Initialization:
+        ProcedureTable(numColumns)
+            numColumns - the number of columns in the data sheet
+
+    Column c of the data sheet is stored in columns[c] as an array of floats, and a
+    procedure's ID is its row number in the table. Indexing the table with an ID gives a
+    ProcedureRecord, which reads and writes that row, so table[i][iProcTime] is the
+    procedure time of procedure i and table[i][ID] is i.
+
+    getBuckets(keyColumns) indexes the ID's by the values of some columns, e.g. by
+    (scheduling horizon, day), so that a day's or week's procedures can be looked up
+    instead of scanning the whole table.
+
+    withColumns(replacements) gives a new table that shares this table's columns except
+    for the replaced ones. The preprocessing transforms (see applyTransforms) are done this
+    way, so a table read from a file is never modified by a run and can be scheduled under
+    any number of policies. Columns shared between tables must not be modified in place.
+    '''
+
+    def __init__(self,numColumns):
+        self.columns = [array.array('d') for c in xrange(numColumns)]
+        self.buckets = {}       # cached groupings: key columns -> (column arrays, number of rows, buckets)
+        self.derived = {}       # cached tables derived from this one: transform stages -> table
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self,procID):
+        if not 0 <= procID < len(self):
+            raise IndexError(procID)
+        return ProcedureRecord(self,procID)
+
+    def __iter__(self):
+        for procID in xrange(len(self)):
+            yield ProcedureRecord(self,procID)
+
+    def append(self,row):
+        '''
+        Input: row (list of one procedure's data, one float per column)
+        Returns: none
+        '''
+        for c in xrange(len(self.columns)):
+            self.columns[c].append(row[c])
+
+    def extend(self,rows):
+        '''
+        Input: rows (iterable of procedures' data, each a list of one float per column). It is
+                read one row at a time, so the rows can be generated as they are added.
+        Returns: none
+        '''
+        columns = self.columns
+        numColumns = len(columns)
+        for row in rows:
+            for c in xrange(numColumns):
+                columns[c].append(row[c])
+
+    def withColumns(self,replacements):
+        '''
+        Input: replacements (dictionary from column index to the new column's array)
+        Returns: a new ProcedureTable with the given columns replaced and the others shared
+                    with this table. Groupings of unchanged columns are carried over.
+        '''
+        table = ProcedureTable(0)
+        table.columns = list(self.columns)
+        for c,column in replacements.iteritems():
+            table.columns[c] = column
+        table.buckets = dict(self.buckets)
+        return table
+
+    def getBuckets(self,keyColumns):
+        '''
+        Groups the procedure ID's by their values in the given columns. The grouping is
+        built the first time it is asked for and kept until one of those columns is
+        replaced or a row is added or modified.
+        Input: keyColumns (tuple of column indices to group by)
+        Returns: a dictionary from tuples of column values to lists of ID's in increasing order
+        '''
+        columns = [self.columns[c] for c in keyColumns]
+        cached = self.buckets.get(keyColumns)
+        if cached is None or cached[1] != len(self) or any(a is not b for a,b in zip(cached[0],columns)):
+            buckets = {}
+            for procID,key in enumerate(zip(*columns)):
+                buckets.setdefault(key,[]).append(procID)
+            cached = (columns,len(self),buckets)
+            self.buckets[keyColumns] = cached
+        return cached[2]
+
+
+class ProcedureRecord(object):
+    '''
+    One procedure's row of a ProcedureTable. Behaves like the procedure lists used
+    elsewhere in this script: record[c] is the value in column c and record[numColumns]
+    is the procedure ID. Records hold no data of their own, so they are cheap to create
+    and changes made through them are seen by the table.
+    '''
+    __slots__ = ('table','id')
+
+    def __init__(self,table,procID):
+        self.table = table
+        self.id = procID
+
+    def __getitem__(self,c):
+        if c == len(self.table.columns):
+            return self.id
+        return self.table.columns[c][self.id]
+
+    def __setitem__(self,c,value):
+        self.table.columns[c][self.id] = value
+        self.table.buckets.clear()
+
+    def __len__(self):
+        return len(self.table.columns)+1
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __deepcopy__(self,memo):
+        return self.tolist()
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        '''
+        Returns: a list of the procedure's data followed by its ID
+        '''
+        return [column[self.id] for column in self.table.columns] + [self.id]
+
+
+######################################################################################################
+######################################################################################################
+############################################## PROFILING #############################################
+######################################################################################################
+######################################################################################################
+
+class PackingProfile:
+    '''
+    Class to count the work done by a TimePeriod while it packs, to find out which
+    policies make a run slow.
+
+    Initialization:
+        PackingProfile()
+
+    A TimePeriod whose config has profile set keeps one in self.profile (None otherwise,
+    so that the only cost of the counters when they are off is checking for None). The
+    counts are kept per pass of the packing (see TimePeriod.runPass); work done outside
+    of a pass is counted under "other".
+
+    Counters of each pass:
+        seconds - wall time of the pass
+        attempts, placements - procedures tried, and placed in a room, by tryPlaceProc
+        domainTotal, domainMax - total and largest number of room days a procedure could
+                        be placed in (its candidate domain), over the attempts
+        closedRooms - rooms dropped from the room queues for being past closeCap
+        timeLimitRejections - searches that found no room with time left before totalTimeRoom
+        holdingBayStays, holdingBaySlots - stays added to or taken out of the holding bays,
+                        and the number of time slots they cover
+    '''
+
+    counterNames = ['seconds','attempts','placements','domainTotal','domainMax','closedRooms',
+                    'timeLimitRejections','holdingBayStays','holdingBaySlots']
+
+    def __init__(self):
+        self.passes = collections.OrderedDict()
+        self.current = None
+        self.startTime = None
+
+    def getCounters(self,name):
+        if name not in self.passes:
+            self.passes[name] = dict.fromkeys(self.counterNames,0)
+        return self.passes[name]
+
+    def startPass(self,name):
+        self.current = self.getCounters(name)
+        self.startTime = time.time()
+
+    def stopPass(self):
+        self.current['seconds'] += time.time()-self.startTime
+        self.current = None
+
+    def getCurrent(self):
+        if self.current is None:
+            return self.getCounters('other')
+        return self.current
+
+    def recordAttempt(self,domainSize,placed):
+        counters = self.getCurrent()
+        counters['attempts'] += 1
+        counters['placements'] += 1 if placed else 0
+        counters['domainTotal'] += domainSize
+        counters['domainMax'] = max(counters['domainMax'],domainSize)
+
+    def recordClosedRoom(self):
+        self.getCurrent()['closedRooms'] += 1
+
+    def recordTimeLimitRejection(self):
+        self.getCurrent()['timeLimitRejections'] += 1
+
+    def recordHoldingBayStay(self,numSlots):
+        counters = self.getCurrent()
+        counters['holdingBayStays'] += 1
+        counters['holdingBaySlots'] += numSlots
+
 
 ######################################################################################################
 ######################################################################################################
@@ -42,23 +323,121 @@ import math
 ######################################################################################################
 ###################################################################################################### 
 
-random.seed(30)
+class RoomBinsView(collections.Mapping):
+    '''
+    Read-only view of a TimePeriod's room bookings in the shape of the old room bins:
+    a dictionary keyed by (day,lab,room) whose values are the lists of procedures
+    booked in that room day, in the order they were booked. Values are fresh lists, so
+    modifying them does not change the time period.
+    '''
+
+    def __init__(self,timePeriod):
+        self.timePeriod = timePeriod
+
+    def __getitem__(self,room):
+        return self.timePeriod.getRoomProcedures(self.timePeriod.getRoomIndex(room))
+
+    def __iter__(self):
+        for index in xrange(self.timePeriod.numDays*self.timePeriod.roomsPerDay):
+            yield self.timePeriod.getRoomKey(index)
+
+    def __len__(self):
+        return self.timePeriod.numDays*self.timePeriod.roomsPerDay
+
+    def __deepcopy__(self,memo):
+        return {room:copy.deepcopy(procs,memo) for room,procs in self.iteritems()}
+
+
+class OverflowBinsView(collections.Mapping):
+    '''
+    Read-only view of a TimePeriod's overflow in the shape of the old overflow bins: a
+    dictionary keyed by day whose values are the lists of procedures that went to
+    overflow on that day.
+    '''
+
+    def __init__(self,timePeriod):
+        self.timePeriod = timePeriod
+
+    def __getitem__(self,day):
+        if not 0 <= day < self.timePeriod.numDays:
+            raise KeyError(day)
+        return self.timePeriod.getOverflowProcedures(day)
+
+    def __iter__(self):
+        return iter(xrange(self.timePeriod.numDays))
+
+    def __len__(self):
+        return self.timePeriod.numDays
+
+    def __deepcopy__(self,memo):
+        return {day:copy.deepcopy(procs,memo) for day,procs in self.iteritems()}
+
+
+class HoldingBayView(collections.Mapping):
+    '''
+    Read-only view of a TimePeriod's holding bay occupancy in the shape of the old
+    holding bay bins: a dictionary keyed by (day,hour) whose values are the number of
+    patients in the holding bays during the time slot starting at that hour.
+    '''
+
+    def __init__(self,timePeriod):
+        self.timePeriod = timePeriod
+
+    def __getitem__(self,key):
+        day,hour = key
+        slot = int(round(hour*self.timePeriod.slotsPerHour))
+        if not (0 <= day < self.timePeriod.numDays and 0 <= slot < self.timePeriod.numSlots):
+            raise KeyError(key)
+        return self.timePeriod.getHoldingBayMatrix()[day*self.timePeriod.numSlots+slot]
+
+    def __iter__(self):
+        for d in xrange(self.timePeriod.numDays):
+            for i in xrange(self.timePeriod.numSlots):
+                yield (d,i/self.timePeriod.slotsPerHour)
+
+    def __len__(self):
+        return self.timePeriod.numDays*self.timePeriod.numSlots
+
+    def __deepcopy__(self,memo):
+        return dict(self.iteritems())
+
+
+# arrays and counters of a TimePeriod that make up its room assignments (see getRoomState)
+roomStateNames = ['assignments','overflowAssignments','overflowOrder','procsPlacedData','roomLoads',
+                  'procsPlaced','crossOverProcs','cathToEP','epToCath','overflowCath','overflowEP','overflowMiddle',
+                  'overflowWeeks','overflowDays']
 
 class TimePeriod:
     '''
     Class to model a given time period of scheduling.
     
     Initialization:
-        TimePeriod(days,numCathRooms,numEPRooms)
-            days - the number of days in the time period
-            numCathRooms - the number of Cath rooms to be modeled
-            numEPRooms - the number of EP rooms to be modeled
+        TimePeriod(config)
+            config - the SchedulerConfig (see makeConfig) giving the number of days, the
+                     rooms to be modeled and the scheduling policies
 
     User methods:
-        packBins(procedures)
+        packBins(procedures,randomInputs)
+        preparePacking(procedures,randomInputs)
+        packSameWeeks(weekBuckets)
+        packSameDays(dayBuckets)
+        packEmergencies(dayBuckets)
+        recoverOverflow()
+        improveSchedule(seconds,maxMoves)
+        checkpoint()
+        rollback(marker)
+        commit(marker)
         
     Observer methods:
         sumProcTimes(dataList)
+        getRoomLoad(room)
+        getRoomIndex(room)
+        getRoomKey(index)
+        getRoomProcedures(index)
+        getOverflowProcedures(day)
+        getHoldingBayOccupancy(day)
+        getHoldingBayMatrix()
+        getRoomStartTimes(index)
         getTotalMinutesInLabForDay(day,lab)
         getTotalMinutesInLabForWeek(week,lab) 
 
@@ -67,29 +446,107 @@ class TimePeriod:
         packBinsForDay(day,daysProcedures)
         tryPlaceProcInLabWeek(procedure,lab,week,nextOpenRoom,openRooms)
         packBinsForWeek(week,weeksProcedures)
+        tryPlaceProc(procID,firstDay,numDays,restricted,overflowDay,dayOrWeek,day)
+        getRoomHeap(lab,firstDay,numDays,numRooms)
+        getLeastLoadedRoom(heap,duration)
+        findRoom(duration,labs,firstDay,numDays)
+        registerProcedures(procedures)
+        bookRoom(procID,index)
+        unbookRoom(procID)
+        appendToRoom(procID,index)
+        popRoomTail(index)
+        addToOverflow(procID,day)
+        removeFromOverflow(procID)
+        tryBumpFlexProc(procID,day,restricted)
+        getPlacementWindow(procID)
+        pickWindowRoom(window)
+        isWindowRoom(window,index)
+        getLoadBeforeTail(index)
+        getStayChanges(procID,index,startLoad,count)
+        getOccupancyDelta(occupancy,changes,apply)
+        getCrossoverDelta(moves)
+        getWindow(procID,windows)
+        fitsInRoom(load,duration)
+        tryInsertOverflow(procID,occupancy,windows)
+        tryMoveTail(index,occupancy,windows)
+        trySwapTails(index,occupancy,windows)
+        updateHoldingBays(procID,day,procStartTime,count)
+        getHoldingBayStays(procID,procStartTime)
+        addHoldingBayStay(day,firstSlot,numSlots,count)
+        recomputeHoldingBays()
+        iterHoldingBayStays(slotsPerHour)
+        getRoomState()
+        setRoomState(state)
+        invalidateRoomHeaps(indices)
+        setLogged(container,key,value)
+        deleteLogged(container,key)
+        appendLogged(container,value)
+        removeLogged(container,value)
+
+    State:
+        Procedures are referred to by their ID's in the ProcedureTable being scheduled
+        (self.procedures). The schedule is stored in flat arrays rather than dictionaries. Room days are
+        numbered day by day, and within a day Cath rooms come first, then EP rooms, then
+        middle rooms, so that index = day*roomsPerDay + labOffsets[lab] + room.
+            roomLoads - minutes booked per room day index
+            roomSequences - procedure IDs booked per room day index, in the order they are done
+            assignments - room day index each procedure ID was booked in (-1 if none)
+            overflowAssignments - day each procedure ID went to overflow on (-1 if none)
+            overflowOrder - procedure IDs in the order they were sent to overflow
+            holdingBayChanges - change in the number of patients in the holding bays at the
+                          start of each time slot, indexed by day*(numSlots+1) + slot.
+                          A stay costs two updates however long it is; the occupancy
+                          matrix (day*numSlots + slot) is rebuilt from it by prefix sums
+                          only when it is read (getHoldingBayMatrix)
+        self.bins gives read-only dictionary views of the same data, keyed as before.
+
+    Transactions:
+        Trial moves (bumping, swapping, re-packing) are made between checkpoint() and
+        rollback(marker) or commit(marker). While a checkpoint is open, every change to
+        the state and to the statistical counters is recorded in an undo log, so a
+        rollback costs time proportional to what the trial changed rather than to the
+        size of the time period. Checkpoints can be nested, and must be closed in the
+        reverse order they were opened.
         
     '''
     
-    def __init__(self,days,numCathRooms,numEPRooms,numMiddleRooms,numRestrictedCath,numRestrictedEP,labStartTime):
-
-        CathRooms = {(d,cathID,i):[] for i in xrange(numCathRooms) for d in xrange(days)}
-        EPRooms = {(d,epID,i):[] for i in xrange(numEPRooms) for d in xrange(days)}
-        MiddleRooms = {(d,middleID,i):[] for i in xrange(numMiddleRooms) for d in xrange(days)}
-        rooms = dict(CathRooms.items() + EPRooms.items() + MiddleRooms.items())
-        overflow = {d:[] for d in xrange(days)}
-        multiple = 60.0/resolution
-        holdingBays = {(d,i/multiple):0 for i in xrange(0,int(HBCloseTime*multiple)) for d in xrange(days)}
-
-        self.bins = [copy.deepcopy(rooms),copy.deepcopy(overflow),copy.deepcopy(holdingBays)]
-
-        self.numCathRooms = numCathRooms
-        self.numEPRooms = numEPRooms
-        self.numMiddleRooms = numMiddleRooms
-        self.numRestrictedCath = numRestrictedCath
-        self.numRestrictedEP = numRestrictedEP
+    def __init__(self,config):
+
+        self.config = config
+        self.random = random.Random(config.seed)       # private stream, so runs made side by side do not interfere
+        days = config.daysInPeriod
+
+        # layout of the rooms within a day
+        self.labOffsets = {config.cathID:0, config.epID:config.numCathRooms, config.middleID:config.numCathRooms+config.numEPRooms}
+        self.roomLabs = [config.cathID]*config.numCathRooms + [config.epID]*config.numEPRooms + [config.middleID]*config.numMiddleRooms
+        self.roomNumbers = range(config.numCathRooms) + range(config.numEPRooms) + range(config.numMiddleRooms)
+        self.roomsPerDay = len(self.roomLabs)
+        self.slotsPerHour = 60.0/config.resolution
+        self.numSlots = int(config.HBCloseTime*self.slotsPerHour)
+
+        self.roomLoads = array.array('d',[0.0])*(days*self.roomsPerDay)
+        self.holdingBayChanges = array.array('i',[0])*(days*(self.numSlots+1))
+        self.holdingBayMatrix = None                    # occupancy from the last prefix sum, None if out of date
+        self.roomSequences = [[] for i in xrange(days*self.roomsPerDay)]
+        self.procedures = []
+        self.assignments = array.array('i')
+        self.overflowAssignments = array.array('i')
+        self.overflowOrder = array.array('i')
+        self.roomHeaps = {}                             # least loaded room queues per (lab,firstDay,numDays,numRooms)
+        self.undoLog = None                             # (undo function, arguments) per change, None if no checkpoint is open
+        self.checkpointDepth = 0
+        self.profile = PackingProfile() if config.profile else None
+
+        self.bins = [RoomBinsView(self),OverflowBinsView(self),HoldingBayView(self)]
+
+        self.numCathRooms = config.numCathRooms
+        self.numEPRooms = config.numEPRooms
+        self.numMiddleRooms = config.numMiddleRooms
+        self.numRestrictedCath = config.numRestrictedCath
+        self.numRestrictedEP = config.numRestrictedEP
         self.numDays = days
         self.numWeeks = days/5
-        self.labStartTime = labStartTime
+        self.labStartTime = config.labStartTime
         self.numTotalProcs = None
         self.numSameDays = None
         self.numSameWeeks = None
@@ -97,7 +554,7 @@ class TimePeriod:
 
         # statistical counters
         self.procsPlaced = 0
-        self.procsPlacedData = []
+        self.procsPlacedData = array.array('i')     # ID's of the procedures placed, in placement order
         self.crossOverProcs = 0
         self.cathToEP = 0           # procedures historically done in Cath that are scheduled in an EP room
         self.epToCath = 0           # procedures historically done in EP that are scheduled in a Cath room
@@ -106,125 +563,292 @@ class TimePeriod:
         self.overflowMiddle = 0
         self.overflowWeeks = []
         self.overflowDays = []
+        self.overflowEntries = {}   # (day or week, True if day) recorded for each procedure ID in overflow
+        self.overflowCounts = {}    # number of procedures in overflow per (True if day, day or week)
         
 
     ##################################### BIN PACKING FOR #####################################
     #################################### WHOLE TIME PERIOD ####################################
 
-    def packBins(self,procedures,algType,weekPairs,dayPairs):
+    def packBins(self,procedures,randomInputs=None):
         '''
-        Schedules procedures into the time period.
+        Schedules procedures into the time period, following the policies in self.config.
         
-        Input: procedures (a list of cleaned procedure data for a given period of time)
-                algType (a string describing the type of scheduling algorithm to run)
+        Input: procedures (a ProcedureTable of cleaned procedure data for a given period of time)
+                randomInputs (optional: the random draws to use, as given by drawRandomInputs,
+                              so that runs under different policies can share them; drawn
+                              from self.random if not given)
         Returns: none
         '''
+        dayBuckets,weekBuckets = self.runPass('prepare',self.preparePacking,procedures,randomInputs)
+        if self.config.packingProcesses != 1 and len(self.getShards()) > 1:
+            self.runPass('parallelPacking',self.packShardsInParallel,dayBuckets,weekBuckets)
+            return
+        self.runPass('sameWeeks',self.packSameWeeks,weekBuckets)
+        self.runPass('sameDays',self.packSameDays,dayBuckets)
+        self.runPass('emergencies',self.packEmergencies,dayBuckets)
 
-        allProcs = procedures[:]
-
-        # add procedure ID's
-        for i in xrange(len(allProcs)):
-            proc = procedures[i]
-            proc.append(i)
-
-        if emergencyFlex:
-            for proc in allProcs:
-                proc[iRoom] = 2.0 if proc[iSchedHorizon]==1.0 else proc[iRoom]
-                
-        if sameDaysOnly:
-            # change all same week procedures to same day
-            for proc in allProcs:
-                original = proc[iSchedHorizon]
-                proc[iSchedHorizon] = 2.0 if original==3.0 else original
-                
-        if postProcRandom:
-            # change the post procedure time to a random value from a distribution with a given mean/standard deviation
-            for proc in allProcs:
-                postTime = random.gauss(desiredMean, desiredStDev)
-                proc[iPostTime] = postTime
-                
-        if ConvertPreProcToHours:
-            # Convert the pre procedure time to hours and then cap it to be be no more than 3 hours
-            for proc in allProcs:
-                proc[iPreTime] = proc[iPreTime]/60
-                
-        if CapHBPreProc:
-            # Cap the pre procedure time to be be no more than 3 hours
-            for proc in allProcs:
-                PreTime = min(proc[iPreTime],HBPreProcCap)
-                proc[iPreTime] = PreTime
-
-        # break procedures up by scheduling horizon
-        emergencies = [x for x in allProcs if x[iSchedHorizon]==1.0]
-        sameDay = [x for x in allProcs if x[iSchedHorizon]==2.0]
-        sameWeek = [x for x in allProcs if x[iSchedHorizon]==3.0]
-
-        self.numTotalProcs = len(emergencies)+len(sameDay)+len(sameWeek)
-        self.numSameDays = len(sameDay)
-        self.numSameWeeks = len(sameWeek)
-        self.numEmergencies = len(emergencies)
+    def runPass(self,name,method,*args):
+        '''
+        Calls a method of the packing, timing it as a pass of the profile if profiling is on.
+        Input: name (name of the pass), method (the bound method to call), args (its arguments)
+        Returns: what the method returns
+        '''
+        if self.profile is None:
+            return method(*args)
+        self.profile.startPass(name)
+        try:
+            return method(*args)
+        finally:
+            self.profile.stopPass()
+
+    def preparePacking(self,procedures,randomInputs=None):
+        '''
+        Applies the policies' transforms to a new view of the data, replaces the columns that
+        are drawn at random (e.g. post procedure times), by procedure ID, and registers the
+        result as the procedures being scheduled.
         
+        Input: procedures, randomInputs (as for packBins)
+        Returns: the procedure ID's grouped by (scheduling horizon, day) and by (scheduling
+                    horizon, week), as given by ProcedureTable.getBuckets
+        '''
+        config = self.config
+
+        allProcs = applyTransforms(procedures,getTransformStages(config))
+        if randomInputs is None:
+            randomInputs = drawRandomInputs(len(allProcs),config,self.random)
+        if randomInputs:
+            allProcs = allProcs.withColumns(randomInputs)
+        self.registerProcedures(allProcs)
+
+        # break procedures up by scheduling horizon, day and week
+        dayBuckets = allProcs.getBuckets((config.iSchedHorizon,config.iDay))
+        weekBuckets = allProcs.getBuckets((config.iSchedHorizon,config.iWeek))
+        numByHorizon = {}
+        for (horizon,d),procIDs in dayBuckets.iteritems():
+            numByHorizon[horizon] = numByHorizon.get(horizon,0) + len(procIDs)
+
+        self.numSameDays = numByHorizon.get(2.0,0)
+        self.numSameWeeks = numByHorizon.get(3.0,0)
+        self.numEmergencies = numByHorizon.get(1.0,0)
+        self.numTotalProcs = self.numEmergencies+self.numSameDays+self.numSameWeeks
+        return (dayBuckets,weekBuckets)
+
+    def packSameWeeks(self,weekBuckets,weeks=None):
+        '''
+        Input: weekBuckets (procedure ID's by (scheduling horizon, week), as given by preparePacking)
+                weeks (optional: (first, last) weeks to pack, indexed from 1, as given by
+                       getShards; all weeks if not given)
+        Returns: none
+        '''
+        config = self.config
+        columns = self.procedures.columns
+        sameWeek = lambda w: weekBuckets.get((3.0,w),[])
+        firstWeek,lastWeek = weeks or (1,self.numWeeks)
+
         # SAME WEEK procedures: two week spans
-        if weekPairs:
-            for w in range(1,timePeriod.numWeeks+1,2):
+        if config.weekPairs:
+            for w in range(firstWeek,lastWeek+1,2):
                 # last week: no weeks left to pair with
-                if w == timePeriod.numWeeks:
-                    weeksProcs = [proc for proc in sameWeek if proc[iWeek]==w]
-                    weeksProcs = self.sortProcedures(weeksProcs)
-                    self.packBinsForWeek(w-1,weeksProcs,restrictWeeks,False)
+                if w == self.numWeeks:
+                    weeksProcs = self.sortProcedures(sameWeek(w))
+                    self.packBinsForWeek(w-1,weeksProcs,config.restrictWeeks,False)
                 # pair week's procedures with the following week's and schedule over two week span
                 else:
-                    weeksProcs = [proc for proc in sameWeek if proc[iWeek]==w or proc[iWeek]==w+1]
-                    weeksProcs.sort(lambda x,y:cmp(x[iProcTime],y[iProcTime]))
-                    self.packBinsForWeek(w-1,weeksProcs,restrictWeeks,True)                   
+                    weeksProcs = list(heapq.merge(sameWeek(w),sameWeek(w+1)))
+                    weeksProcs.sort(key=columns[config.iProcTime].__getitem__)
+                    self.packBinsForWeek(w-1,weeksProcs,config.restrictWeeks,True)                   
         # SAME WEEK procedures: one week spans
         else:
-            for w in range(1,timePeriod.numWeeks+1):
-                weeksProcs = [proc for proc in sameWeek if proc[iWeek]==w]
-                weeksProcs = self.sortProcedures(weeksProcs)                 
-                self.packBinsForWeek(w-1,weeksProcs,restrictWeeks,False)
-        
+            for w in range(firstWeek,lastWeek+1):
+                weeksProcs = self.sortProcedures(sameWeek(w))
+                self.packBinsForWeek(w-1,weeksProcs,config.restrictWeeks,False)
+
+    def packSameDays(self,dayBuckets,weeks=None):
+        '''
+        Input: dayBuckets (procedure ID's by (scheduling horizon, day), as given by preparePacking)
+                weeks (optional: (first, last) weeks whose days to pack, as for packSameWeeks)
+        Returns: none
+        '''
+        config = self.config
+        sameDay = lambda d: dayBuckets.get((2.0,d),[])
+        firstDay,lastDay = self.getShardDays(weeks)
+
         # SAME DAY procedures: two day span (M,T/W,R/F)
-        if dayPairs:
-            for d in range(1,timePeriod.numDays+1):
+        if config.dayPairs:
+            for d in range(firstDay,lastDay+1):
                 # Wednesday/Friday: do not have to be handled, because they are absorbed into Tuesdays/Thursdays
                 if (d%5 == 3) or (d%5 == 0):
                     continue
                 # Monday: should not be paired
                 elif (d%5 == 1):
-                    daysSameDays = [proc for proc in sameDay if proc[iDay]==d]
-                    daysSameDays = self.sortProcedures(daysSameDays)                       
-                    self.packBinsForDay(d-1,daysSameDays,restrictDays,False)
+                    daysSameDays = self.sortProcedures(sameDay(d))
+                    self.packBinsForDay(d-1,daysSameDays,config.restrictDays,False)
                 # Tuesday/Thursday: should be paired
                 else:
-                    twoDaysProcs = [proc for proc in sameDay if proc[iDay]==d or proc[iDay]==d+1]
-                    twoDaysProcs = self.sortProcedures(twoDaysProcs)                    
-                    self.packBinsForDay(d-1,twoDaysProcs,restrictDays,True)
+                    twoDaysProcs = self.sortProcedures(heapq.merge(sameDay(d),sameDay(d+1)))
+                    self.packBinsForDay(d-1,twoDaysProcs,config.restrictDays,True)
         # SAME DAY procedures: one day span 
         else:
-            for d in range(1,timePeriod.numDays+1):
-                daysSameDays = [proc for proc in sameDay if proc[iDay]==d]
-                daysSameDays = self.sortProcedures(daysSameDays)                  
-                self.packBinsForDay(d-1,daysSameDays,restrictDays,False)
+            for d in range(firstDay,lastDay+1):
+                daysSameDays = self.sortProcedures(sameDay(d))
+                self.packBinsForDay(d-1,daysSameDays,config.restrictDays,False)
 
+    def packEmergencies(self,dayBuckets,weeks=None):
+        '''
+        Input: dayBuckets (procedure ID's by (scheduling horizon, day), as given by preparePacking)
+                weeks (optional: (first, last) weeks whose days to pack, as for packSameWeeks)
+        Returns: none
+        '''
+        config = self.config
+        emergencies = lambda d: dayBuckets.get((1.0,d),[])
+        firstDay,lastDay = self.getShardDays(weeks)
 
         # EMERGENCY procedures: day by day, one day span
-        for d in range(1,timePeriod.numDays+1):
-            daysEmergencies = [proc for proc in emergencies if proc[iDay]==d]
-            daysEmergencies = self.sortProcedures(daysEmergencies)                
-            self.packBinsForDay(d-1,daysEmergencies,restrictEmergencies,False)
-
-
-    def sortProcedures(self,procedures):
-        procs = copy.deepcopy(procedures)
-        if priority == 'shortest':
-            procs.sort(lambda x,y: cmp(x[iProcTime],y[iProcTime]))
-        elif priority == 'longest':
-            procs.sort(lambda x,y: cmp(x[iProcTime],y[iProcTime]),reverse=True)
-        elif priority == 'HBConstraints':
-            procs.sort(lambda x,y: cmp(x[iPostTime],y[iPostTime]),reverse=True) 
+        for d in range(firstDay,lastDay+1):
+            daysEmergencies = self.sortProcedures(emergencies(d))
+            self.packBinsForDay(d-1,daysEmergencies,config.restrictEmergencies,False)
+
+
+    def sortProcedures(self,procIDs):
+        '''
+        Input: procIDs (list of procedure ID's)
+
+        Returns: a new list of the ID's in the order given by the placement priority
+        '''
+        config = self.config
+        procs = list(procIDs)
+        columns = self.procedures.columns
+        if config.priority == 'shortest':
+            procs.sort(key=columns[config.iProcTime].__getitem__)
+        elif config.priority == 'longest':
+            procs.sort(key=columns[config.iProcTime].__getitem__,reverse=True)
+        elif config.priority == 'HBConstraints':
+            procs.sort(key=columns[config.iPostTime].__getitem__,reverse=True) 
         return procs
 
+
+    ##################################### PARALLEL PACKING #####################################
+    ####################################### (WEEK SHARDS) ######################################
+
+    def getShards(self):
+        '''
+        Every placement made by the three passes of packBins is within one week, or one
+        pair of weeks (1-2, 3-4, ...) if weekPairs is set, so the passes can be run on each
+        such shard of the time period on its own and give the same rooms as the whole run.
+
+        Returns: a list of (first, last) weeks of the shards, indexed from 1, in order
+        '''
+        span = 2 if self.config.weekPairs else 1
+        shards = [(w,min(w+span-1,self.numWeeks)) for w in xrange(1,self.numWeeks+1,span)]
+        return shards or [(1,0)]
+
+    def getShardDays(self,weeks=None):
+        '''
+        Input: weeks (optional: (first, last) weeks of a shard, as given by getShards)
+        Returns: the (first, last) days of the shard, indexed from 1; the last shard also has
+                    any days after the last whole week. All days if weeks is not given.
+        '''
+        if weeks is None:
+            return (1,self.numDays)
+        firstWeek,lastWeek = weeks
+        lastDay = self.numDays if lastWeek == self.numWeeks else lastWeek*5
+        return ((firstWeek-1)*5+1,lastDay)
+
+    def packShardsInParallel(self,dayBuckets,weekBuckets):
+        '''
+        Packs the shards of the time period (see getShards) in a pool of
+        config.packingProcesses worker processes (None for one per core) and merges
+        their results in shard order. Since the shards share no rooms, and the lists kept in
+        placement order are merged pass by pass, the result is identical to the serial one.
+        Consecutive shards are packed together in blocks, two per process, as each block
+        costs a full size TimePeriod in its worker.
+        If profiling, the workers' counters are added to this time period's profile under
+        their passes (their seconds summed over the workers).
+        Input: dayBuckets, weekBuckets (as given by preparePacking)
+        Returns: none
+        '''
+        config = self.config
+        shards = self.getShards()
+        numBlocks = min(len(shards),2*(config.packingProcesses or multiprocessing.cpu_count()))
+        blocks = []
+        for b in xrange(numBlocks):
+            blockShards = shards[b*len(shards)//numBlocks:(b+1)*len(shards)//numBlocks]
+            weeks = (blockShards[0][0],blockShards[-1][1])
+            firstDay,lastDay = self.getShardDays(weeks)
+            blockDays = dict((key,procIDs) for key,procIDs in dayBuckets.iteritems() if firstDay <= key[1] <= lastDay)
+            blockWeeks = dict((key,procIDs) for key,procIDs in weekBuckets.iteritems() if weeks[0] <= key[1] <= weeks[1])
+            blocks.append((weeks,blockDays,blockWeeks))
+
+        pool = multiprocessing.Pool(config.packingProcesses,initShardWorker,(config,self.procedures.columns))
+        try:
+            states = pool.map(packShard,blocks,1)
+        finally:
+            pool.close()
+            pool.join()
+
+        for p in xrange(3):
+            for state in states:
+                self.mergeShardState(state,p)
+
+    def getShardState(self,weeks,marks):
+        '''
+        Input: weeks (the (first, last) weeks packed into this time period)
+                marks (lengths of the lists kept in placement order after each pass)
+        Returns: what the packing changed, in the shard's days only, for mergeShardState
+        '''
+        firstDay,lastDay = self.getShardDays(weeks)
+        firstRoom,endRoom = (firstDay-1)*self.roomsPerDay,lastDay*self.roomsPerDay
+        firstChange,endChange = (firstDay-1)*(self.numSlots+1),lastDay*(self.numSlots+1)
+        counters = ['procsPlaced','crossOverProcs','cathToEP','epToCath','overflowCath','overflowEP','overflowMiddle']
+        return {
+            'rooms':(firstRoom,self.roomLoads[firstRoom:endRoom],self.roomSequences[firstRoom:endRoom]),
+            'holdingBays':(firstChange,self.holdingBayChanges[firstChange:endChange]),
+            'assignments':[(procID,self.assignments[procID]) for procID in self.procsPlacedData],
+            'overflow':[(procID,self.overflowAssignments[procID]) for procID in self.overflowOrder],
+            'overflowEntries':self.overflowEntries,
+            'overflowCounts':self.overflowCounts,
+            'ordered':dict((name,getattr(self,name)) for name in ['procsPlacedData','overflowOrder','overflowWeeks','overflowDays']),
+            'marks':marks,
+            'counters':dict((name,getattr(self,name)) for name in counters),
+            'profile':self.profile and self.profile.passes,
+            }
+
+    def mergeShardState(self,state,p):
+        '''
+        Merges what a shard's packing changed into this time period, one pass at a time:
+        the shard's rooms and counts with its first pass, and each pass's share of the lists
+        kept in placement order, so that merging every shard for pass 0, then 1, then 2
+        puts them in the serial order.
+        Input: state (as given by getShardState), p (the pass, 0 to 2)
+        Returns: none
+        '''
+        for name,values in state['ordered'].iteritems():
+            start = state['marks'][p-1][name] if p > 0 else 0
+            getattr(self,name).extend(values[start:state['marks'][p][name]])
+        if p > 0:
+            return
+
+        firstRoom,roomLoads,roomSequences = state['rooms']
+        self.roomLoads[firstRoom:firstRoom+len(roomLoads)] = roomLoads
+        self.roomSequences[firstRoom:firstRoom+len(roomSequences)] = roomSequences
+        firstChange,changes = state['holdingBays']
+        self.holdingBayChanges[firstChange:firstChange+len(changes)] = changes
+        self.holdingBayMatrix = None
+        for procID,index in state['assignments']:
+            self.assignments[procID] = index
+        for procID,day in state['overflow']:
+            self.overflowAssignments[procID] = day
+        self.overflowEntries.update(state['overflowEntries'])
+        self.overflowCounts.update(state['overflowCounts'])
+        for name,value in state['counters'].iteritems():
+            setattr(self,name,getattr(self,name)+value)
+        if self.profile is not None and state['profile']:
+            for name,counters in state['profile'].iteritems():
+                merged = self.profile.getCounters(name)
+                for counter,value in counters.iteritems():
+                    merged[counter] = max(merged[counter],value) if counter == 'domainMax' else merged[counter]+value
+
     ######################################## SUMMARY STAT ########################################
     ########################################## METHODS ###########################################
 
@@ -317,23 +941,25 @@ class TimePeriod:
 
         return (overflowWeeks,overflowProcs)
 
-    def getProcsByMinuteVolume(self,allProcs):
+    def getProcsByMinuteVolume(self,procIDs):
         '''
-        '''
-        emergencies = [x for x in allProcs if x[iSchedHorizon]==1.0]
-        sameDay = [x for x in allProcs if x[iSchedHorizon]==2.0]
-        sameWeek = [x for x in allProcs if x[iSchedHorizon]==3.0]
-
-        emergFlex = [x for x in emergencies if x[iRoom]==2.0]
-        emergInflex = [x for x in emergencies if x[iRoom]!=2.0]
-
-        sameDayFlex = [x for x in sameDay if x[iRoom]==2.0]
-        sameDayInflex = [x for x in sameDay if x[iRoom]!=2.0]
-
-        sameWeekFlex = [x for x in sameWeek if x[iRoom]==2.0]
-        sameWeekInflex = [x for x in sameWeek if x[iRoom]!=2.0]
+        Input: procIDs (iterable of procedure ID's)
 
-        return [self.sumProcTimes(x) for x in [emergFlex,emergInflex,sameDayFlex,sameDayInflex,sameWeekFlex,sameWeekInflex]]
+        Returns: the total procedure minutes of the given procedures, broken down into
+                    [emergency flex, emergency inflex, same day flex, same day inflex,
+                    same week flex, same week inflex]
+        '''
+        config = self.config
+        columns = self.procedures.columns
+        horizons = columns[config.iSchedHorizon]
+        rooms = columns[config.iRoom]
+        procTimes = columns[config.iProcTime]
+        minutes = [0]*6
+        for i in procIDs:
+            if horizons[i] in (1.0,2.0,3.0):
+                group = 2*(int(horizons[i])-1) + (0 if rooms[i]==2.0 else 1)
+                minutes[group] += procTimes[i]
+        return minutes
 
 
 
@@ -346,85 +972,947 @@ class TimePeriod:
         
         Returns: the sum of the procedure times in dataList
         '''
-        timeDataOnly = [dataList[i][iProcTime] for i in range(len(dataList))]
+        config = self.config
+        timeDataOnly = [dataList[i][config.iProcTime] for i in range(len(dataList))]
         
         return sum(timeDataOnly)
 
+    def getRoomLoad(self,room):
+        '''
+        Input: room (a (day,lab,room) key into the room bins)
 
-    def eliminateRoomsByTimeLimit(self,initialDomain,procedure):
+        Returns: the total minutes already booked in that room day
         '''
+        return self.roomLoads[self.getRoomIndex(room)]
+
+    def getRoomIndex(self,room):
         '''
-        duration = procedure[iProcTime]
-        domain = copy.deepcopy(initialDomain)
-        toRemove = set()
-        for room in domain:
-            roomTime = self.sumProcTimes(self.bins[0][room])
-            if roomTime > closeCap or roomTime+procedure[iProcTime] > totalTimeRoom:
-                toRemove.add(room)
-        domain -= toRemove
-        return domain
+        Input: room (a (day,lab,room) key into the room bins)
 
-    def updateHoldingBays(self,procedure,day,roomBooked):
+        Returns: the integer index of that room day in the state arrays
         '''
+        config = self.config
+        day,lab,r = room
+        numRooms = {config.cathID:self.numCathRooms, config.epID:self.numEPRooms, config.middleID:self.numMiddleRooms}.get(lab,0)
+        if not (0 <= day < self.numDays and 0 <= r < numRooms):
+            raise KeyError(room)
+        return day*self.roomsPerDay + self.labOffsets[lab] + r
+
+    def getRoomKey(self,index):
         '''
-        # add counters to holding bay
-        procStartTime = self.labStartTime + (self.sumProcTimes(roomBooked)-procedure[iProcTime])/60.0
-        preHoldingStart = procStartTime - procedure[iPreTime]
-        postHoldingStart = procStartTime + procedure[iProcTime]/60.0
-        postHoldingEnd = postHoldingStart + procedure[iPostTime]
+        Input: index (integer index of a room day in the state arrays)
 
-        # multipliers to round up/down to nearest resolution
-        fraction = resolution/60.0
-        multiple = 60.0/resolution
-        preHoldingStartRound = fraction*math.floor(multiple*preHoldingStart)
-        preHoldingEndRound = fraction*math.ceil(multiple*procStartTime)
-        postHoldingStartRound = fraction*math.floor(multiple*postHoldingStart)
-        postHoldingEndRound = fraction*math.ceil(multiple*postHoldingEnd)
+        Returns: the (day,lab,room) key of that room day
+        '''
+        day,position = divmod(index,self.roomsPerDay)
+        return (day,self.roomLabs[position],self.roomNumbers[position])
 
-        numPreSlots = (preHoldingEndRound-preHoldingStartRound)/fraction
-        numPostSlots = (postHoldingEndRound-postHoldingStartRound)/fraction
+    def getRoomProcedures(self,index):
+        '''
+        Input: index (integer index of a room day in the state arrays)
 
-        for i in range(int(numPreSlots)):
-            self.bins[2][(day,preHoldingStartRound+(i*fraction))] += 1
-        
-        #The if statement is meant to prevent Dict Key errors when a patient's recovery time 
-        #is so long as to exceed the number of available holdingBay slots.
-        #However it doesn't quite work and instead I've increased the number of holding bay
-        #slots to prevent this error
-        #if postHoldingStartRound+(int(numPostSlots)*fraction) <= int(HBCloseTime*multiple):
-        for j in range(int(numPostSlots)):
-            self.bins[2][(day,postHoldingStartRound+(j*fraction))] += 1
-        #else:
-        #  for j in range(int(HBCloseTime*multiple)):
-        #      holdingBays[postHoldingStartRound+(j*fraction)] += 1
-
-    def updateOverflowStats(self,procOverflow,dayOrWeek,day=True):
-        if procOverflow[iRoom] == 3.0:
-            self.overflowMiddle += 1
-        elif procOverflow[iLab] == cathID:
-            self.overflowCath += 1
-        elif procOverflow[iLab] == epID:
-            self.overflowEP += 1
-
-        if (day and dayOrWeek not in self.overflowDays):
-            self.overflowDays.append(dayOrWeek)
-        elif (not day and dayOrWeek not in self.overflowWeeks):
-            self.overflowWeeks.append(dayOrWeek)
-
-    def updateProcsPlacedStats(self,procedure):
-        self.procsPlaced += 1
-        self.procsPlacedData.append(procedure)
-
-    def updateCrossoverStats(self,procedure,placedLabID):
-        originalLab = procedure[iLab]
+        Returns: a new list of the procedures booked in that room day, in the order they are done
+        '''
+        return [self.procedures[procID] for procID in self.roomSequences[index]]
+
+    def getOverflowProcedures(self,day):
+        '''
+        Input: day (integer day of time period, indexed from 0)
+
+        Returns: a new list of the procedures that went to overflow on that day
+        '''
+        return [self.procedures[procID] for procID in self.overflowOrder if self.overflowAssignments[procID]==day]
+
+    def getRoomStartTimes(self,index):
+        '''
+        Input: index (integer index of a room day in the state arrays)
+
+        Returns: (list of the start times of the room day's procedures in hours, total
+                    minutes booked), adding up the procedure times in the order they are
+                    done exactly as booking them one by one does
+        '''
+        config = self.config
+        procTimes = self.procedures.columns[config.iProcTime]
+        load = 0.0
+        startTimes = []
+        for procID in self.roomSequences[index]:
+            load += procTimes[procID]
+            startTimes.append(self.labStartTime + (load-procTimes[procID])/60.0)
+        return (startTimes,load)
+
+    def getHoldingBayOccupancy(self,day):
+        '''
+        Input: day (integer day of time period, indexed from 0)
+
+        Returns: a list of the number of patients in the holding bays per time slot of that day
+        '''
+        return self.getHoldingBayMatrix()[day*self.numSlots:(day+1)*self.numSlots].tolist()
+
+    def getHoldingBayMatrix(self):
+        '''
+        Takes the prefix sums of the holding bay changes, if any stays were added since
+        they were last taken.
+
+        Returns: an array of the number of patients in the holding bays per day and time
+                    slot, indexed by day*numSlots + slot
+        '''
+        if self.holdingBayMatrix is None:
+            changes = self.holdingBayChanges
+            matrix = array.array('i',[0])*(self.numDays*self.numSlots)
+            for d in xrange(self.numDays):
+                rowStart = d*(self.numSlots+1)
+                matrixStart = d*self.numSlots
+                count = 0
+                for i in xrange(self.numSlots):
+                    count += changes[rowStart+i]
+                    matrix[matrixStart+i] = count
+            self.holdingBayMatrix = matrix
+        return self.holdingBayMatrix
+
+
+    def getRoomHeap(self,lab,firstDay,numDays,numRooms):
+        '''
+        Returns the priority queue of the first numRooms rooms of a lab over the days
+        firstDay to firstDay+numDays-1, ordered by the minutes already booked. Equally
+        loaded rooms are taken by room number, then by day, so the first procedures of a
+        window go to the first room of each of its days in turn. Queues are built the first
+        time a window is requested and reused afterwards.
+        Input: lab (lab ID of the rooms)
+                firstDay (integer first day of the window, indexed from 0)
+                numDays (integer number of days in the window)
+                numRooms (integer number of the lab's rooms that may be used)
+        Returns: a heap of [minutes booked, tie-break rank, room day index] entries
+        '''
+        window = (lab,firstDay,numDays,numRooms)
+        if window not in self.roomHeaps:
+            offset = self.labOffsets[lab]
+            indices = [d*self.roomsPerDay+offset+r for r in xrange(numRooms) for d in xrange(firstDay,firstDay+numDays)]
+            heap = [[self.roomLoads[i],rank,i] for rank,i in enumerate(indices)]
+            heapq.heapify(heap)
+            self.roomHeaps[window] = heap
+        return self.roomHeaps[window]
+
+    def getLeastLoadedRoom(self,heap,duration):
+        '''
+        Finds the room with the shortest amount of time already scheduled in a room queue,
+        provided the procedure still fits in it. Rooms that have passed the closing cap are
+        dropped from the queue for good, since room loads never decrease.
+        Input: heap (a room queue, as returned by getRoomHeap)
+                duration (the procedure time of the procedure to be placed)
+        Returns: the room day index of the room, or None if no room fits
+        '''
+        config = self.config
+        while heap:
+            entry = heap[0]
+            room = entry[2]
+            roomTime = self.roomLoads[room]
+            # the room was booked through another window's queue: refresh its position
+            if roomTime != entry[0]:
+                heapq.heapreplace(heap,[roomTime,entry[1],room])
+            elif roomTime > config.closeCap:
+                heapq.heappop(heap)
+                if self.profile is not None:
+                    self.profile.recordClosedRoom()
+            elif roomTime+duration > config.totalTimeRoom:
+                if self.profile is not None:
+                    self.profile.recordTimeLimitRejection()
+                return None
+            else:
+                return room
+        return None
+
+    def findRoom(self,duration,labs,firstDay,numDays):
+        '''
+        Input: duration (the procedure time of the procedure to be placed)
+                labs (list of (lab,numRooms) pairs the procedure may be placed in)
+                firstDay (integer first day of the window, indexed from 0)
+                numDays (integer number of days in the window)
+        Returns: the room day index of the least loaded room the procedure fits in,
+                    or None if there is none
+        '''
+        best = None
+        for lab,numRooms in labs:
+            if numRooms == 0:
+                continue
+            room = self.getLeastLoadedRoom(self.getRoomHeap(lab,firstDay,numDays,numRooms),duration)
+            # on equal loads the lab listed first, the procedure's own, is kept
+            if room is not None and (best is None or self.roomLoads[room] < self.roomLoads[best]):
+                best = room
+        return best
+
+    def invalidateRoomHeaps(self,indices):
+        '''
+        Drops the room queues containing any of the given room days. Queues only handle
+        room loads going up, so they are rebuilt when next needed after a load goes down.
+        Input: indices (iterable of room day indices whose loads went down)
+        Returns: none
+        '''
+        rooms = [self.getRoomKey(index) for index in indices]
+        if not rooms:
+            return
+        for window in self.roomHeaps.keys():
+            lab,firstDay,numDays,numRooms = window
+            for day,roomLab,r in rooms:
+                if roomLab==lab and firstDay <= day < firstDay+numDays and r < numRooms:
+                    del self.roomHeaps[window]
+                    break
+
+    def registerProcedures(self,procedures):
+        '''
+        Sizes the assignment arrays for the procedures to be scheduled.
+        Input: procedures (a ProcedureTable of procedure data)
+        Returns: none
+        '''
+        self.procedures = procedures
+        self.assignments = array.array('i',[-1])*len(procedures)
+        self.overflowAssignments = array.array('i',[-1])*len(procedures)
+        self.overflowOrder = array.array('i')
+
+    def bookRoom(self,procID,index):
+        '''
+        Adds a procedure to the end of a room day's schedule and updates the room load,
+        the summary statistics and the holding bays accordingly.
+        Input: procID (ID of the procedure to be placed)
+                index (the integer index of the room day to book)
+        Returns: none
+        '''
+        self.appendToRoom(procID,index)
+        self.updateProcsPlacedStats(procID)
+
+    def appendToRoom(self,procID,index):
+        '''
+        Adds a procedure to the end of a room day's schedule as bookRoom does, without
+        counting it as placed again, e.g. when moving it from another room day.
+        Input: procID (ID of the procedure), index (the integer index of the room day)
+        Returns: none
+        '''
+        config = self.config
+        procTime = self.procedures.columns[config.iProcTime][procID]
+        self.setLogged(self.assignments,procID,index)
+        self.appendLogged(self.roomSequences[index],procID)
+        self.setLogged(self.roomLoads,index,self.roomLoads[index]+procTime)
+        self.updateCrossoverStats(procID,self.roomLabs[index%self.roomsPerDay])
+        procStartTime = self.labStartTime + (self.roomLoads[index]-procTime)/60.0
+        self.updateHoldingBays(procID,index/self.roomsPerDay,procStartTime)
+
+    def popRoomTail(self,index):
+        '''
+        Takes the last procedure out of a room day, to be appended to another. No other
+        procedure's start time changes. The room load is added up again from the
+        procedures left, so that it is exactly what booking them one by one gives.
+        Input: index (the integer index of a room day with procedures booked)
+        Returns: the ID of the procedure taken out
+        '''
+        config = self.config
+        procTimes = self.procedures.columns[config.iProcTime]
+        sequence = self.roomSequences[index]
+        procID = sequence[-1]
+        procStartTime = self.labStartTime + (self.roomLoads[index]-procTimes[procID])/60.0
+        self.updateHoldingBays(procID,index/self.roomsPerDay,procStartTime,-1)
+        self.removeLogged(sequence,procID)
+        self.setLogged(self.roomLoads,index,self.getRoomStartTimes(index)[1])
+        self.setLogged(self.assignments,procID,-1)
+        self.updateCrossoverStats(procID,self.roomLabs[index%self.roomsPerDay],-1)
+        return procID
+
+    def unbookRoom(self,procID):
+        '''
+        Takes a booked procedure out of its room day. The procedures done after it in that
+        room move earlier, and their holding bay stays move with them.
+        Input: procID (ID of a booked procedure)
+        Returns: the room day index the procedure was booked in
+        '''
+        index = self.assignments[procID]
+        day = index/self.roomsPerDay
+        sequence = self.roomSequences[index]
+        position = sequence.index(procID)
+
+        # take the stays of the procedure and of the ones after it out of the holding bays
+        startTimes,load = self.getRoomStartTimes(index)
+        for k in xrange(position,len(sequence)):
+            self.updateHoldingBays(sequence[k],day,startTimes[k],-1)
+        self.removeLogged(sequence,procID)
+        # put the later procedures back in at their new start times
+        startTimes,load = self.getRoomStartTimes(index)
+        for k in xrange(position,len(sequence)):
+            self.updateHoldingBays(sequence[k],day,startTimes[k])
+
+        self.setLogged(self.roomLoads,index,load)
+        self.setLogged(self.assignments,procID,-1)
+        self.setLogged(self.__dict__,'procsPlaced',self.procsPlaced-1)
+        self.removeLogged(self.procsPlacedData,procID)
+        self.updateCrossoverStats(procID,self.roomLabs[index%self.roomsPerDay],-1)
+        self.invalidateRoomHeaps([index])
+        return index
+
+    def addToOverflow(self,procID,day):
+        '''
+        Input: procID (ID of the procedure that could not be placed)
+                day (integer day whose overflow the procedure is listed under, indexed from 0)
+        Returns: none
+        '''
+        self.setLogged(self.overflowAssignments,procID,day)
+        self.appendLogged(self.overflowOrder,procID)
+
+    def removeFromOverflow(self,procID):
+        '''
+        Takes a procedure out of overflow and out of the overflow statistics, e.g. before
+        booking it after all.
+        Input: procID (ID of a procedure in overflow)
+        Returns: none
+        '''
+        dayOrWeek,day = self.overflowEntries[procID]
+        self.setLogged(self.overflowAssignments,procID,-1)
+        self.removeLogged(self.overflowOrder,procID)
+        self.updateOverflowStats(procID,dayOrWeek,day,-1)
+
+    def updateHoldingBays(self,procID,day,procStartTime,count=1):
+        '''
+        Adds a procedure's pre and post procedure stays to the holding bays.
+        Input: procID (ID of a booked procedure)
+                day (integer day of time period the procedure is done, indexed from 0)
+                procStartTime (time of day the procedure starts, in hours)
+                count (1 to add the stays, -1 to take them back out)
+        Returns: none
+        '''
+        preFirstSlot,numPreSlots,postFirstSlot,numPostSlots = self.getHoldingBayStays(procID,procStartTime)
+        self.addHoldingBayStay(day,preFirstSlot,numPreSlots,count)
+        self.addHoldingBayStay(day,postFirstSlot,numPostSlots,count)
+
+    def getHoldingBayStays(self,procID,procStartTime):
+        '''
+        Input: procID (ID of a booked procedure)
+                procStartTime (time of day the procedure starts, in hours)
+        Returns: (first slot, number of slots) of the pre procedure stay followed by
+                    (first slot, number of slots) of the post procedure stay, rounded out
+                    to whole holding bay time slots
+        '''
+        config = self.config
+        columns = self.procedures.columns
+        preHoldingStart = procStartTime - columns[config.iPreTime][procID]
+        postHoldingStart = procStartTime + columns[config.iProcTime][procID]/60.0
+        postHoldingEnd = postHoldingStart + columns[config.iPostTime][procID]
+
+        # round down/up to the nearest resolution
+        multiple = self.slotsPerHour
+        preFirstSlot = int(math.floor(multiple*preHoldingStart))
+        postFirstSlot = int(math.floor(multiple*postHoldingStart))
+        numPreSlots = int(math.ceil(multiple*procStartTime)) - preFirstSlot
+        numPostSlots = int(math.ceil(multiple*postHoldingEnd)) - postFirstSlot
+        return (preFirstSlot,numPreSlots,postFirstSlot,numPostSlots)
+
+    def addHoldingBayStay(self,day,firstSlot,numSlots,count=1):
+        '''
+        Input: day (integer day of time period, indexed from 0)
+                firstSlot (integer holding bay time slot the stay starts in, indexed from 0)
+                numSlots (integer number of time slots the stay lasts)
+                count (number of patients staying, negative to take patients out)
+        Returns: none
+        '''
+        if numSlots <= 0:
+            return
+        if self.profile is not None:
+            self.profile.recordHoldingBayStay(numSlots)
+        # slots outside of the holding bay's opening hours do not exist. Patients whose
+        # recovery time exceeds the available slots need a later HBCloseTime
+        if firstSlot < 0:
+            raise KeyError((day,firstSlot/self.slotsPerHour))
+        if firstSlot+numSlots > self.numSlots:
+            raise KeyError((day,self.numSlots/self.slotsPerHour))
+        start = day*(self.numSlots+1)+firstSlot
+        end = start+numSlots
+        self.setLogged(self.holdingBayChanges,start,self.holdingBayChanges[start]+count)
+        self.setLogged(self.holdingBayChanges,end,self.holdingBayChanges[end]-count)
+        self.holdingBayMatrix = None
+
+    def recomputeHoldingBays(self):
+        '''
+        Rebuilds the holding bay occupancy of the whole time period from the final room
+        assignments in a single pass over the room days, e.g. after procedure data that
+        only affects the holding bays has changed. The new changes array is built on its
+        own and swapped in whole, so only the swap is recorded if a checkpoint is open.
+
+        Returns: the occupancy array, as given by getHoldingBayMatrix()
+        '''
+        rowLength = self.numSlots+1
+        changes = array.array('i',[0])*(self.numDays*rowLength)
+        for day,firstSlot,numSlots in self.iterHoldingBayStays(self.slotsPerHour):
+            # as in addHoldingBayStay
+            if numSlots <= 0:
+                continue
+            if firstSlot < 0:
+                raise KeyError((day,firstSlot/self.slotsPerHour))
+            if firstSlot+numSlots > self.numSlots:
+                raise KeyError((day,self.numSlots/self.slotsPerHour))
+            changes[day*rowLength+firstSlot] += 1
+            changes[day*rowLength+firstSlot+numSlots] -= 1
+        self.setLogged(self.__dict__,'holdingBayChanges',changes)
+        self.holdingBayMatrix = None
+        return self.getHoldingBayMatrix()
+
+    def iterHoldingBayStays(self,slotsPerHour):
+        '''
+        Goes through the pre and post procedure stays of every booked procedure, room day by
+        room day, rounded out to whole time slots of the given length as getHoldingBayStays
+        does (a stay takes up every slot it overlaps).
+        Input: slotsPerHour (number of time slots per hour)
+        Returns: a generator of (day, first slot, number of slots) of the stays, including the
+                    stays of no time (e.g. no pre procedure time) that fall on a slot boundary
+                    and so take up no slot
+        '''
+        config = self.config
+        columns = self.procedures.columns
+        procTimes = columns[config.iProcTime]
+        preTimes = columns[config.iPreTime]
+        postTimes = columns[config.iPostTime]
+        floor,ceil = math.floor,math.ceil
+        for index in xrange(len(self.roomSequences)):
+            sequence = self.roomSequences[index]
+            if not sequence:
+                continue
+            day = index/self.roomsPerDay
+            # start times added up in the order the procedures are done, as bookRoom does
+            load = 0.0
+            for procID in sequence:
+                procTime = procTimes[procID]
+                load += procTime
+                # the stays as given by getHoldingBayStays, worked out inline
+                procStartTime = self.labStartTime + (load-procTime)/60.0
+                postHoldingStart = procStartTime + procTime/60.0
+                preFirstSlot = int(floor(slotsPerHour*(procStartTime-preTimes[procID])))
+                postFirstSlot = int(floor(slotsPerHour*postHoldingStart))
+                numPreSlots = int(ceil(slotsPerHour*procStartTime)) - preFirstSlot
+                numPostSlots = int(ceil(slotsPerHour*(postHoldingStart+postTimes[procID]))) - postFirstSlot
+                yield (day,preFirstSlot,numPreSlots)
+                yield (day,postFirstSlot,numPostSlots)
+
+    def getRoomState(self):
+        '''
+        Returns: the room assignments of the time period and the statistical counters that
+                    go with them, everything the packing decides apart from the holding bays,
+                    which follow from it (see recomputeHoldingBays). Arrays and lists are
+                    returned as they are, not copied.
+        '''
+        state = dict((name,getattr(self,name)) for name in roomStateNames)
+        state['roomSequences'] = self.roomSequences
+        state['overflowEntries'] = self.overflowEntries
+        state['overflowCounts'] = self.overflowCounts
+        return state
+
+    def setRoomState(self,state):
+        '''
+        Sets the room assignments and counters of the time period to copies of those in
+        state, for a time period with the same rooms and procedures. The holding bays are
+        left as they are, to be recomputed.
+        Input: state (as given by getRoomState)
+        Returns: none
+        '''
+        for name in roomStateNames:
+            value = state[name]
+            setattr(self,name,copy.copy(value) if isinstance(value,(list,array.array)) else value)
+        self.roomSequences = [list(sequence) for sequence in state['roomSequences']]
+        self.overflowEntries = dict(state['overflowEntries'])
+        self.overflowCounts = dict(state['overflowCounts'])
+        self.roomHeaps = {}
+
+    def updateOverflowStats(self,procID,dayOrWeek,day=True,count=1):
+        config = self.config
+        columns = self.procedures.columns
+        if columns[config.iRoom][procID] == 3.0:
+            self.setLogged(self.__dict__,'overflowMiddle',self.overflowMiddle+count)
+        elif columns[config.iLab][procID] == config.cathID:
+            self.setLogged(self.__dict__,'overflowCath',self.overflowCath+count)
+        elif columns[config.iLab][procID] == config.epID:
+            self.setLogged(self.__dict__,'overflowEP',self.overflowEP+count)
+
+        if count > 0:
+            self.setLogged(self.overflowEntries,procID,(dayOrWeek,day))
+        else:
+            self.deleteLogged(self.overflowEntries,procID)
+        key = (day,dayOrWeek)
+        numOverflow = self.overflowCounts.get(key,0)
+        self.setLogged(self.overflowCounts,key,numOverflow+count)
+        overflowPeriods = self.overflowDays if day else self.overflowWeeks
+        if numOverflow == 0 and count > 0:
+            self.appendLogged(overflowPeriods,dayOrWeek)
+        elif numOverflow+count == 0:
+            self.removeLogged(overflowPeriods,dayOrWeek)
+
+    def updateProcsPlacedStats(self,procID):
+        self.setLogged(self.__dict__,'procsPlaced',self.procsPlaced+1)
+        self.appendLogged(self.procsPlacedData,procID)
+
+    def updateCrossoverStats(self,procID,placedLabID,count=1):
+        config = self.config
+        originalLab = self.procedures.columns[config.iLab][procID]
         if originalLab != placedLabID:
-            self.crossOverProcs += 1
-            if originalLab == cathID:
-                self.cathToEP += 1
+            self.setLogged(self.__dict__,'crossOverProcs',self.crossOverProcs+count)
+            if originalLab == config.cathID:
+                self.setLogged(self.__dict__,'cathToEP',self.cathToEP+count)
             else:
-                self.epToCath += 1
-        
-        
+                self.setLogged(self.__dict__,'epToCath',self.epToCath+count)
+
+
+    ######################################## TRANSACTIONS ########################################
+    ########################################## (UNDO LOG) ##########################################
+
+    def checkpoint(self):
+        '''
+        Starts recording changes to the time period so that they can be undone.
+
+        Returns: a marker to pass to rollback or commit
+        '''
+        if self.undoLog is None:
+            self.undoLog = []
+        self.checkpointDepth += 1
+        return len(self.undoLog)
+
+    def rollback(self,marker):
+        '''
+        Undoes every change made since the checkpoint that returned marker, and closes
+        that checkpoint.
+        Input: marker (as returned by checkpoint())
+        Returns: none
+        '''
+        log = self.undoLog
+        changedRooms = set()
+        while len(log) > marker:
+            undo,args = log.pop()
+            if getattr(undo,'__self__',None) is self.roomLoads:
+                changedRooms.add(args[0])
+            undo(*args)
+        self.holdingBayMatrix = None
+        self.invalidateRoomHeaps(changedRooms)
+        self.closeCheckpoint()
+
+    def commit(self,marker):
+        '''
+        Keeps the changes made since the checkpoint that returned marker, and closes that
+        checkpoint. They can still be undone by rolling back an enclosing checkpoint.
+        Input: marker (as returned by checkpoint())
+        Returns: none
+        '''
+        self.closeCheckpoint()
+
+    def closeCheckpoint(self):
+        self.checkpointDepth -= 1
+        if self.checkpointDepth == 0:
+            self.undoLog = None
+
+    def setLogged(self,container,key,value):
+        '''
+        Sets container[key] = value, recording how to undo it if a checkpoint is open.
+        Counters of the time period are set through self.__dict__.
+        '''
+        if self.undoLog is not None:
+            if isinstance(container,dict) and key not in container:
+                self.undoLog.append((container.pop,(key,)))
+            else:
+                self.undoLog.append((container.__setitem__,(key,container[key])))
+        container[key] = value
+
+    def deleteLogged(self,container,key):
+        '''
+        Deletes a dictionary entry, recording how to undo it if a checkpoint is open.
+        '''
+        if self.undoLog is not None:
+            self.undoLog.append((container.__setitem__,(key,container[key])))
+        del container[key]
+
+    def appendLogged(self,container,value):
+        '''
+        Appends to a list or array, recording how to undo it if a checkpoint is open.
+        '''
+        if self.undoLog is not None:
+            self.undoLog.append((container.pop,()))
+        container.append(value)
+
+    def removeLogged(self,container,value):
+        '''
+        Removes the first occurrence of a value from a list or array, recording how to
+        undo it if a checkpoint is open.
+        '''
+        position = container.index(value)
+        if self.undoLog is not None:
+            self.undoLog.append((container.insert,(position,value)))
+        del container[position]
+
+
+    ###################################### OVERFLOW RECOVERY ######################################
+    ########################################### (BUMPING) ###########################################
+
+    def recoverOverflow(self):
+        '''
+        Tries to place every procedure left in overflow after packBins by bumping a
+        flexible procedure out of its lab into the other lab on the same day. Middle room
+        procedures and the NoCrossovers policy are left alone.
+
+        Returns: the number of overflow procedures that were placed
+        '''
+        config = self.config
+        if config.crossoverType == 'NoCrossovers':
+            return 0
+        horizons = self.procedures.columns[config.iSchedHorizon]
+        restrictedByHorizon = {1.0:config.restrictEmergencies, 2.0:config.restrictDays, 3.0:config.restrictWeeks}
+        numRecovered = 0
+        for procID in self.overflowOrder.tolist():
+            if self.procedures.columns[config.iRoom][procID] == 3.0:
+                continue
+            dayOrWeek,day = self.overflowEntries[procID]
+            days = [dayOrWeek] if day else range(dayOrWeek*5,min(dayOrWeek*5+5,self.numDays))
+            restricted = restrictedByHorizon.get(horizons[procID],False)
+            for d in days:
+                if self.tryBumpFlexProc(procID,d,restricted):
+                    numRecovered += 1
+                    break
+        return numRecovered
+
+    def tryBumpFlexProc(self,procID,day,restricted):
+        '''
+        Tries to make room for an overflow procedure on a given day by moving one of the
+        flexible procedures booked in its lab that day to a room in the other lab. Each
+        trial move is made inside a checkpoint and rolled back if either procedure does
+        not fit.
+        Input: procID (ID of a procedure in overflow)
+                day (integer day of time period to place it on, indexed from 0)
+                restricted (a boolean value, denoting whether or not to restrict the scheduling to certain Cath/EP rooms)
+        Returns: True if the procedure was placed, False otherwise
+        '''
+        config = self.config
+        columns = self.procedures.columns
+        lab = columns[config.iLab][procID]
+        otherLab = config.cathID if lab==config.epID else config.epID
+        if not restricted:
+            labRooms = self.numCathRooms if lab==config.cathID else self.numEPRooms
+            otherLabRooms = self.numCathRooms if otherLab==config.cathID else self.numEPRooms
+        else:
+            labRooms = self.numRestrictedCath if lab==config.cathID else self.numRestrictedEP
+            otherLabRooms = self.numRestrictedCath if otherLab==config.cathID else self.numRestrictedEP
+
+        firstRoom = day*self.roomsPerDay + self.labOffsets[lab]
+        procsToTry = [x for index in xrange(firstRoom,firstRoom+labRooms) for x in self.roomSequences[index] if columns[config.iRoom][x]==2.0]
+
+        for bumped in procsToTry:
+            marker = self.checkpoint()
+            self.unbookRoom(bumped)
+            toBeBooked = self.findRoom(columns[config.iProcTime][procID],[(lab,labRooms)],day,1)
+            if toBeBooked is not None:
+                self.removeFromOverflow(procID)
+                self.bookRoom(procID,toBeBooked)
+                bumpedTo = self.findRoom(columns[config.iProcTime][bumped],[(otherLab,otherLabRooms)],day,1)
+                if bumpedTo is not None:
+                    self.bookRoom(bumped,bumpedTo)
+                    self.commit(marker)
+                    return True
+            self.rollback(marker)
+        return False
+
+
+
+    ####################################### LOCAL SEARCH #######################################
+    #################################### (MOVES AND SWAPS) #####################################
+
+    def improveSchedule(self,seconds,maxMoves=None):
+        '''
+        Improves the schedule left by packBins by local search, until the time budget is
+        spent or, if maxMoves is given, until that many moves have been tried. Each move
+        tried is one of:
+            insert - book a procedure in overflow in a room day that has time for it, or
+                     in one that has time once its last procedure is moved to another
+            move - move the last procedure of a room day to the end of another
+            swap - swap the last procedures of two room days
+        Procedures stay within the windows, labs and rooms tryPlaceProc may book them in
+        (see getPlacementWindow), and room days within the room time limits.
+        Only the last procedure of a room day is ever taken out, so no other procedure's
+        start time changes: a move is weighed from the loads of its room days and the
+        holding bay slots of the two to six stays it moves, however big the time period.
+        A move is kept if it leaves fewer procedures in overflow; or as many, and no more
+        crossovers under LabPreference; or as many of both, and a sum of the squares of
+        the holding bay occupancy no higher (it goes down as the peaks are flattened).
+
+        Input: seconds (time budget of the search, not used if maxMoves is given)
+                maxMoves (optional: number of moves to try instead, for a result that does
+                          not depend on the speed of the machine)
+        Returns: the number of moves kept
+        '''
+        occupancy = array.array('i',self.getHoldingBayMatrix())
+        windows = {}
+        deadline = time.time()+seconds
+        numTried = 0
+        numKept = 0
+        while maxMoves is None or numTried < maxMoves:
+            if maxMoves is None and numTried%64 == 0 and time.time() >= deadline:
+                break
+            numTried += 1
+            if self.overflowOrder and self.random.random() < 0.5:
+                procID = self.overflowOrder[self.random.randrange(len(self.overflowOrder))]
+                kept = self.tryInsertOverflow(procID,occupancy,windows)
+            elif self.procsPlacedData:
+                index = self.assignments[self.procsPlacedData[self.random.randrange(len(self.procsPlacedData))]]
+                if self.random.random() < 0.5:
+                    kept = self.tryMoveTail(index,occupancy,windows)
+                else:
+                    kept = self.trySwapTails(index,occupancy,windows)
+            else:
+                break
+            numKept += kept
+        # loads went down: the room queues are rebuilt if packing goes on
+        self.roomHeaps = {}
+        return numKept
+
+    def getPlacementWindow(self,procID):
+        '''
+        Input: procID (ID of a procedure)
+        Returns: (first day, number of days, list of (lab, number of rooms)) of the room
+                    days packBins may book the procedure in: its week or pair of weeks,
+                    its day or pair of days, or its day for emergencies, in the rooms
+                    tryPlaceProc may use (the other lab's included for flexible procedures
+                    under LabPreference)
+        '''
+        config = self.config
+        columns = self.procedures.columns
+        horizon = columns[config.iSchedHorizon][procID]
+        day = int(columns[config.iDay][procID])
+        if horizon == 3.0:
+            week = int(columns[config.iWeek][procID])
+            numDays = 5
+            if config.weekPairs:
+                week -= (week-1)%2              # the first week of its pair
+                numDays = 5 if week == self.numWeeks else 10
+            firstDay,restricted = (week-1)*5,config.restrictWeeks
+        elif horizon == 2.0:
+            numDays = 1
+            if config.dayPairs and day%5 in (2,4):
+                numDays = 2
+            elif config.dayPairs and day%5 in (3,0):
+                day,numDays = day-1,2
+            firstDay,restricted = day-1,config.restrictDays
+        else:
+            firstDay,numDays,restricted = day-1,1,config.restrictEmergencies
+        numDays = min(numDays,self.numDays-firstDay)
+
+        if columns[config.iRoom][procID] == 3.0:
+            return (firstDay,numDays,[(config.middleID,self.numMiddleRooms)])
+        originalLab = columns[config.iLab][procID]
+        otherLab = config.cathID if originalLab==config.epID else config.epID
+        if not restricted:
+            numRooms = {config.cathID:self.numCathRooms, config.epID:self.numEPRooms}
+        else:
+            numRooms = {config.cathID:self.numRestrictedCath, config.epID:self.numRestrictedEP}
+        labs = [(originalLab,numRooms[originalLab])]
+        flex = columns[config.iRoom][procID] == 2.0
+        if config.crossoverType == 'AllFlex' or (config.crossoverType == 'LabPreference' and flex):
+            labs.append((otherLab,numRooms[otherLab]))
+        return (firstDay,numDays,labs)
+
+    def pickWindowRoom(self,window):
+        '''
+        Input: window (as given by getPlacementWindow)
+        Returns: the index of a room day of the window drawn at random, or None if it has none
+        '''
+        firstDay,numDays,labs = window
+        k = self.random.randrange(sum(numRooms for lab,numRooms in labs)*numDays or 1)
+        for lab,numRooms in labs:
+            if k < numRooms*numDays:
+                return (firstDay+k/numRooms)*self.roomsPerDay + self.labOffsets[lab] + k%numRooms
+            k -= numRooms*numDays
+        return None
+
+    def isWindowRoom(self,window,index):
+        '''
+        Input: window (as given by getPlacementWindow), index (index of a room day)
+        Returns: True if the room day is one of the window's
+        '''
+        firstDay,numDays,labs = window
+        room = index%self.roomsPerDay
+        if not firstDay <= index/self.roomsPerDay < firstDay+numDays:
+            return False
+        return any(lab == self.roomLabs[room] and self.roomNumbers[room] < numRooms for lab,numRooms in labs)
+
+    def getLoadBeforeTail(self,index):
+        '''
+        Input: index (index of a room day with procedures booked)
+        Returns: the minutes booked in the room day before its last procedure, added up as
+                    booking them one by one does
+        '''
+        procTimes = self.procedures.columns[self.config.iProcTime]
+        load = 0.0
+        for procID in self.roomSequences[index][:-1]:
+            load += procTimes[procID]
+        return load
+
+    def getStayChanges(self,procID,index,startLoad,count):
+        '''
+        Input: procID (ID of a procedure)
+                index (index of the room day it is booked in)
+                startLoad (minutes booked in the room day before it starts)
+                count (1 to book it, -1 to take it out)
+        Returns: a list of (day, first slot, number of slots, count) of its holding bay
+                    stays, as updateHoldingBays adds them, or None if a stay falls outside
+                    of the holding bay's opening hours
+        '''
+        day = index/self.roomsPerDay
+        preFirstSlot,numPreSlots,postFirstSlot,numPostSlots = self.getHoldingBayStays(procID,self.labStartTime+startLoad/60.0)
+        changes = []
+        for firstSlot,numSlots in [(preFirstSlot,numPreSlots),(postFirstSlot,numPostSlots)]:
+            if numSlots <= 0:
+                continue
+            if firstSlot < 0 or firstSlot+numSlots > self.numSlots:
+                return None
+            changes.append((day,firstSlot,numSlots,count))
+        return changes
+
+    def getOccupancyDelta(self,occupancy,changes,apply=False):
+        '''
+        Input: occupancy (array of the holding bay occupancy, as given by getHoldingBayMatrix)
+                changes (list of stays, as given by getStayChanges)
+                apply (True to also make the changes to occupancy)
+        Returns: the change in the sum of the squares of the occupancy the changes make
+        '''
+        slotChanges = {}
+        for day,firstSlot,numSlots,count in changes:
+            start = day*self.numSlots+firstSlot
+            for i in xrange(start,start+numSlots):
+                slotChanges[i] = slotChanges.get(i,0)+count
+        delta = 0
+        for i,count in slotChanges.iteritems():
+            delta += count*(2*occupancy[i]+count)
+            if apply:
+                occupancy[i] += count
+        return delta
+
+    def getCrossoverDelta(self,moves):
+        '''
+        Input: moves (list of (procedure ID, room day index from, room day index to))
+        Returns: the change in the number of crossovers the moves make under LabPreference, 0
+                    under the other policies (which do not prefer the original lab)
+        '''
+        config = self.config
+        if config.crossoverType != 'LabPreference':
+            return 0
+        labs = self.procedures.columns[config.iLab]
+        delta = 0
+        for procID,fromIndex,toIndex in moves:
+            delta += (labs[procID] != self.roomLabs[toIndex%self.roomsPerDay]) - (labs[procID] != self.roomLabs[fromIndex%self.roomsPerDay])
+        return delta
+
+    def getWindow(self,procID,windows):
+        if procID not in windows:
+            windows[procID] = self.getPlacementWindow(procID)
+        return windows[procID]
+
+    def fitsInRoom(self,load,duration):
+        return load <= self.config.closeCap and load+duration <= self.config.totalTimeRoom
+
+    def tryInsertOverflow(self,procID,occupancy,windows):
+        '''
+        Tries to book a procedure in overflow in a room day of its window drawn at random,
+        moving the room day's last procedure to another room day of that procedure's window
+        if that makes time for it.
+        Input: procID (ID of a procedure in overflow)
+                occupancy, windows (holding bay occupancy and placement windows by procedure
+                                    ID, kept by improveSchedule)
+        Returns: True if the procedure was booked
+        '''
+        procTimes = self.procedures.columns[self.config.iProcTime]
+        duration = procTimes[procID]
+        index = self.pickWindowRoom(self.getWindow(procID,windows))
+        if index is None:
+            return False
+        load = self.roomLoads[index]
+        if self.fitsInRoom(load,duration):
+            changes = self.getStayChanges(procID,index,(load+duration)-duration,1)
+            if changes is None:
+                return False
+            self.removeFromOverflow(procID)
+            self.bookRoom(procID,index)
+            self.getOccupancyDelta(occupancy,changes,True)
+            return True
+
+        # make time by moving the room day's last procedure
+        sequence = self.roomSequences[index]
+        if not sequence:
+            return False
+        last = sequence[-1]
+        lastDuration = procTimes[last]
+        loadBefore = self.getLoadBeforeTail(index)
+        target = self.pickWindowRoom(self.getWindow(last,windows))
+        if target is None or target == index or not self.fitsInRoom(loadBefore,duration) or not self.fitsInRoom(self.roomLoads[target],lastDuration):
+            return False
+        stays = [self.getStayChanges(last,index,load-lastDuration,-1),
+                 self.getStayChanges(procID,index,(loadBefore+duration)-duration,1),
+                 self.getStayChanges(last,target,(self.roomLoads[target]+lastDuration)-lastDuration,1)]
+        if None in stays:
+            return False
+        self.popRoomTail(index)
+        self.removeFromOverflow(procID)
+        self.bookRoom(procID,index)
+        self.appendToRoom(last,target)
+        self.getOccupancyDelta(occupancy,sum(stays,[]),True)
+        return True
+
+    def tryMoveTail(self,index,occupancy,windows):
+        '''
+        Tries to move the last procedure of a room day to the end of a room day of its
+        window drawn at random.
+        Input: index (index of a room day with procedures booked)
+                occupancy, windows (as for tryInsertOverflow)
+        Returns: True if the move was kept
+        '''
+        procID = self.roomSequences[index][-1]
+        duration = self.procedures.columns[self.config.iProcTime][procID]
+        target = self.pickWindowRoom(self.getWindow(procID,windows))
+        if target is None or target == index or not self.fitsInRoom(self.roomLoads[target],duration):
+            return False
+        stays = [self.getStayChanges(procID,index,self.roomLoads[index]-duration,-1),
+                 self.getStayChanges(procID,target,(self.roomLoads[target]+duration)-duration,1)]
+        if None in stays:
+            return False
+        changes = sum(stays,[])
+        if (self.getCrossoverDelta([(procID,index,target)]),self.getOccupancyDelta(occupancy,changes)) > (0,0):
+            return False
+        self.popRoomTail(index)
+        self.appendToRoom(procID,target)
+        self.getOccupancyDelta(occupancy,changes,True)
+        return True
+
+    def trySwapTails(self,index,occupancy,windows):
+        '''
+        Tries to swap the last procedure of a room day with the last procedure of a room
+        day of its window drawn at random.
+        Input: index (index of a room day with procedures booked)
+                occupancy, windows (as for tryInsertOverflow)
+        Returns: True if the swap was kept
+        '''
+        procTimes = self.procedures.columns[self.config.iProcTime]
+        procID = self.roomSequences[index][-1]
+        target = self.pickWindowRoom(self.getWindow(procID,windows))
+        if target is None or target == index or not self.roomSequences[target]:
+            return False
+        other = self.roomSequences[target][-1]
+        if not self.isWindowRoom(self.getWindow(other,windows),index):
+            return False
+        duration,otherDuration = procTimes[procID],procTimes[other]
+        loadBefore,targetLoadBefore = self.getLoadBeforeTail(index),self.getLoadBeforeTail(target)
+        if not self.fitsInRoom(targetLoadBefore,duration) or not self.fitsInRoom(loadBefore,otherDuration):
+            return False
+        stays = [self.getStayChanges(procID,index,self.roomLoads[index]-duration,-1),
+                 self.getStayChanges(other,target,self.roomLoads[target]-otherDuration,-1),
+                 self.getStayChanges(procID,target,(targetLoadBefore+duration)-duration,1),
+                 self.getStayChanges(other,index,(loadBefore+otherDuration)-otherDuration,1)]
+        if None in stays:
+            return False
+        changes = sum(stays,[])
+        crossovers = self.getCrossoverDelta([(procID,index,target),(other,target,index)])
+        if (crossovers,self.getOccupancyDelta(occupancy,changes)) > (0,0):
+            return False
+        self.popRoomTail(index)
+        self.popRoomTail(target)
+        self.appendToRoom(procID,target)
+        self.appendToRoom(other,index)
+        self.getOccupancyDelta(occupancy,changes,True)
+        return True
+
 
     ##################################### DAY BY DAY PACKING #####################################
     ################################### EMERGENCIES/SAME DAYS ####################################
@@ -435,7 +1923,7 @@ class TimePeriod:
         (that couldn't be scheduled in that day).
         
         Input: day (integer day of time period to be scheduled, indexed from 0)
-                daysProcedures (a list of procedure data for a given day)
+                daysProcedures (a list of procedure ID's for a given day)
         Returns: none
         '''
 
@@ -443,89 +1931,17 @@ class TimePeriod:
         for proc in procs:
             self.tryPlaceProcInLabDay(proc,day,restricted,paired)
 
-    def tryPlaceProcInLabDay(self,procedure,day,restricted,paired):
+    def tryPlaceProcInLabDay(self,procID,day,restricted,paired):
         '''
         Tries to place a procedure in a given room, if there is time for it in the schedule.
-        Input: procedure (list of one procedure's data to be placed)
+        Input: procID (ID of the procedure to be placed)
                 lab (string name of lab to be scheduled into)
                 day (integer day of time period, indexed from 0)
         Returns: True if placed, False otherwise
         '''
 
-        procDomain = set()
-
-        ### STEP 0: screen for middle room procedures ###
-        if procedure[iRoom]==3.0:
-            for r in xrange(self.numMiddleRooms):
-                procDomain.add((day,middleID,r))
-                procDomain.add((day+1,middleID,r)) if paired else None
-            # constrain domain by room time limit
-            procDomain = self.eliminateRoomsByTimeLimit(procDomain,procedure)
-            # push to overflow: no room choices
-            if len(procDomain) == 0:
-                self.bins[1][day].append(procedure)
-                self.updateOverflowStats(procedure,day,day=True)
-            # schedule procedure: add the procedure to the room with the shortest amount of time already scheduled
-            else:
-                procDomainList = list(procDomain)
-                ascending = sorted(procDomainList, key=lambda x:self.sumProcTimes(self.bins[0][x]))
-                toBeBooked = ascending.pop(0)
-                roomToBeBooked = self.bins[0][toBeBooked]
-                roomToBeBooked.append(procedure)
-                self.updateProcsPlacedStats(procedure)
-                self.updateCrossoverStats(procedure,toBeBooked[1])
-                self.updateHoldingBays(procedure,toBeBooked[0],roomToBeBooked)
-            return
-        
-        ### STEP 1: get procedure information ###
-        originalLab = procedure[iLab]
-        otherLab = cathID if originalLab==epID else epID
-        if not restricted:
-            originalLabRooms = self.numCathRooms if originalLab==cathID  else self.numEPRooms
-            otherLabRooms = self.numCathRooms if originalLab==epID else self.numEPRooms
-        else:
-            originalLabRooms = self.numRestrictedCath if originalLab==cathID  else self.numRestrictedEP
-            otherLabRooms = self.numRestrictedCath if originalLab==epID else self.numRestrictedEP
-        flex = True if procedure[iRoom]==2.0 else False
-        duration = procedure[iProcTime]
-
-        ### STEP 2: establish initial domain (room choices) ###
-        # initial domain is the original lab's rooms for all crossover policies
-        for r in xrange(originalLabRooms):
-            procDomain.add((day,originalLab,r))
-            procDomain.add((day+1,originalLab,r)) if paired else None
-        # add other lab's rooms if all procedures can be flexed
-        if crossoverType == 'AllFlex':
-            for o in xrange(otherLabRooms):
-                procDomain.add((day,otherLab,o))
-                procDomain.add((day+1,otherLab,o)) if paired else None
-
-        ### STEP 3: constrain domain further ###
-        # eliminate rooms that are over the room time limit
-        procDomain = self.eliminateRoomsByTimeLimit(procDomain,procedure)
-
-        ### STEP 4: schedule procedure or push to overflow based on domain ###
-        # check to see if all room choices have been eliminated: try adding to other lab if possible
-        if len(procDomain) == 0 and crossoverType == 'LabPreference' and flex:
-            for o in xrange(otherLabRooms):
-                procDomain.add((day,otherLab,o))
-                procDomain.add((day+1,otherLab,o)) if paired else None
-            procDomain = self.eliminateRoomsByTimeLimit(procDomain,procedure)
-        # push to overflow: if there are still no room choices
-        if len(procDomain) == 0:
-            self.bins[1][day].append(procedure)
-            self.updateOverflowStats(procedure,day,day=True)
-        # schedule procedure: add the procedure to the room with the shortest amount of time already scheduled
-        else:
-            procDomainList = list(procDomain)
-            ascending = sorted(procDomainList, key=lambda x:self.sumProcTimes(self.bins[0][x]))
-            toBeBooked = ascending.pop(0)
-            roomToBeBooked = self.bins[0][toBeBooked]
-            roomToBeBooked.append(procedure)
-            self.updateProcsPlacedStats(procedure)
-            self.updateCrossoverStats(procedure,toBeBooked[1])
-            self.updateHoldingBays(procedure,toBeBooked[0],roomToBeBooked)
-                                
+        numDays = 2 if paired else 1
+        return self.tryPlaceProc(procID,day,numDays,restricted,day,day,True)
 
     ##################################### WEEK BY WEEK PACKING #####################################
     ################################### SAME WEEK PROCEDURES ONLY ##################################
@@ -536,7 +1952,7 @@ class TimePeriod:
         (that couldn't be scheduled in that week).
         
         Input: week (integer week of time period to be scheduled, indexed from 0)
-                weeksProcedures (a list of procedure data for a given week)
+                weeksProcedures (a list of procedure ID's for a given week)
                 restricted (a boolean value, denoting whether or not to restrict the scheduling to certain Cath/EP rooms
         Returns: none
         '''
@@ -546,331 +1962,979 @@ class TimePeriod:
             self.tryPlaceProcInLabWeek(proc,week,restricted,paired)
 
 
-    def tryPlaceProcInLabWeek(self,procedure,week,restricted,paired):
+    def tryPlaceProcInLabWeek(self,procID,week,restricted,paired):
         '''
         Tries to place a procedure in a given room, if there is time for it in the week's schedule.
-        Input: procedure (list of one procedure's data to be placed)
+        Input: procID (ID of the procedure to be placed)
                 lab (string name of lab to be scheduled into)
                 week (integer week of time period, indexed from 0)
         Returns: True if placed, False otherwise
         '''
 
-        procDomain = set()
         weekStart = week*5
+        numDays = 10 if paired else 5
+        return self.tryPlaceProc(procID,weekStart,numDays,restricted,weekStart,week,False)
+
+
+    ####################################### PLACEMENT FOR #######################################
+    ###################################### ANY TIME WINDOW ######################################
+
+    def tryPlaceProc(self,procID,firstDay,numDays,restricted,overflowDay,dayOrWeek,day):
+        '''
+        Tries to place a procedure in the least loaded room of a window of consecutive days,
+        pushing it to overflow if no room has time for it.
+        Input: procID (ID of the procedure to be placed)
+                firstDay (integer first day of the window, indexed from 0)
+                numDays (integer number of days in the window)
+                restricted (a boolean value, denoting whether or not to restrict the scheduling to certain Cath/EP rooms)
+                overflowDay (integer day whose overflow list the procedure goes to if not placed)
+                dayOrWeek (integer day or week recorded in the overflow statistics)
+                day (True if dayOrWeek is a day, False if it is a week)
+        Returns: True if placed, False otherwise
+        '''
+        config = self.config
+
+        columns = self.procedures.columns
+        duration = columns[config.iProcTime][procID]
 
         ### STEP 0: screen for middle room procedures ###
-        if procedure[iRoom]==3.0:
-            for day in xrange(weekStart,weekStart+5):
-                for r in xrange(self.numMiddleRooms):
-                    procDomain.add((day,middleID,r))
-                    procDomain.add((day+5,middleID,r)) if paired else None
-            # constrain domain by room time limit
-            procDomain = self.eliminateRoomsByTimeLimit(procDomain,procedure)
-            # push to overflow: no room choices
-            if len(procDomain) == 0:
-                self.bins[1][weekStart].append(procedure)
-                self.updateOverflowStats(procedure,week,day=False)
-            # schedule procedure: add the procedure to the room with the shortest amount of time already scheduled
-            else:
-                procDomainList = list(procDomain)
-                ascending = sorted(procDomainList, key=lambda x:self.sumProcTimes(self.bins[0][x]))
-                toBeBooked = ascending.pop(0)
-                roomToBeBooked = self.bins[0][toBeBooked]
-                roomToBeBooked.append(procedure)
-                self.updateProcsPlacedStats(procedure)
-                self.updateCrossoverStats(procedure,toBeBooked[1])
-                self.updateHoldingBays(procedure,toBeBooked[0],roomToBeBooked)
-            return
+        if columns[config.iRoom][procID]==3.0:
+            labs = [(config.middleID,self.numMiddleRooms)]
+            toBeBooked = self.findRoom(duration,labs,firstDay,numDays)
 
-        ### STEP 1: get procedure information ###
-        originalLab = procedure[iLab]
-        otherLab = cathID if originalLab==epID else epID
-        if not restricted:
-            originalLabRooms = self.numCathRooms if originalLab==cathID  else self.numEPRooms
-            otherLabRooms = self.numCathRooms if originalLab==epID else self.numEPRooms
         else:
-            originalLabRooms = self.numRestrictedCath if originalLab==cathID  else self.numRestrictedEP
-            otherLabRooms = self.numRestrictedCath if originalLab==epID else self.numRestrictedEP
-        flex = True if procedure[iRoom]==2.0 else False
-        duration = procedure[iProcTime]
-
-        ### STEP 2: establish initial domain (room choices) ###
-        # initial domain is the original lab's rooms for all crossover policies
-        for day in xrange(weekStart,weekStart+5):
-            for r in xrange(originalLabRooms):
-                procDomain.add((day,originalLab,r))
-                procDomain.add((day+5,originalLab,r)) if paired else None
-        # add other lab's rooms if all procedures can be flexed
-        if crossoverType == 'AllFlex':
-            for day in xrange(weekStart,weekStart+5):
-                for o in xrange(otherLabRooms):
-                    procDomain.add((day,otherLab,o))
-                    procDomain.add((day+5,otherLab,o)) if paired else None
-
-        ### STEP 3: constrain domain further ###
-        # eliminate rooms that are over the room time limit
-        procDomain = self.eliminateRoomsByTimeLimit(procDomain,procedure)
-
-        ### STEP 4: schedule procedure or push to overflow based on domain ###
-        # check to see if all room choices have been eliminated: try adding to other lab if possible
-        if len(procDomain) == 0 and crossoverType == 'LabPreference' and flex:
-            for day in xrange(weekStart,weekStart+5):
-                for o in xrange(otherLabRooms):
-                    procDomain.add((day,otherLab,o))
-                    procDomain.add((day+5,otherLab,o)) if paired else None
-            procDomain = self.eliminateRoomsByTimeLimit(procDomain,procedure)
-        # push to overflow: if there are still no room choices
-        if len(procDomain) == 0:
-            self.bins[1][weekStart].append(procedure)
-            self.updateOverflowStats(procedure,week,day=False)
+            ### STEP 1: get procedure information ###
+            originalLab = columns[config.iLab][procID]
+            otherLab = config.cathID if originalLab==config.epID else config.epID
+            if not restricted:
+                originalLabRooms = self.numCathRooms if originalLab==config.cathID  else self.numEPRooms
+                otherLabRooms = self.numCathRooms if originalLab==config.epID else self.numEPRooms
+            else:
+                originalLabRooms = self.numRestrictedCath if originalLab==config.cathID  else self.numRestrictedEP
+                otherLabRooms = self.numRestrictedCath if originalLab==config.epID else self.numRestrictedEP
+            flex = True if columns[config.iRoom][procID]==2.0 else False
+
+            ### STEP 2: establish domain (room choices) ###
+            # domain is the original lab's rooms for all crossover policies
+            labs = [(originalLab,originalLabRooms)]
+            # add other lab's rooms if all procedures can be flexed
+            if config.crossoverType == 'AllFlex':
+                labs.append((otherLab,otherLabRooms))
+
+            ### STEP 3: pick the least loaded room that is not over the room time limit ###
+            toBeBooked = self.findRoom(duration,labs,firstDay,numDays)
+            # check to see if all room choices have been eliminated: try adding to other lab if possible
+            if toBeBooked is None and config.crossoverType == 'LabPreference' and flex:
+                toBeBooked = self.findRoom(duration,[(otherLab,otherLabRooms)],firstDay,numDays)
+                labs.append((otherLab,otherLabRooms))
+
+        if self.profile is not None:
+            self.profile.recordAttempt(sum(numRooms for lab,numRooms in labs)*numDays,toBeBooked is not None)
+
+        ### STEP 4: schedule procedure or push to overflow ###
+        # push to overflow: no room choices
+        if toBeBooked is None:
+            self.addToOverflow(procID,overflowDay)
+            self.updateOverflowStats(procID,dayOrWeek,day)
+            return False
         # schedule procedure: add the procedure to the room with the shortest amount of time already scheduled
-        else:
-            procDomainList = list(procDomain)
-            ascending = sorted(procDomainList, key=lambda x:self.sumProcTimes(self.bins[0][x]))
-            toBeBooked = ascending.pop(0)
-            roomToBeBooked = self.bins[0][toBeBooked]
-            roomToBeBooked.append(procedure)
-            self.updateProcsPlacedStats(procedure)
-            self.updateCrossoverStats(procedure,toBeBooked[1])
-            self.updateHoldingBays(procedure,toBeBooked[0],roomToBeBooked)
+        self.bookRoom(procID,toBeBooked)
+        return True
                         
 
 
+# procedure data of the time period being packed, set in each worker process by initShardWorker
+shardContext = {}
+
+def initShardWorker(config,columns):
+    '''
+    Input: config (the SchedulerConfig of the time period), columns (the columns of its
+            ProcedureTable, after preparePacking)
+    Returns: none
+    '''
+    procedures = ProcedureTable(0)
+    procedures.columns = columns
+    shardContext['config'] = config
+    shardContext['procedures'] = procedures
+
+def packShard(shard):
+    '''
+    Packs one shard, or block of consecutive shards, of a time period. Run in the worker
+    processes of packShardsInParallel.
+
+    Input: shard (a (weeks, day buckets, week buckets) tuple: the (first, last) weeks of the
+                  shard, and the procedure ID's of its days and weeks, as given by preparePacking)
+    Returns: the shard's state, as given by TimePeriod.getShardState
+    '''
+    weeks,dayBuckets,weekBuckets = shard
+    timePeriod = TimePeriod(shardContext['config'])
+    timePeriod.registerProcedures(shardContext['procedures'])
+    marks = []
+    for name,method,buckets in [('sameWeeks',timePeriod.packSameWeeks,weekBuckets),
+                                ('sameDays',timePeriod.packSameDays,dayBuckets),
+                                ('emergencies',timePeriod.packEmergencies,dayBuckets)]:
+        timePeriod.runPass(name,method,buckets,weeks)
+        marks.append(dict((name,len(getattr(timePeriod,name))) for name in ['procsPlacedData','overflowOrder','overflowWeeks','overflowDays']))
+    return timePeriod.getShardState(weeks,marks)
+
+
+######################################################################################################
+######################################################################################################
+####################################### HOLDING BAY STATISTICS #######################################
+######################################################################################################
+######################################################################################################
+
+class HoldingBayQuantiles:
+    '''
+    Class to accumulate the distribution of the holding bay occupancy in each time slot of
+    the day, one day (or one whole time period) at a time.
+
+    Initialization:
+        HoldingBayQuantiles(numSlots)
+            numSlots - the number of time slots in a day
+
+    The occupancy is a whole number of patients, so the distribution of a slot is kept as a
+    count of the days seen with each occupancy. This takes memory in proportion to the
+    largest occupancy rather than to the number of days, so days and Monte Carlo
+    replications can be streamed in without keeping them, and the quantiles read back are
+    exactly those of all the values seen, interpolated as by R's quantile() (type 7).
+    Accumulators filled separately (e.g. in different processes) can be merged.
+    '''
+
+    statisticNames = ["Min","Quantile5","Quantile25","Quantile50","Quantile75","Quantile95","Max","Mean"]
+
+    def __init__(self,numSlots):
+        self.numSlots = numSlots
+        self.numDays = 0
+        self.counts = [[] for s in xrange(numSlots)]   # number of days seen with each occupancy, per slot
+        self.totals = [0]*numSlots                      # sum of the occupancies seen, per slot
+
+    def addDay(self,occupancy):
+        '''
+        Input: occupancy (number of patients in the holding bays in each time slot of one day)
+        Returns: none
+        '''
+        counts = self.counts
+        totals = self.totals
+        for s in xrange(self.numSlots):
+            value = occupancy[s]
+            slotCounts = counts[s]
+            if value >= len(slotCounts):
+                slotCounts.extend([0]*(value+1-len(slotCounts)))
+            slotCounts[value] += 1
+            totals[s] += value
+        self.numDays += 1
+
+    def addTimePeriod(self,timePeriod):
+        '''
+        Input: timePeriod (a packed TimePeriod with the same number of time slots)
+        Returns: none
+        '''
+        matrix = timePeriod.getHoldingBayMatrix()
+        numSlots = self.numSlots
+        for d in xrange(timePeriod.numDays):
+            self.addDay(matrix[d*numSlots:(d+1)*numSlots])
+
+    def merge(self,other):
+        '''
+        Input: other (a HoldingBayQuantiles with the same number of time slots)
+        Returns: none
+        '''
+        for s in xrange(self.numSlots):
+            slotCounts = self.counts[s]
+            otherCounts = other.counts[s]
+            if len(otherCounts) > len(slotCounts):
+                slotCounts.extend([0]*(len(otherCounts)-len(slotCounts)))
+            for value in xrange(len(otherCounts)):
+                slotCounts[value] += otherCounts[value]
+            self.totals[s] += other.totals[s]
+        self.numDays += other.numDays
+
+    def getValue(self,slot,k):
+        '''
+        Input: slot (time slot of the day), k (0 indexed rank)
+        Returns: the k-th smallest occupancy seen in the slot
+        '''
+        seen = 0
+        for value,count in enumerate(self.counts[slot]):
+            seen += count
+            if seen > k:
+                return value
+        raise IndexError(k)
+
+    def getQuantile(self,slot,p):
+        '''
+        Input: slot (time slot of the day), p (probability between 0 and 1)
+        Returns: the p quantile of the occupancies seen in the slot
+        '''
+        h = (self.numDays-1)*p
+        lo = int(math.floor(h))
+        low = self.getValue(slot,lo)
+        if h == lo:
+            return float(low)
+        return low + (h-lo)*(self.getValue(slot,lo+1)-low)
+
+    def getStatistics(self,slot):
+        '''
+        Input: slot (time slot of the day)
+        Returns: the values of statisticNames for the slot
+        '''
+        quantiles = [self.getQuantile(slot,p) for p in (0.05,0.25,0.5,0.75,0.95)]
+        return [self.getValue(slot,0)]+quantiles+[self.getValue(slot,self.numDays-1),float(self.totals[slot])/self.numDays]
+
+
+class HoldingBayTimeline:
+    '''
+    Class to hold the holding bay stays of a packed time period on a fine base grid, from
+    which the occupancy at any coarser resolution is rolled up.
+
+    Initialization:
+        HoldingBayTimeline(timePeriod,baseResolution=1.0)
+            timePeriod - a packed TimePeriod
+            baseResolution - length of the base grid's time slots, in minutes
+
+    The stays are rounded out to the base slots once, in a single pass over the room days,
+    and counted as arrivals (the first slot of a stay) and departures (the slot after its
+    last) per day and base slot. Stays of no time on a base slot boundary are counted as
+    instants at that boundary. A resolution that is a whole number of base slots is then
+    rolled up from these counts, with either of two meanings of a patient being in a slot:
+        anyOverlap - the patient is there at any time during the slot. Rounding out to the
+                     base slots and then to the coarse slots is the same as rounding out to
+                     the coarse slots, and an instant inside a coarse slot takes it up, so
+                     this is the occupancy the scheduler itself keeps (see
+                     getHoldingBayOccupancy) at that resolution, except for the odd stay
+                     ending within floating point error of a slot boundary, which can fall
+                     on either side of it depending on the resolution it is rounded at.
+        peakInBin - the most patients there at the same time during the slot (the largest
+                     base slot occupancy within it; instants take up no time and are left out)
+    '''
+
+    rollupMethods = ['anyOverlap','peakInBin']
+
+    def __init__(self,timePeriod,baseResolution=1.0):
+        self.baseResolution = baseResolution
+        self.numDays = timePeriod.numDays
+        self.HBCloseTime = timePeriod.config.HBCloseTime
+        slotsPerHour = 60.0/baseResolution
+        self.numBaseSlots = int(self.HBCloseTime*slotsPerHour)
+        rowLength = self.numBaseSlots+1
+        self.arrivals = array.array('i',[0])*(self.numDays*rowLength)
+        self.departures = array.array('i',[0])*(self.numDays*rowLength)
+        self.instants = array.array('i',[0])*(self.numDays*rowLength)
+        for day,firstSlot,numSlots in timePeriod.iterHoldingBayStays(slotsPerHour):
+            if numSlots <= 0:
+                if 0 <= firstSlot <= self.numBaseSlots:
+                    self.instants[day*rowLength+firstSlot] += 1
+                continue
+            # as in addHoldingBayStay
+            if firstSlot < 0:
+                raise KeyError((day,firstSlot/slotsPerHour))
+            if firstSlot+numSlots > self.numBaseSlots:
+                raise KeyError((day,self.numBaseSlots/slotsPerHour))
+            self.arrivals[day*rowLength+firstSlot] += 1
+            self.departures[day*rowLength+firstSlot+numSlots] += 1
+
+    def getSlotsPerBin(self,resolution):
+        '''
+        Input: resolution (length of the time slots to roll up to, in minutes)
+        Returns: the number of base slots in one of them
+        '''
+        slotsPerBin = int(round(resolution/self.baseResolution))
+        if slotsPerBin < 1 or abs(slotsPerBin*self.baseResolution-resolution) > 1e-9:
+            raise ValueError("resolution "+str(resolution)+" is not a multiple of the base resolution "+str(self.baseResolution))
+        return slotsPerBin
+
+    def getOccupancy(self,resolution,method='anyOverlap'):
+        '''
+        Input: resolution (length of the time slots, in minutes, a multiple of the base resolution)
+                method (one of rollupMethods)
+        Returns: (number of time slots per day, an array of the number of patients in the
+                    holding bays per day and time slot, indexed by day*numSlots + slot)
+        '''
+        if method not in self.rollupMethods:
+            raise ValueError("unknown rollup method: "+str(method))
+        slotsPerBin = self.getSlotsPerBin(resolution)
+        numSlots = int(self.HBCloseTime*60.0/resolution)
+        rowLength = self.numBaseSlots+1
+        occupancy = array.array('i',[0])*(self.numDays*numSlots)
+        for d in xrange(self.numDays):
+            rowStart = d*rowLength
+            count = 0               # base slot occupancy
+            for s in xrange(numSlots):
+                first = s*slotsPerBin
+                if method == 'anyOverlap':
+                    # there at the start of the slot, or arriving during it
+                    count += self.arrivals[rowStart+first] - self.departures[rowStart+first]
+                    value = count
+                    for i in xrange(rowStart+first+1,rowStart+min(first+slotsPerBin,self.numBaseSlots)):
+                        value += self.arrivals[i] + self.instants[i]
+                        count += self.arrivals[i] - self.departures[i]
+                else:
+                    value = 0
+                    for i in xrange(rowStart+first,rowStart+min(first+slotsPerBin,self.numBaseSlots)):
+                        count += self.arrivals[i] - self.departures[i]
+                        value = max(value,count)
+                occupancy[d*numSlots+s] = value
+        return (numSlots,occupancy)
+
+
 ######################################################################################################
 ######################################################################################################
 ##################################### READING/PROCESSING METHODS #####################################
 ######################################################################################################
 ######################################################################################################    
 
-def readData(fileName):
+def readData(fileName,config):
     '''
+    If config.useDataCache is set, the parsed columns are saved to a binary cache the first
+    time a file is read, and read back from the cache while the file's contents stay the same
+    (see getDataCacheName).
+    
     Input: fileName (string name of the file you want to process procedural data from
+            config (the SchedulerConfig giving the number of columns to read)
 
-    Returns: a list of lists, each one being one procedure's information stored as floats
+    Returns: a ProcedureTable, with one row of floats per procedure
     '''
-    procedures = []
+    if config.useDataCache:
+        cacheName = getDataCacheName(fileName,config.numEntries)
+        if os.path.exists(cacheName):
+            return readDataCache(cacheName,config.numEntries)
+
+    procedures = ProcedureTable(config.numEntries)
     with open(fileName, 'rU') as f:
         reader = csv.reader(f)
         for row in reader:
-            row = [float(i) for i in row[:numEntries+1]]
-            procedures.append(row)
-    
+            procedures.append([float(i) for i in row[:config.numEntries]])
+
+    if config.useDataCache:
+        saveDataCache(procedures,cacheName)
     return procedures
 
+##### binary cache of the data files #####
+# A cache file is a header (dataCacheHeader: magic, byte order, number of columns, number of
+# rows) followed by each column in turn as an array of doubles in that byte order.
+
+dataCacheHeader = struct.Struct('<4s1sii')
+dataCacheMagic = 'PTC1'
 
-def cleanProcTimes(allProcs):
+def getDataCacheName(fileName,numEntries):
     '''
-    Input: allProcs (list of all procedures as processed from csv)
-    
-    Returns: list of all procedures modified so that no procedure is
-                of length zero, and procedures of length greater than
-                totalTimeCath are truncated
+    Input: fileName (name of a data file), numEntries (number of columns read from it)
+    Returns: the name of the cache of the file, in a Cache folder next to it. The name
+                includes a hash of the file's contents and the number of columns, so
+                an edited file or a different column layout gets a cache of its own.
     '''
-    newProcs = allProcs[:]
+    with open(fileName,'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    folder,name = os.path.split(fileName)
+    return os.path.join(folder,'Cache',os.path.splitext(name)[0]+'.'+digest[:16]+'.'+str(numEntries)+'.bin')
 
-    for i in range (len(newProcs)):
-        procTime = newProcs[i][iProcTime]
-        procTime += turnover
-        if procTime > totalTimeRoom:
-          procTime = totalTimeRoom
-        newProcs[i][iProcTime] = procTime
-    return newProcs
+def saveDataCache(procedures,cacheName):
+    '''
+    Writes the cache under a temporary name first, so that processes reading the same file
+    at the same time never see a partly written cache.
+    Input: procedures (ProcedureTable as read from the data file), cacheName (name of the cache)
+    Returns: none
+    '''
+    folder = os.path.dirname(cacheName)
+    if folder and not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+    byteOrder = 'l' if sys.byteorder == 'little' else 'b'
+    temporaryName = cacheName+'.'+str(os.getpid())+'.tmp'
+    with open(temporaryName,'wb') as f:
+        f.write(dataCacheHeader.pack(dataCacheMagic,byteOrder,len(procedures.columns),len(procedures)))
+        for column in procedures.columns:
+            column.tofile(f)
+    os.rename(temporaryName,cacheName)
+
+def readDataCache(cacheName,numEntries):
+    '''
+    Reads each column of the cache into an array in one go rather than parsing the csv.
+    This only makes loading faster: every process still reads its own copy of the columns
+    (an array('d') cannot be backed by the file's pages), so no memory is shared.
+    Input: cacheName (name of the cache), numEntries (number of columns expected)
+    Returns: a ProcedureTable
+    '''
+    with open(cacheName,'rb') as f:
+        magic,byteOrder,numColumns,numRows = dataCacheHeader.unpack(f.read(dataCacheHeader.size))
+        if magic != dataCacheMagic or numColumns != numEntries:
+            raise ValueError("not a data cache for "+str(numEntries)+" columns: "+cacheName)
+        procedures = ProcedureTable(numColumns)
+        for column in procedures.columns:
+            column.fromfile(f,numRows)
+            if byteOrder != ('l' if sys.byteorder == 'little' else 'b'):
+                column.byteswap()
+    return procedures
 
 
-def getOptimizedTimeOnly(timePeriod):
+def cleanProcTimes(allProcs,config):
     '''
-    Based on a list of optimized scheduling, filter out irrelevant information and only
-    include the procedure times.
-    Input: optimized (a list, with each element corresponding to 1 day of scheduled procedures.
-                Each element itself is a list, consisting of a dictionary with Cath rooms
-                and their assigned procedures, a dictionary with EP rooms and their
-                assigned procedures, and a list of procedures that went over capacity.
-                This should be the output of packBins(procedures)
-    Returns: a copy of the same input list, but only including procedure times
+    Input: allProcs (ProcedureTable of all procedures as processed from csv)
+            config (the SchedulerConfig giving the turnover and room times)
+    
+    Returns: a view of the table in which the turnover is added to every procedure
+                time, and procedures of length greater than totalTimeRoom are truncated
     '''
-    days = timePeriod.numDays
-    optimized = timePeriod.bins
-    optimizedCopy = copy.deepcopy(optimized)
-    rooms = optimizedCopy[0]
-    overflow = optimizedCopy[1]
+    return applyTransforms(allProcs,[('procTimes',(config.iProcTime,config.turnover,config.totalTimeRoom))])
 
-    for d in xrange(days):
-        for c in xrange(numCathRooms):
-            daysProcs = rooms[(d,cathID,c)]
-            #print "Cath procs: "+str(day)
-            timesOnly = [round(x[iProcTime],2) for x in daysProcs]
-            rooms[(d,cathID,c)] = timesOnly
-        for e in xrange(numEPRooms):
-            daysProcs = rooms[(d,epID,e)]
-            #print "EP procs: "+str(day)
-            timesOnly = [round(x[iProcTime],2)  for x in daysProcs]
-            rooms[(d,epID,e)] = timesOnly
-        daysOverflow = overflow[d][:]
-        overflow[d] = [round(x[iProcTime],2) for x in daysOverflow]
-    return optimizedCopy
-
-def getOptimizedTimeAndIDOnly(timePeriod):
-    '''
-    Based on a list of optimized scheduling, filter out irrelevant information and only
-    include the procedure times and procedure ID.
-    Input: optimized (a list, with each element corresponding to 1 day of scheduled procedures.
-                Each element itself is a list, consisting of a dictionary with Cath rooms
-                and their assigned procedures, a dictionary with EP rooms and their
-                assigned procedures, and a list of procedures that went over capacity.
-                This should be the output of packBins(procedures)
-    Returns: a copy of the same input list, but only including procedure times and ID
-    '''
+##### preprocessing transforms #####
+# A transform stage is a (name, parameters) pair. Its function takes the table's columns and
+# the parameters and returns the columns it replaces, as new arrays, leaving the table as it is.
 
-    days = timePeriod.numDays
-    optimized = timePeriod.bins
-    optimizedCopy = copy.deepcopy(optimized)
-    rooms = optimizedCopy[0]
-    overflow = optimizedCopy[1]
+def transformProcTimes(columns,iProcTime,turnover,totalTimeRoom):
+    return {iProcTime: array.array('d',[min(procTime+turnover,totalTimeRoom) for procTime in columns[iProcTime]])}
 
-    for d in xrange(days):
-        for c in xrange(numCathRooms):
-            daysProcs = rooms[(d,cathID,c)]
-            #print "Cath procs: "+str(day)
-            timesOnly = [(x[ID],round(x[iProcTime],2) ) for x in daysProcs]
-            rooms[(d,cathID,c)] = timesOnly
-        for e in xrange(numEPRooms):
-            daysProcs = rooms[(d,epID,e)]
-            #print "EP procs: "+str(day)
-            timesOnly = [(x[ID],round(x[iProcTime],2) ) for x in daysProcs]
-            rooms[(d,epID,e)] = timesOnly
-        daysOverflow = overflow[d][:]
-        overflow[d] = [(x[ID],round(x[iProcTime],2) ) for x in daysOverflow]
-    return optimizedCopy
-
-
-def cleanResults(newOptimized,timePeriod):
-    '''
-    Input: optimizedTimeOnly (a list of the optimized procedure times. Should be output from
-            getOptimizedTimeOnly(optimized)
-    Returns: a copy of the same input list, but with all days equalized in terms of number of
-                procedures listed per room day and overflow procedures per day
+def transformEmergencyFlex(columns,iRoom,iSchedHorizon):
+    # emergencies can be done in either lab
+    return {iRoom: array.array('d',[2.0 if horizon==1.0 else room for room,horizon in zip(columns[iRoom],columns[iSchedHorizon])])}
+
+def transformSameDaysOnly(columns,iSchedHorizon):
+    # change all same week procedures to same day
+    return {iSchedHorizon: array.array('d',[2.0 if original==3.0 else original for original in columns[iSchedHorizon]])}
+
+def transformPreProcToHours(columns,iPreTime):
+    # Convert the pre procedure time to hours
+    return {iPreTime: array.array('d',[preTime/60 for preTime in columns[iPreTime]])}
+
+def transformCapPreProc(columns,iPreTime,cap):
+    # Cap the pre procedure time to be be no more than the cap (in hours)
+    return {iPreTime: array.array('d',[min(preTime,cap) for preTime in columns[iPreTime]])}
+
+procedureTransforms = {
+    'procTimes': transformProcTimes,
+    'emergencyFlex': transformEmergencyFlex,
+    'sameDaysOnly': transformSameDaysOnly,
+    'preProcToHours': transformPreProcToHours,
+    'capPreProc': transformCapPreProc,
+    }
+
+def getTransformStages(config):
     '''
-    days = timePeriod.numDays
-    optimizedCopy = newOptimized[:]
-    rooms = optimizedCopy[0]
-    overflow = optimizedCopy[1]
+    Input: config (SchedulerConfig of a run)
+    Returns: the list of transform stages packBins applies to the cleaned data under the
+                config's policies. Runs whose policies share the first few stages share
+                their results (see applyTransforms).
+    '''
+    stages = []
+    if config.emergencyFlex:
+        stages.append(('emergencyFlex',(config.iRoom,config.iSchedHorizon)))
+    if config.sameDaysOnly:
+        stages.append(('sameDaysOnly',(config.iSchedHorizon,)))
+    if config.ConvertPreProcToHours:
+        stages.append(('preProcToHours',(config.iPreTime,)))
+    if config.CapHBPreProc:
+        stages.append(('capPreProc',(config.iPreTime,config.HBPreProcCap)))
+    return stages
+
+def applyTransforms(procedures,stages):
+    '''
+    Applies transform stages in turn, each to a new view of the result of the stage before.
+    The result after each stage is cached on the original table, keyed by the stages up to
+    it, so that a later call whose stages start the same way picks up from there.
     
-    # get the OVERALL maximum number of procedures in Cath/EP/Overflow for the time period
-    maxNumProcsCathRoom = 0
-    maxNumProcsEPRoom = 0
-    maxNumOverflow = 0
-    for d in xrange(days):
-        for c in xrange(numCathRooms):
-            room = rooms[(d,cathID,c)]
-            maxNumProcsCathRoom = len(room) if len(room)>maxNumProcsCathRoom else maxNumProcsCathRoom
-        for e in xrange(numEPRooms):
-            room = rooms[(d,epID,e)]
-            maxNumProcsEPRoom = len(room) if len(room)>maxNumProcsEPRoom else maxNumProcsEPRoom
-            
-        maxNumOverflow = len(overflow[d]) if len(overflow[d])>maxNumOverflow else maxNumOverflow
- 
-    # add elements to each room day if necessary, so each room day has the same number of elements
-    for d in xrange(days):        
-        for c in xrange(numCathRooms):
-            room = rooms[(d,cathID,c)]
-            numDiffProcs = maxNumProcsCathRoom - len(room)
-            room += numDiffProcs*[0.00]
-        for e in xrange(numEPRooms):
-            room = rooms[(d,epID,e)]
-            numDiffProcs = maxNumProcsEPRoom - len(room)
-            room += numDiffProcs*[0.00]
-        overflowList = overflow[d]
-        numDiffProcs = maxNumOverflow - len(overflowList)
-        overflowList += numDiffProcs*[0.00]
-    return optimizedCopy
-
-
-def saveSchedulingResults(cleanOptimizedTimeOnly,timePeriod,workbook):
+    Input: procedures (ProcedureTable to transform; it is not modified)
+            stages (list of (transform name, parameters) pairs, see procedureTransforms)
+    Returns: the transformed ProcedureTable (procedures itself if there are no stages)
+    '''
+    table = procedures
+    for i in xrange(len(stages)):
+        key = tuple(stages[:i+1])
+        derived = procedures.derived.get(key)
+        if derived is None:
+            name,parameters = stages[i]
+            derived = table.withColumns(procedureTransforms[name](table.columns,*parameters))
+            procedures.derived[key] = derived
+        table = derived
+    return table
+
+
+def drawRandomInputs(numProcs,config,generator):
+    '''
+    Draws every random input of a run up front. The draws depend only on the generator and
+    the procedure ID's, not on the order the procedures are placed in, so giving the same
+    draws to runs under different policies (common random numbers) makes their results
+    differ only by the policies.
+    
+    Input: numProcs (number of procedures)
+            config (the SchedulerConfig saying which inputs are random)
+            generator (a random.Random to draw from)
+    Returns: a dictionary from column index to an array of that column's values per procedure ID
+    '''
+    randomInputs = {}
+    if config.postProcRandom:
+        # post procedure time from a distribution with a given mean/standard deviation
+        randomInputs[config.iPostTime] = array.array('d',[generator.gauss(config.desiredMean, config.desiredStDev) for i in xrange(numProcs)])
+    return randomInputs
+
+def getOverflowByDay(timePeriod):
+    '''
+    Input: timePeriod (a packed TimePeriod)
+    Returns: a list, per day, of the ID's of the procedures that went to overflow on that day,
+                in the order they were sent there
+    '''
+    overflow = [[] for d in xrange(timePeriod.numDays)]
+    for procID in timePeriod.overflowOrder:
+        overflow[timePeriod.overflowAssignments[procID]].append(procID)
+    return overflow
+
+def saveAssignmentResults(timePeriod,workbook):
+    '''
+    Writes the schedule in long format, in one pass over the schedule: a row per procedure
+    placed, in room day order, with where and when it is done and its holding bay stays,
+    then a row per procedure sent to overflow. Times are in hours of the day.
+    Input: timePeriod (a packed TimePeriod)
+            workbook (name of the csv to write to)
+    Returns: none
+    '''
+    config = timePeriod.config
+    columns = timePeriod.procedures.columns
+    procTimes = columns[config.iProcTime]
+    preTimes = columns[config.iPreTime]
+    postTimes = columns[config.iPostTime]
+    labNames = {config.cathID:'Cath', config.epID:'EP', config.middleID:'Middle'}
 
     out = open(workbook,'wb')
     writer = csv.writer(out)
+    writer.writerow(['ID','Day','Lab','Room','Sequence','ProcTime','Start','End',
+                     'PreHoldingStart','PreHoldingEnd','PostHoldingStart','PostHoldingEnd','Overflow'])
+    for index in xrange(len(timePeriod.roomSequences)):
+        sequence = timePeriod.roomSequences[index]
+        if not sequence:
+            continue
+        day,lab,room = timePeriod.getRoomKey(index)
+        startTimes = timePeriod.getRoomStartTimes(index)[0]
+        for position in xrange(len(sequence)):
+            procID = sequence[position]
+            start = startTimes[position]
+            end = start + procTimes[procID]/60.0
+            writer.writerow([procID,day+1,labNames[lab],room+1,position+1,round(procTimes[procID],2),
+                             round(start,4),round(end,4),round(start-preTimes[procID],4),round(start,4),
+                             round(end,4),round(end+postTimes[procID],4),0])
+    labs = columns[config.iLab]
+    overflow = getOverflowByDay(timePeriod)
+    for d in xrange(timePeriod.numDays):
+        for position in xrange(len(overflow[d])):
+            procID = overflow[d][position]
+            writer.writerow([procID,d+1,labNames.get(labs[procID],''),'',position+1,round(procTimes[procID],2),
+                             '','','','','','',1])
+    out.close()
 
-    maxNumCathProcs = len(cleanOptimizedTimeOnly[0][(0,cathID,0)])
-    maxNumEPProcs = len(cleanOptimizedTimeOnly[0][(0,epID,0)])
-
-    numCathColumns = numCathRooms*maxNumCathProcs
-    numEPColumns = numEPRooms*maxNumEPProcs
-    numOverflowColumns = len(cleanOptimizedTimeOnly[1][0])
+def saveSchedulingResults(timePeriod,workbook,includeID=False):
+    '''
+    Writes the schedule in wide format: a row per day, with a column per procedure slot of
+    every Cath and EP room and per overflow slot. Rooms with fewer procedures than the most
+    any room of their lab has on any day are filled out with 0.0.
+    Input: timePeriod (a packed TimePeriod)
+            workbook (name of the csv to write to)
+            includeID (True to write (ID, procedure time) in each cell, False for the procedure time only)
+    Returns: none
+    '''
+    config = timePeriod.config
+    procTimes = timePeriod.procedures.columns[config.iProcTime]
+    if includeID:
+        cell = lambda procID: str((procID,round(procTimes[procID],2)))
+    else:
+        cell = lambda procID: str(round(procTimes[procID],2))
+    padding = str(0.00)
 
     days = timePeriod.numDays
+    sequences = timePeriod.roomSequences
+    roomsPerDay = timePeriod.roomsPerDay
+    cathOffset = timePeriod.labOffsets[config.cathID]
+    epOffset = timePeriod.labOffsets[config.epID]
+    overflow = getOverflowByDay(timePeriod)
+
+    # the most procedures in any Cath/EP room day and overflow day over the time period
+    maxNumCathProcs = max(len(sequences[d*roomsPerDay+cathOffset+c]) for d in xrange(days) for c in xrange(config.numCathRooms))
+    maxNumEPProcs = max(len(sequences[d*roomsPerDay+epOffset+e]) for d in xrange(days) for e in xrange(config.numEPRooms))
+    numOverflowColumns = max(len(procIDs) for procIDs in overflow)
+
+    out = open(workbook,'wb')
+    writer = csv.writer(out)
 
     columns = ['Day']
-    for c in xrange(numCathRooms):
+    for c in xrange(config.numCathRooms):
         for i in xrange(maxNumCathProcs):
             columns.append('Cath Room '+str(c+1)+' Proc '+str(i+1))
-    for e in xrange(numEPRooms):
+    for e in xrange(config.numEPRooms):
         for j in xrange(maxNumEPProcs):
             columns.append('EP Room '+str(e+1)+' Proc '+str(j+1))
     for o in xrange(numOverflowColumns):
         columns.append('Overflow Proc '+str(o+1))
     writer.writerow(columns)
 
-    data = []
-    for d in xrange(1,days+1):
-        day = [str(d)]
+    for d in xrange(days):
+        day = [str(d+1)]
         # write room-procedure/overflow-procedure information
-        for cath in xrange(numCathRooms):
-            for proc in xrange(1,maxNumCathProcs+1):
-                day.append(str(cleanOptimizedTimeOnly[0][(d-1,cathID,cath)][proc-1]))
-        for ep in xrange(numEPRooms):
-            for proc in xrange(1,maxNumEPProcs+1):
-                day.append(str(cleanOptimizedTimeOnly[0][(d-1,epID,ep)][proc-1]))
-        for o in xrange(1,numOverflowColumns+1):
-            day.append(str(cleanOptimizedTimeOnly[1][d-1][o-1]))
-        data.append(day)
-    writer.writerows(data)
-
+        for c in xrange(config.numCathRooms):
+            sequence = sequences[d*roomsPerDay+cathOffset+c]
+            day.extend(cell(procID) for procID in sequence)
+            day.extend([padding]*(maxNumCathProcs-len(sequence)))
+        for e in xrange(config.numEPRooms):
+            sequence = sequences[d*roomsPerDay+epOffset+e]
+            day.extend(cell(procID) for procID in sequence)
+            day.extend([padding]*(maxNumEPProcs-len(sequence)))
+        day.extend(cell(procID) for procID in overflow[d])
+        day.extend([padding]*(numOverflowColumns-len(overflow[d])))
+        writer.writerow(day)
+    out.close()
+
+
+def getSlotLabels(resolution,HBCloseTime):
+    '''
+    Input: resolution (length of the holding bay time slots, in minutes), HBCloseTime
+    Returns: the "hours:minutes" start time of each time slot of the day
+    '''
+    multiple = 60.0/resolution
+    times = [i/multiple for i in xrange(int(HBCloseTime*multiple))]
+    labels = []
+    for time in times:
+        hours = math.floor(time)
+        minutes = (time - math.floor(time))*60
+        labels.append(str(int(hours))+":"+str(int(minutes)))
+    return labels
 
 def saveHoldingBayResults(timePeriod,workbook):
 
+    config = timePeriod.config
     out = open(workbook,'wb')
     writer = csv.writer(out)
 
-    multiple = 60.0/resolution
-    times = [i/multiple for i in xrange(int(HBCloseTime*multiple))]
-    columns = ["Day"]
-    for time in times:
-        hours = math.floor(time)
-        minutes = (time - math.floor(time))*60
-        columns.append(str(int(hours))+":"+str(int(minutes)))
+    columns = ["Day"] + getSlotLabels(config.resolution,config.HBCloseTime)
     writer.writerow(columns)
     
     data = []
     for d in xrange(timePeriod.numDays):
-        holdingBays = timePeriod.bins[2]
-        day = [holdingBays[(d,time)] for time in times]
+        day = timePeriod.getHoldingBayOccupancy(d)
         day.insert(0,str(d+1))
         data.append(day)
 
     writer.writerows(data)
 
+def saveHoldingBayRollups(timeline,rollups,workbook):
+    '''
+    Writes the occupancy at each of several resolutions, laid out as by saveHoldingBayResults,
+    one workbook per resolution and rollup method.
+    Input: timeline (a HoldingBayTimeline)
+            rollups (list of (resolution in minutes, rollup method) pairs)
+            workbook (name of a csv; each rollup is written to it with "_<resolution>min_<method>"
+                      added before the extension)
+    Returns: the list of workbooks written
+    '''
+    base,extension = os.path.splitext(workbook)
+    workbooks = []
+    for resolution,method in rollups:
+        numSlots,occupancy = timeline.getOccupancy(resolution,method)
+        rollupWorkbook = base+"_"+('%g' % resolution)+"min_"+method+extension
+        out = open(rollupWorkbook,'wb')
+        writer = csv.writer(out)
+        writer.writerow(["Day"] + getSlotLabels(resolution,timeline.HBCloseTime))
+        for d in xrange(timeline.numDays):
+            writer.writerow([str(d+1)] + occupancy[d*numSlots:(d+1)*numSlots].tolist())
+        out.close()
+        workbooks.append(rollupWorkbook)
+    return workbooks
+
+def saveHoldingBayQuantiles(quantiles,config,workbook):
+    '''
+    Input: quantiles (a HoldingBayQuantiles)
+            config (the SchedulerConfig giving the holding bay resolution)
+            workbook (name of the csv to write the statistics of each time slot to)
+    Returns: none
+    '''
+    out = open(workbook,'wb')
+    writer = csv.writer(out)
+    writer.writerow(["Time"]+HoldingBayQuantiles.statisticNames)
+    for s in xrange(quantiles.numSlots):
+        time = s*config.resolution/60.0
+        hours = math.floor(time)
+        minutes = (time - math.floor(time))*60
+        writer.writerow([str(int(hours))+":"+str(int(minutes))]+quantiles.getStatistics(s))
+    out.close()
+
+##### cache of scheduling results #####
+# A result file is a header (resultCacheHeader: magic, byte order, length of the description)
+# followed by a JSON description of the run's statistical counters and of the arrays that
+# follow it, and each array in turn in that byte order. Only the room assignments are kept
+# (see TimePeriod.getRoomState): the holding bays are recomputed from them when read, so runs
+# differing only in their holding bay settings share a result.
+
+resultCacheHeader = struct.Struct('<4s1si')
+resultCacheMagic = 'RSC2'
+# settings that do not change the result of a run, left out of its key
+resultCacheIgnored = ['useDataCache','packingProcesses','resultCache','resultCacheMegabytes','profile']
+# settings that only change the holding bays, not where procedures are placed: the pre
+# procedure times and the holding bay's slots are never looked at by the packing (but are
+# by the local search, see getRoomSettings)
+holdingBaySettings = ['resolution','HBCloseTime','ConvertPreProcToHours','CapHBPreProc','HBPreProcCap']
+
+def getRoomSettings(config):
+    '''
+    Input: config (SchedulerConfig of a run)
+    Returns: the names of the settings that can change where procedures are placed: all but
+                those in resultCacheIgnored and, unless the local search weighs the holding
+                bays (config.localSearchSeconds), those in holdingBaySettings. Of the local
+                search settings, only the one that bounds the search is kept: localSearchMoves
+                if it is given, else localSearchSeconds, and neither without a local search.
+    '''
+    if config.localSearchSeconds <= 0:
+        ignored = resultCacheIgnored+holdingBaySettings+['localSearchSeconds','localSearchMoves']
+    elif config.localSearchMoves is not None:
+        ignored = resultCacheIgnored+['localSearchSeconds']
+    else:
+        ignored = resultCacheIgnored
+    return [name for name in SchedulerConfig._fields if name not in ignored]
+
+def getResultCacheName(procedures,config,randomInputs=None):
+    '''
+    Input: procedures, config, randomInputs (as for runScheduler)
+    Returns: the name of the file the result of the run is cached in, in the config.resultCache
+                folder. The name is a hash of the procedure data, of the random draws if
+                given and of every setting that can change the room assignments.
+    '''
+    digest = hashlib.sha1(resultCacheMagic)
+    for column in procedures.columns:
+        digest.update(column.tostring())
+    for c in sorted(randomInputs or {}):
+        digest.update(str(c))
+        digest.update(randomInputs[c].tostring())
+    settings = [(name,getattr(config,name)) for name in getRoomSettings(config)]
+    digest.update(repr(settings))
+    return os.path.join(config.resultCache,digest.hexdigest()+'.bin')
+
+def saveResultCache(timePeriod,cacheName):
+    '''
+    Writes the result under a temporary name first, as saveDataCache does, then removes the
+    least recently used results until the folder is within config.resultCacheMegabytes.
+    Input: timePeriod (a packed TimePeriod), cacheName (as given by getResultCacheName)
+    Returns: none
+    '''
+    config = timePeriod.config
+    folder = os.path.dirname(cacheName)
+    if folder and not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+    state = timePeriod.getRoomState()
+    arrays = [(name,state[name]) for name in roomStateNames if isinstance(state[name],array.array)]
+    arrays.append(('sequenceLengths',array.array('i',[len(sequence) for sequence in state['roomSequences']])))
+    arrays.append(('sequences',array.array('i',[procID for sequence in state['roomSequences'] for procID in sequence])))
+    description = {
+        'counters':dict((name,state[name]) for name in roomStateNames if not isinstance(state[name],array.array)),
+        'overflowEntries':[[procID,dayOrWeek,day] for procID,(dayOrWeek,day) in state['overflowEntries'].iteritems()],
+        'overflowCounts':[[day,dayOrWeek,count] for (day,dayOrWeek),count in state['overflowCounts'].iteritems()],
+        'arrays':[[name,values.typecode,len(values)] for name,values in arrays],
+        }
+    description = json.dumps(description)
+    byteOrder = 'l' if sys.byteorder == 'little' else 'b'
+    temporaryName = cacheName+'.'+str(os.getpid())+'.tmp'
+    with open(temporaryName,'wb') as f:
+        f.write(resultCacheHeader.pack(resultCacheMagic,byteOrder,len(description)))
+        f.write(description)
+        for name,values in arrays:
+            values.tofile(f)
+    os.rename(temporaryName,cacheName)
+    trimResultCache(folder,config.resultCacheMegabytes*1024*1024,os.path.basename(cacheName))
+
+def trimResultCache(folder,maxBytes,keep=None):
+    '''
+    Removes the least recently used results (see readResultCache) until the results in the
+    folder take no more than maxBytes.
+    Input: folder (the result cache folder), maxBytes (the most the results may take, in bytes)
+            keep (optional: name of a result not to remove, e.g. the one just saved)
+    Returns: none
+    '''
+    entries = []
+    for name in os.listdir(folder):
+        if name.endswith('.bin'):
+            try:
+                info = os.stat(os.path.join(folder,name))
+            except OSError:             # removed by another process meanwhile
+                continue
+            entries.append((info.st_mtime,name,info.st_size))
+    total = sum(size for mtime,name,size in entries)
+    for mtime,name,size in sorted(entries):
+        if name == keep:
+            continue
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(os.path.join(folder,name))
+        except OSError:
+            pass
+        total -= size
+
+def readResultCache(cacheName,procedures,config,randomInputs=None):
+    '''
+    Rebuilds a packed TimePeriod from a cached result, with its holding bays recomputed under
+    config's holding bay settings, and marks the result as recently used.
+    Input: cacheName (as given by getResultCacheName)
+            procedures, config, randomInputs (as for runScheduler)
+    Returns: the TimePeriod, or None if the result is not in the cache
+    '''
+    try:
+        f = open(cacheName,'rb')
+    except IOError:
+        return None
+    with f:
+        contents = f.read()
+    magic,byteOrder,descriptionLength = resultCacheHeader.unpack_from(contents,0)
+    if magic != resultCacheMagic:
+        raise ValueError("not a result cache: "+cacheName)
+    offset = resultCacheHeader.size
+    description = json.loads(contents[offset:offset+descriptionLength])
+    offset += descriptionLength
+    arrays = {}
+    for name,typecode,length in description['arrays']:
+        values = array.array(str(typecode))
+        size = length*values.itemsize
+        values.fromstring(contents[offset:offset+size])
+        if byteOrder != ('l' if sys.byteorder == 'little' else 'b'):
+            values.byteswap()
+        arrays[name] = values
+        offset += size
+    try:
+        os.utime(cacheName,None)
+    except OSError:
+        pass
+
+    state = dict((str(name),value) for name,value in description['counters'].iteritems())
+    state.update(arrays)
+    sequences = arrays['sequences'].tolist()
+    state['roomSequences'] = []
+    start = 0
+    for length in arrays['sequenceLengths']:
+        state['roomSequences'].append(sequences[start:start+length])
+        start += length
+    state['overflowEntries'] = dict((procID,(dayOrWeek,day)) for procID,dayOrWeek,day in description['overflowEntries'])
+    state['overflowCounts'] = dict(((day,dayOrWeek),count) for day,dayOrWeek,count in description['overflowCounts'])
+
+    timePeriod = TimePeriod(config)
+    timePeriod.preparePacking(procedures,randomInputs)
+    timePeriod.setRoomState(state)
+    timePeriod.recomputeHoldingBays()
+    return timePeriod
+
+def reprojectHoldingBays(timePeriod,procedures,config):
+    '''
+    Gives the result of scheduling the same procedures under settings that differ from the
+    time period's only in the holding bay settings (holdingBaySettings), without packing
+    again: the room assignments are copied and the holding bays recomputed in one pass.
+    
+    Input: timePeriod (a packed TimePeriod)
+            procedures (the cleaned procedure data it was scheduled from, as for runScheduler)
+            config (the SchedulerConfig with the new holding bay settings)
+    Returns: a new TimePeriod
+    '''
+    names = set(getRoomSettings(timePeriod.config)+getRoomSettings(config))
+    changed = [name for name in SchedulerConfig._fields if name in names and getattr(config,name) != getattr(timePeriod.config,name)]
+    if changed:
+        raise ValueError("settings other than the holding bay's changed: "+", ".join(changed))
+    # the time period's random draws, so that random post procedure times stay the same
+    randomInputs = None
+    if config.postProcRandom:
+        randomInputs = {config.iPostTime: timePeriod.procedures.columns[config.iPostTime]}
+    projected = TimePeriod(config)
+    projected.preparePacking(procedures,randomInputs)
+    projected.setRoomState(timePeriod.getRoomState())
+    projected.recomputeHoldingBays()
+    return projected
+
+def runScheduler(procedures,config,randomInputs=None):
+    '''
+    Schedules a set of procedures under the given config, including the overflow recovery
+    if config.bumpFlexProcs is set and the local search if config.localSearchSeconds is.
+    If config.resultCache names a folder, the result is kept there, and read back instead
+    of scheduling again when the same procedures are scheduled under the same settings.
+    A local search with no config.localSearchMoves stops when its time budget is spent,
+    so its result depends on the speed of the machine: such runs are never cached, as the
+    cache would give one run's result for every later run with the same settings.
+    
+    Input: procedures (ProcedureTable of cleaned procedure data; packBins modifies some of its columns)
+            config (SchedulerConfig to schedule with)
+            randomInputs (optional: random draws to use, as given by drawRandomInputs)
+    Returns: the packed TimePeriod
+    '''
+    timeBudgeted = config.localSearchSeconds > 0 and config.localSearchMoves is None
+    useCache = config.resultCache is not None and not timeBudgeted
+    if useCache:
+        cacheName = getResultCacheName(procedures,config,randomInputs)
+        timePeriod = readResultCache(cacheName,procedures,config,randomInputs)
+        if timePeriod is not None:
+            return timePeriod
+
+    timePeriod = TimePeriod(config)
+    timePeriod.packBins(procedures,randomInputs)
+    if config.bumpFlexProcs:
+        timePeriod.runPass('recovery',timePeriod.recoverOverflow)
+    if config.localSearchSeconds > 0:
+        timePeriod.runPass('localSearch',timePeriod.improveSchedule,config.localSearchSeconds,config.localSearchMoves)
+
+    if useCache:
+        saveResultCache(timePeriod,cacheName)
+    return timePeriod
+
+def getOutputStatistics(timePeriod):
+    '''
+    Collects the figures reported by printOutputStatistics, for tabulating several runs.
+    
+    Input: timePeriod (a packed TimePeriod)
+    Returns: an OrderedDict from statistic name to value
+    '''
+    categories = ['EmergencyFlex','EmergencyInflex','SameDayFlex','SameDayInflex','SameWeekFlex','SameWeekInflex']
+    minutes = timePeriod.getProcsByMinuteVolume(xrange(len(timePeriod.procedures)))
+    minutesPlaced = timePeriod.getProcsByMinuteVolume(timePeriod.procsPlacedData)
+    
+    stats = collections.OrderedDict()
+    stats['totalProcs'] = timePeriod.numTotalProcs
+    stats['sameDays'] = timePeriod.numSameDays
+    stats['sameWeeks'] = timePeriod.numSameWeeks
+    stats['emergencies'] = timePeriod.numEmergencies
+    stats['procsPlaced'] = timePeriod.procsPlaced
+    stats['overflowProcs'] = timePeriod.overflowCath+timePeriod.overflowEP
+    stats['overflowCath'] = timePeriod.overflowCath
+    stats['overflowEP'] = timePeriod.overflowEP
+    stats['overflowWeeks'] = len(timePeriod.overflowWeeks)
+    stats['overflowDays'] = len(timePeriod.overflowDays)
+    for x in xrange(6):
+        stats['minutes'+categories[x]] = round(minutes[x],2)
+        stats['minutesPlaced'+categories[x]] = round(minutesPlaced[x],2)
+    stats['crossOverProcs'] = timePeriod.crossOverProcs
+    stats['cathToEP'] = timePeriod.cathToEP
+    stats['epToCath'] = timePeriod.epToCath
+    return stats
+
 def printOutputStatistics(timePeriod):
+    config = timePeriod.config
 
     print "*********PARAMETERS*********"
-    print "Cath rooms: "+str(numCathRooms)
-    print "EP rooms: "+str(numEPRooms)
-    print "Cath rooms used for non-emergencies: "+str(numRestrictedCath)
-    print "EP rooms used for non-emergencies: "+str(numRestrictedEP)
-    print "Crossover policy: "+str(crossoverType)
-    print "Pair weeks for scheduling? "+str(weekPairs)
-    print "Pair days for scheduling? "+str(dayPairs)
-    print "Schedule all procedures on same day as historically? "+str(sameDaysOnly)
-    print "Placement priority: "+str(priority)
-    print "Post procedure determination random? "+str(postProcRandom)
-    print "Pre procedure time converted to hours? "+str(ConvertPreProcToHours)
-    print "Pre procedure cap implemented? "+str(CapHBPreProc)+"\n"
+    print "Cath rooms: "+str(config.numCathRooms)
+    print "EP rooms: "+str(config.numEPRooms)
+    print "Cath rooms used for non-emergencies: "+str(config.numRestrictedCath)
+    print "EP rooms used for non-emergencies: "+str(config.numRestrictedEP)
+    print "Crossover policy: "+str(config.crossoverType)
+    print "Pair weeks for scheduling? "+str(config.weekPairs)
+    print "Pair days for scheduling? "+str(config.dayPairs)
+    print "Schedule all procedures on same day as historically? "+str(config.sameDaysOnly)
+    print "Placement priority: "+str(config.priority)
+    print "Bump flexible procedures to recover overflow? "+str(config.bumpFlexProcs)
+    print "Seconds of local search after packing: "+str(config.localSearchSeconds)
+    print "Post procedure determination random? "+str(config.postProcRandom)
+    print "Pre procedure time converted to hours? "+str(config.ConvertPreProcToHours)
+    print "Pre procedure cap implemented? "+str(config.CapHBPreProc)+"\n"
 
     print "*********PROCEDURE DATA*********"
     print "Total procedures: "+str(timePeriod.numTotalProcs)
     print "Same days: "+str(timePeriod.numSameDays)
     print "Same weeks: "+str(timePeriod.numSameWeeks)
     print "Emergencies: "+str(timePeriod.numEmergencies)
-    minutes = timePeriod.getProcsByMinuteVolume(procedures)
+    minutes = timePeriod.getProcsByMinuteVolume(xrange(len(timePeriod.procedures)))
     for x in xrange(6):
         minutes[x] = round(minutes[x],2)
     print "\tBREAKDOWN BY MINUTES"
@@ -918,6 +2982,44 @@ def printOutputStatistics(timePeriod):
 ##    print "type: 'util[day]' to view the full utilization breakdown by lab and room on a given day (indexed from 0)"
 ##        
 
+def getProfileReport(timePeriod):
+    '''
+    Input: timePeriod (a packed TimePeriod, scheduled with config.profile set)
+    Returns: an OrderedDict from pass name (and "total") to an OrderedDict of the pass's
+                counters (see PackingProfile), with the placements per second and the mean
+                candidate domain size worked out, or None if the run was not profiled
+    '''
+    profile = timePeriod.profile
+    if profile is None:
+        return None
+    total = dict.fromkeys(PackingProfile.counterNames,0)
+    report = collections.OrderedDict()
+    for name,counters in profile.passes.items()+[('total',total)]:
+        if name != 'total':
+            for counter in PackingProfile.counterNames:
+                if counter == 'domainMax':
+                    total[counter] = max(total[counter],counters[counter])
+                else:
+                    total[counter] += counters[counter]
+        entry = collections.OrderedDict((counter,counters[counter]) for counter in PackingProfile.counterNames)
+        entry['seconds'] = round(counters['seconds'],6)
+        entry['placementsPerSecond'] = round(counters['placements']/counters['seconds'],1) if counters['seconds'] > 0 else None
+        entry['domainMean'] = round(float(counters['domainTotal'])/counters['attempts'],2) if counters['attempts'] else None
+        report[name] = entry
+    return report
+
+def printProfileReport(timePeriod):
+    report = getProfileReport(timePeriod)
+    if report is None:
+        return
+    names = ['seconds','attempts','placements','placementsPerSecond','domainMean','domainMax',
+             'closedRooms','timeLimitRejections','holdingBayStays','holdingBaySlots']
+    print "*********PROFILE*********"
+    print "pass".ljust(12)+"".join(name.rjust(21) for name in names)
+    for passName,entry in report.items():
+        print passName.ljust(12)+"".join(str(entry[name]).rjust(21) for name in names)
+    print ""
+
 ######################################################################################################
 ######################################################################################################
 #################################### CONFIGURING/RUNNING THE SCRIPT ##################################
@@ -970,6 +3072,15 @@ if __name__ == "__main__":
     emergencyFlex = True
     #emergencyFlex = False
 
+    # UNCOMMENT the overflow recovery policy you want to implement
+    #bumpFlexProcs = True        # after packing, try to place overflow procedures by bumping flexible procedures into the other lab
+    bumpFlexProcs = False
+
+    # UNCOMMENT whether to improve the schedule by local search after packing, and for how many seconds
+    #localSearchSeconds = 10     # moves and swaps procedures between room days to cut overflow and holding bay peaks
+    localSearchSeconds = 0
+    localSearchMoves = None     # or the number of moves to try instead, for results that do not depend on the machine
+
 
     # Information for holding bays
     #UNCOMMENT the post procedure time policy you want to implement
@@ -977,6 +3088,7 @@ if __name__ == "__main__":
     postProcRandom = False      # will use the post procedure time specified in the input data
     #desiredMean = 3.0           # in hours
     #desiredStDev= 0.25          # in hours
+    seed = 30                   # seed for the random post procedure times
     #Set the number of hours in the day after which the holding bays should close:
     HBCloseTime = 30            #Default is 24
     
@@ -1046,37 +3158,64 @@ if __name__ == "__main__":
     ###### information regarding the name/location of the output data ######
     ########## which must be created before running this script ############
     
-    # please name the workbook to save the primary output to
+    # please name the workbook to save the primary output to (one row per procedure)
+    assignmentWorkbook = "OutputData/assignmentsV2.csv"
+
+    # UNCOMMENT whether to also save the schedule with one row per day (procedure times only, and with ID's)
+    #saveWideSchedules = True
+    saveWideSchedules = False
     mainWorkbook = "OutputData/scheduleV2.csv"
     detailedWorkbook = "OutputData/detailedScheduleV2.csv"
 
     # please name the workbook to save the holding bay output to
     holdingBayWorkbook = "OutputData/holdingBaysV2.csv"    
 
+    # UNCOMMENT the holding bay occupancy to also save at other resolutions, as (resolution in minutes,
+    # 'anyOverlap' or 'peakInBin'), rolled up from a base grid of holdingBayBaseResolution minutes
+    holdingBayRollups = []
+    #holdingBayRollups = [(5.0,'anyOverlap'),(15.0,'peakInBin'),(30.0,'anyOverlap'),(30.0,'peakInBin')]
+    holdingBayBaseResolution = 1.0
+
+    # please name the workbook to save the holding bay occupancy quantiles per time slot to
+    holdingBayQuantileWorkbook = "OutputData/holdingBayQuantilesV2.csv"
+
+    # number of processes to pack the weeks (or pairs of weeks) in side by side, None for one per core
+    packingProcesses = 1
+
+    # UNCOMMENT whether to keep the results of runs, to be read back when the same data is run with the same settings
+    #resultCache = "OutputData/ResultCache"
+    resultCache = None
+    resultCacheMegabytes = 512  # the least recently used results are removed past this size
+
+    # UNCOMMENT whether to count the work done in each pass of the packing and print it after the statistics
+    #profile = True
+    profile = False
+
 
     ############# RUNNING OF THE SCRIPT: not necessary to modify #############
 
+    ###### collect the settings above ######
+    config = makeConfig(**dict((name,value) for name,value in globals().items() if name in SchedulerConfig._fields))
+
     ###### read/process in data ######
-    procedures = readData(fileName)
-    procedures = cleanProcTimes(procedures)
+    procedures = readData(fileName,config)
+    procedures = cleanProcTimes(procedures,config)
     
     ###### model time period / pack bins ######
-    timePeriod = TimePeriod(daysInPeriod,numCathRooms,numEPRooms,numMiddleRooms,numRestrictedCath,numRestrictedEP,labStartTime)
-    timePeriod.packBins(procedures,crossoverType,weekPairs,dayPairs)
+    timePeriod = runScheduler(procedures,config)
 
     printOutputStatistics(timePeriod)
+    printProfileReport(timePeriod)
     
-    ###### process results ######
-    optimized = copy.deepcopy(timePeriod.bins)
-    
-    optimizedTimeOnly = getOptimizedTimeOnly(timePeriod)
-    cleanedOptimizedTime = cleanResults(optimizedTimeOnly,timePeriod)
-
-    optimizedTimeAndIDOnly = getOptimizedTimeAndIDOnly(timePeriod)
-    cleanedOptimizedTimeID = cleanResults(optimizedTimeAndIDOnly,timePeriod)
-
     ###### save results ######
     saveHoldingBayResults(timePeriod,holdingBayWorkbook)
-    saveSchedulingResults(cleanedOptimizedTime,timePeriod,mainWorkbook)
-    saveSchedulingResults(cleanedOptimizedTimeID,timePeriod,detailedWorkbook)
+    if holdingBayRollups:
+        saveHoldingBayRollups(HoldingBayTimeline(timePeriod,holdingBayBaseResolution),holdingBayRollups,holdingBayWorkbook)
+    holdingBayQuantiles = HoldingBayQuantiles(timePeriod.numSlots)
+    holdingBayQuantiles.addTimePeriod(timePeriod)
+    saveHoldingBayQuantiles(holdingBayQuantiles,config,holdingBayQuantileWorkbook)
+    saveAssignmentResults(timePeriod,assignmentWorkbook)
+    if saveWideSchedules:
+        saveSchedulingResults(timePeriod,mainWorkbook)
+        saveSchedulingResults(timePeriod,detailedWorkbook,includeID=True)
 
@@ -0,0 +1,185 @@
+"""
+This script runs the scheduler of Optimization_Version2.py over every combination of a set
+of scheduling policies and input data scenarios, and collects the statistics reported by
+printOutputStatistics for all of the runs into a single csv, one row per run.
+
+Notes about use:
+- The policies and scenarios to sweep over are defined at the bottom of this file, in the
+    __main__ function, in the same way as the settings of Optimization_Version2.py. Any
+    setting that is not swept takes its value from defaultSettings in Optimization_Version2.py.
+
+- The runs are spread over a pool of worker processes, one per core by default. Each worker
+    reads a scenario's data once and keeps it, with the preprocessed versions of it, for the
+    later runs on the same scenario.
+
+- With 'profile':True in the base settings, the time and work of each pass of the packing
+    (see getProfileReport in Optimization_Version2.py) are added to each run's row, to show
+    which policy combinations are slow.
+
+- With 'resultCache' set in the base settings, the result of every run is kept, and runs
+    already made (e.g. before a crash, or in an overlapping sweep) are read back instead of
+    scheduled again (see runScheduler in Optimization_Version2.py).
+"""
+import csv
+import glob
+import os
+import itertools
+import multiprocessing
+
+from Optimization_Version2 import makeConfig, readData, cleanProcTimes, runScheduler, getOutputStatistics, getProfileReport
+
+
+######################################################################################################
+######################################################################################################
+############################################## SWEEP RUNS ############################################
+######################################################################################################
+######################################################################################################
+
+# cleaned procedure data per (file name, data settings), kept by each worker process between runs
+cachedData = {}
+
+def getSweepRuns(fileNames,policies,baseSettings={}):
+    '''
+    Input: fileNames (list of data files to schedule)
+            policies (list of (setting name(s), list of values) pairs; a tuple of names sweeps
+                      several settings together, with a tuple of values for each choice)
+            baseSettings (dictionary of settings shared by all runs)
+    Returns: a list of (fileName, settings dictionary) pairs, one per combination of
+                scenario and policies, grouped by scenario
+    '''
+    choices = []
+    for names,values in policies:
+        if isinstance(names,tuple):
+            choices.append([zip(names,value) for value in values])
+        else:
+            choices.append([[(names,value)] for value in values])
+
+    runs = []
+    for fileName in fileNames:
+        for combination in itertools.product(*choices):
+            settings = dict(baseSettings)
+            for pairs in combination:
+                settings.update(pairs)
+            runs.append((fileName,settings))
+    return runs
+
+def getScenarioData(fileName,config):
+    '''
+    Input: fileName (name of the data file to schedule)
+            config (SchedulerConfig the data is to be read and cleaned with)
+    Returns: the cleaned procedure data, read from the file only the first time it is asked
+                for in this process. Runs do not modify it, and the transforms of runs with
+                similar policies are cached on it (see applyTransforms).
+    '''
+    key = (fileName,config.numEntries)
+    if key not in cachedData:
+        cachedData[key] = readData(fileName,config)
+    return cleanProcTimes(cachedData[key],config)
+
+def runSweepEntry(run):
+    '''
+    Schedules one scenario under one set of policies. Run in the worker processes.
+
+    Input: run (a (fileName, settings dictionary) pair from getSweepRuns)
+    Returns: an (fileName, settings, statistics) triple, the statistics as given by
+                getOutputStatistics, followed by the profile's counters if profiling is on
+    '''
+    fileName,settings = run
+    config = makeConfig(**settings)
+    timePeriod = runScheduler(getScenarioData(fileName,config),config)
+    stats = getOutputStatistics(timePeriod)
+    if config.profile:
+        for passName,counters in getProfileReport(timePeriod).items():
+            for counter,value in counters.items():
+                stats[passName+counter[0].upper()+counter[1:]] = value
+    return (fileName,settings,stats)
+
+def runSweep(runs,processes=None):
+    '''
+    Input: runs (list of (fileName, settings dictionary) pairs, as given by getSweepRuns)
+            processes (number of worker processes, None for one per core)
+    Returns: a list of (fileName, settings, statistics) triples in the same order as runs
+    '''
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunkSize = max(1,len(runs)//(4*(processes or multiprocessing.cpu_count())))
+        return pool.map(runSweepEntry,runs,chunkSize)
+    finally:
+        pool.close()
+        pool.join()
+
+def saveSweepResults(results,settingNames,workbook):
+    '''
+    Input: results (list of (fileName, settings, statistics) triples, as given by runSweep)
+            settingNames (list of the settings to give a column each)
+            workbook (name of the csv to write to)
+    Returns: none
+    '''
+    if not results:
+        return
+    # runs can have different passes profiled (e.g. recovery only when bumping), so take every name seen
+    statNames = []
+    for fileName,settings,stats in results:
+        statNames.extend(name for name in stats if name not in statNames)
+    with open(workbook,'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Scenario']+settingNames+statNames)
+        for fileName,settings,stats in results:
+            scenario = os.path.splitext(os.path.basename(fileName))[0]
+            writer.writerow([scenario]+[settings.get(name,'') for name in settingNames]+[stats.get(name,'') for name in statNames])
+
+
+######################################################################################################
+######################################################################################################
+#################################### CONFIGURING/RUNNING THE SCRIPT ##################################
+######################################################################################################
+######################################################################################################
+
+
+if __name__ == "__main__":
+
+    ############# VERIFY FOLLOWING VALUES BEFORE RUNNING ##############
+
+    # UNCOMMENT the working directory, or add a new one
+    #os.chdir("/Users/nicseo/Desktop/MIT/Junior/Fall/UROP/Scheduling Optimization/Script")
+    os.chdir("/Users/dscheink/Documents/MIT-MGH/EP_Cath/Git/mghSchedulingModel/")
+
+    # UNCOMMENT the data sets to sweep over, or add new ones
+    fileNames = sorted(glob.glob('InputData/Cath*EP*V2.csv'))
+    #fileNames = sorted(glob.glob('InputData/Cath*EP*.csv'))
+    #fileNames = ['InputData/CathFlatEPGrow2V2.csv','InputData/CathDrop1EPFlat.csv']
+
+    # the policies to sweep over, each with the values to try
+    policies = [
+        ('crossoverType', ["LabPreference","NoCrossovers","AllFlex"]),
+        ('weekPairs', [True,False]),
+        ('dayPairs', [True,False]),
+        ('sameDaysOnly', [True,False]),
+        ('emergencyFlex', [True,False]),
+        ('priority', ['longest','shortest','none','HBConstraints']),
+        (('numRestrictedCath','numRestrictedEP'), [(5,4),(4,3)]),
+        ]
+
+    # settings shared by all runs (see makeConfig in Optimization_Version2.py for the rest)
+    baseSettings = {}
+    #baseSettings = {'profile':True}
+    #baseSettings = {'resultCache':"OutputData/ResultCache"}     # reruns of the same runs are read back
+
+    # number of worker processes, None for one per core
+    processes = None
+
+    # please name the workbook to save the sweep results to
+    sweepWorkbook = "OutputData/policySweepV2.csv"
+
+
+    ############# RUNNING OF THE SCRIPT: not necessary to modify #############
+
+    runs = getSweepRuns(fileNames,policies,baseSettings)
+    print "Running "+str(len(runs))+" scenario/policy combinations"
+    results = runSweep(runs,processes)
+
+    settingNames = []
+    for names,values in policies:
+        settingNames.extend(names if isinstance(names,tuple) else [names])
+    saveSweepResults(results,settingNames,sweepWorkbook)
+    print "Saved sweep results to "+sweepWorkbook
@@ -0,0 +1,279 @@
+"""
+This script generates synthetic procedure data in the format of the InputData files (day, week,
+lab, procedure time, scheduling horizon, room constraint, pre procedure time, post procedure
+time, procedure type, provider), modeled on an existing data file, to see how the scheduler
+behaves at volumes and time spans beyond those of the data we have.
+
+Notes about use:
+- Two ways of generating are available:
+    resample - every generated day copies procedures, drawn with replacement, from a random
+               day of the data on the same weekday
+    parametric - the number of procedures on a day is drawn from a Poisson distribution with
+               the data's mean for that weekday, the lab, scheduling horizon, room constraint,
+               procedure type and provider from their joint frequencies in the data, and the
+               procedure, pre and post procedure times from a lognormal distribution fitted
+               to the data's times in each lab (with the data's share of zero times)
+  In both, the number of procedures is multiplied by the volume, which grows by the annual
+  growth rate over the time span (250 weekdays a year).
+
+- The procedures are generated one day at a time, as they are asked for, so they can be
+    streamed straight into a ProcedureTable (see ProcedureTable.extend) without writing them
+    to a csv first. They can also be saved to a csv like the InputData files.
+
+- The settings of the run at the generated scale (the number of days, and as many times the
+    rooms as the room scale) are given by getWorkloadSettings.
+"""
+import csv
+import os
+import math
+import random
+import collections
+
+from Optimization_Version2 import makeConfig, readData, cleanProcTimes, runScheduler, printOutputStatistics, ProcedureTable
+
+
+######################################################################################################
+######################################################################################################
+########################################### WORKLOAD MODELS ##########################################
+######################################################################################################
+######################################################################################################
+
+daysPerYear = 250.0
+
+def samplePoisson(generator,mean):
+    '''
+    Input: generator (a random.Random), mean (mean of the distribution)
+    Returns: a number drawn from a Poisson distribution with the given mean
+    '''
+    if mean > 30:
+        # normal approximation, for speed with large means
+        return max(0,int(round(generator.gauss(mean,math.sqrt(mean)))))
+    limit = math.exp(-mean)
+    count = 0
+    product = generator.random()
+    while product > limit:
+        count += 1
+        product *= generator.random()
+    return count
+
+def fitTimeDistribution(values):
+    '''
+    Input: values (list of non-negative times)
+    Returns: (share of zeros, mean of the log of the positive times, standard deviation of it,
+                longest time)
+    '''
+    positive = [math.log(v) for v in values if v > 0]
+    if not positive:
+        return (1.0,0.0,0.0,0.0)
+    mean = sum(positive)/len(positive)
+    variance = sum((v-mean)**2 for v in positive)/len(positive)
+    return (1.0-float(len(positive))/len(values),mean,math.sqrt(variance),max(values))
+
+def sampleTime(generator,distribution):
+    '''
+    Input: generator (a random.Random), distribution (as given by fitTimeDistribution)
+    Returns: a time drawn from the distribution, no longer than the longest time in the data
+                (the tail of the lognormal would otherwise give stays past the holding bay's hours)
+    '''
+    zeroShare,mean,deviation,longest = distribution
+    if generator.random() < zeroShare:
+        return 0.0
+    return min(generator.lognormvariate(mean,deviation),longest)
+
+class WorkloadModel:
+    '''
+    Class to hold what the generators need to know about a data file.
+
+    Initialization:
+        WorkloadModel(procedures,config)
+            procedures - a ProcedureTable of the data to model, as read by readData
+            config - the SchedulerConfig giving the data's columns and number of days
+
+    Fields:
+        daysByWeekday - the days of the data on each weekday (0 for Monday)
+        dayProcedures - the procedure ID's of each day of the data
+        meanPerWeekday - the mean number of procedures per day on each weekday
+        categories, categoryWeights - the (lab, scheduling horizon, room constraint,
+                        procedure type, provider) combinations in the data, with their counts
+        timeDistributions - the fitted (procedure, pre, post) time distributions of each lab
+    '''
+
+    def __init__(self,procedures,config):
+        self.procedures = procedures
+        self.config = config
+        columns = procedures.columns
+
+        self.dayProcedures = collections.defaultdict(list)
+        for procID in xrange(len(procedures)):
+            self.dayProcedures[int(columns[config.iDay][procID])].append(procID)
+        self.daysByWeekday = [[d for d in xrange(1,config.daysInPeriod+1) if (d-1)%5 == weekday] for weekday in xrange(5)]
+        self.meanPerWeekday = [float(sum(len(self.dayProcedures[d]) for d in days))/len(days) for days in self.daysByWeekday]
+
+        categoryColumns = [config.iLab,config.iSchedHorizon,config.iRoom,config.iProcType,config.iProvider]
+        counts = collections.Counter(zip(*[columns[c] for c in categoryColumns]))
+        self.categoryColumns = categoryColumns
+        self.categories = sorted(counts)
+        self.categoryWeights = [counts[category] for category in self.categories]
+
+        self.timeDistributions = {}
+        for lab in set(columns[config.iLab]):
+            procIDs = [procID for procID in xrange(len(procedures)) if columns[config.iLab][procID] == lab]
+            self.timeDistributions[lab] = [fitTimeDistribution([columns[c][procID] for procID in procIDs])
+                                           for c in (config.iProcTime,config.iPreTime,config.iPostTime)]
+
+    def getVolume(self,day,volume,annualGrowth):
+        '''
+        Input: day (day of the generated data, indexed from 1), volume (multiplier of the
+                number of procedures at the start), annualGrowth (growth rate per year)
+        Returns: the multiplier of the number of procedures on that day
+        '''
+        return volume*(1.0+annualGrowth)**((day-1)/daysPerYear)
+
+
+######################################################################################################
+######################################################################################################
+############################################# GENERATION #############################################
+######################################################################################################
+######################################################################################################
+
+def resampleProcedures(model,numDays,volume=1.0,annualGrowth=0.0,seed=0):
+    '''
+    Input: model (a WorkloadModel)
+            numDays (number of days to generate)
+            volume (multiplier of the number of procedures at the start)
+            annualGrowth (growth rate of the number of procedures per year)
+            seed (seed of the random draws)
+    Returns: a generator of procedures, each a list of floats in the data file's column order
+    '''
+    config = model.config
+    columns = model.procedures.columns
+    generator = random.Random(seed)
+    for d in xrange(1,numDays+1):
+        sourceDay = generator.choice(model.daysByWeekday[(d-1)%5])
+        sourceProcs = model.dayProcedures[sourceDay]
+        if not sourceProcs:
+            continue
+        expected = len(sourceProcs)*model.getVolume(d,volume,annualGrowth)
+        count = int(expected) + (1 if generator.random() < expected-int(expected) else 0)
+        for i in xrange(count):
+            procID = generator.choice(sourceProcs)
+            row = [column[procID] for column in columns]
+            row[config.iDay] = float(d)
+            row[config.iWeek] = float((d-1)//5+1)
+            yield row
+
+def sampleProcedures(model,numDays,volume=1.0,annualGrowth=0.0,seed=0):
+    '''
+    Input: as for resampleProcedures
+    Returns: a generator of procedures, each a list of floats in the data file's column order
+    '''
+    config = model.config
+    generator = random.Random(seed)
+    totalWeight = float(sum(model.categoryWeights))
+    cumulative = []
+    running = 0
+    for weight in model.categoryWeights:
+        running += weight
+        cumulative.append(running/totalWeight)
+    for d in xrange(1,numDays+1):
+        count = samplePoisson(generator,model.meanPerWeekday[(d-1)%5]*model.getVolume(d,volume,annualGrowth))
+        for i in xrange(count):
+            # bisect for the category whose cumulative share first exceeds the draw
+            u = generator.random()
+            lo,hi = 0,len(cumulative)-1
+            while lo < hi:
+                mid = (lo+hi)//2
+                if cumulative[mid] <= u:
+                    lo = mid+1
+                else:
+                    hi = mid
+            category = model.categories[lo]
+
+            row = [0.0]*config.numEntries
+            for c,value in zip(model.categoryColumns,category):
+                row[c] = value
+            procTime,preTime,postTime = [sampleTime(generator,distribution) for distribution in model.timeDistributions[row[config.iLab]]]
+            row[config.iDay] = float(d)
+            row[config.iWeek] = float((d-1)//5+1)
+            row[config.iProcTime] = procTime
+            row[config.iPreTime] = preTime
+            row[config.iPostTime] = postTime
+            yield row
+
+workloadGenerators = {'resample':resampleProcedures, 'parametric':sampleProcedures}
+
+def getWorkloadSettings(settings,numDays,roomScale=1):
+    '''
+    Input: settings (dictionary of the settings of the run at the data's scale)
+            numDays (number of days generated)
+            roomScale (multiplier of the number of rooms)
+    Returns: the settings of the run for the generated data
+    '''
+    config = makeConfig(**settings)
+    scaled = dict(settings)
+    for name in ['numCathRooms','numEPRooms','numMiddleRooms','numRestrictedCath','numRestrictedEP']:
+        scaled[name] = int(math.ceil(getattr(config,name)*roomScale))
+    scaled['daysInPeriod'] = numDays
+    return scaled
+
+def saveWorkload(rows,workbook):
+    '''
+    Input: rows (iterable of procedures, as given by the generators)
+            workbook (name of the csv to write to)
+    Returns: none
+    '''
+    out = open(workbook,'wb')
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow([repr(value) for value in row])
+    out.close()
+
+
+######################################################################################################
+######################################################################################################
+#################################### CONFIGURING/RUNNING THE SCRIPT ##################################
+######################################################################################################
+######################################################################################################
+
+
+if __name__ == "__main__":
+
+    ############# VERIFY FOLLOWING VALUES BEFORE RUNNING ##############
+
+    # UNCOMMENT the working directory, or add a new one
+    #os.chdir("/Users/nicseo/Desktop/MIT/Junior/Fall/UROP/Scheduling Optimization/Script")
+    os.chdir("/Users/dscheink/Documents/MIT-MGH/EP_Cath/Git/mghSchedulingModel/")
+
+    # UNCOMMENT the data set to model, or add a new one
+    fileName = 'InputData/CathFlatEPGrow2V2.csv'
+
+    # UNCOMMENT the way of generating the data
+    method = 'resample'
+    #method = 'parametric'
+
+    volume = 10.0               # multiplier of the number of procedures at the start
+    annualGrowth = 0.0          # growth rate of the number of procedures per year (0.05 = 5%)
+    numDays = 1250              # number of days to generate (250 per year)
+    roomScale = 10              # multiplier of the number of rooms
+    seed = 30
+
+    # settings of the run at the data's scale (see makeConfig in Optimization_Version2.py for the rest)
+    settings = {}
+
+    # please name the workbook to save the generated data to, or None to only schedule it
+    workloadWorkbook = None
+    #workloadWorkbook = "InputData/Synthetic.csv"
+
+
+    ############# RUNNING OF THE SCRIPT: not necessary to modify #############
+
+    config = makeConfig(**settings)
+    model = WorkloadModel(readData(fileName,config),config)
+    rows = workloadGenerators[method](model,numDays,volume,annualGrowth,seed)
+    if workloadWorkbook is not None:
+        saveWorkload(rows,workloadWorkbook)
+    else:
+        workloadConfig = makeConfig(**getWorkloadSettings(settings,numDays,roomScale))
+        procedures = ProcedureTable(workloadConfig.numEntries)
+        procedures.extend(rows)
+        printOutputStatistics(runScheduler(cleanProcTimes(procedures,workloadConfig),workloadConfig))